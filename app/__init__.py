@@ -1,11 +1,44 @@
+import sqlalchemy as sa
 from flask import Flask, url_for
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 import config
 
 db = SQLAlchemy()
-migrate = Migrate()
+
+
+def _set_mmap_size(size):
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.execute(f"PRAGMA mmap_size = {size:d}")
+    return connect
+
+
+def _check_schema(app, revision: str) -> None:
+    """
+    Compare the schema revision of the database with the one of the models, a
+        single query at startup.
+    """
+    with db.engine.connect() as connection:
+        try:
+            found = connection.exec_driver_sql(
+                "SELECT version_num FROM alembic_version").scalar()
+        except sa.exc.DBAPIError:
+            if not sa.inspect(connection).has_table("corpus"):
+                # rows of the legacy schema aren't in any corpus until migrated
+                raise RuntimeError(
+                    "the database predates the corpus registry, migrate it by starting "
+                    "the ingestion service or local_parse.py, or with `alembic upgrade "
+                    "head` in ingestion/, its play is moved into the corpus 'default'")
+            app.logger.warning("the database schema isn't versioned, start the "
+                               "ingestion service or local_parse.py to migrate it")
+            return
+    if found != revision:
+        raise RuntimeError(
+            f"the database schema is at revision {found}, the webapp needs {revision}. "
+            f"Migrate an older database by starting the ingestion service or "
+            f"local_parse.py, or with `alembic upgrade head` in ingestion/. If the "
+            f"migrations don't know {found} either, the database was migrated by a "
+            f"newer release, run the webapp of that release.")
 
 
 def create_app():
@@ -14,14 +47,32 @@ def create_app():
 
     #ORM
     db.init_app(app)
-    migrate.init_app(app, db)
-    from . import models
+    from . import models, corpus, memory, instrumentation, guard, suggest
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            sa.event.listen(db.engine, "connect",
+                            _set_mmap_size(app.config["SQLITE_MMAP_SIZE"]))
+        _check_schema(app, models.SCHEMA_REVISION)
+    guard.init_app(app)
+    # its timer starts after the cost estimate of the guard
+    instrumentation.init_app(app)
+    corpus.init_app(app)
+    memory.init_app(app)
+    suggest.init_app(app)
 
     #blueprint
-    from .views import main_views, query_views, result_views
+    from .views import (main_views, query_views, result_views, cql_views, api_views,
+                        search_views, suggest_views)
     app.register_blueprint(main_views.bp)
     app.register_blueprint(query_views.bp)
     app.register_blueprint(result_views.bp)
+    app.register_blueprint(cql_views.bp)
+    app.register_blueprint(api_views.bp)
+    app.register_blueprint(search_views.bp)
+    app.register_blueprint(suggest_views.bp)
+    if app.config.get("DEBUG_STATS"):
+        from .views import debug_views
+        app.register_blueprint(debug_views.bp)
     
     return app
 
@@ -2,7 +2,6 @@ import os
 
 from dotenv import load_dotenv
 from flask import Flask
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 from .views import main_views, query_views, result_views
@@ -18,7 +17,6 @@ DB_NAME = os.getenv("TT_DB_NAME")
 
 if __name__ == '__main__':
     db = SQLAlchemy()
-    migrate = Migrate()
 
     app = Flask(__name__)
     app.config.from_object({
@@ -29,7 +27,6 @@ if __name__ == '__main__':
 
     # ORM
     db.init_app(app)
-    migrate.init_app(app, db)
 
     # blueprint
     app.register_blueprint(main_views.bp)
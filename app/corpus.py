@@ -0,0 +1,124 @@
+"""
+This module contains the scoping of requests to a single corpus.
+
+    The corpus is picked by the `corpus` request parameter (id or name), the CORPUS
+    config value or else the newest registered corpus. All ORM selects of the request
+    are restricted to it, which lets mariadb prune every query to the corpus partition.
+    On sqlite the corpus file is attached to the request connection and unqualified
+    tables are translated to it, so the registry in the main database file has to be
+    read through its own connection.
+"""
+import os
+from typing import List, Optional
+
+import sqlalchemy as sa
+from flask import abort, current_app, g, request
+from sqlalchemy.orm import with_loader_criteria
+
+from app import db
+from app.models import Corpus, CorpusMixin
+
+# blueprints searching several corpora on their own (see app/shards.py)
+UNSCOPED_BLUEPRINTS = {"search"}
+# blueprints only reading a corpus to build a cached index (see app/suggest.py), the
+#  corpus is resolved but the session is scoped by the view if it builds the index
+LAZY_BLUEPRINTS = {"suggest"}
+
+
+def find_corpora() -> List:
+    """
+    Get the registered corpora, newest first, without corpora still loading.
+    """
+    query = sa.select(Corpus.__table__).where(Corpus.created_at.isnot(None)) \
+        .order_by(Corpus.created_at.desc())
+    with db.engine.connect() as connection:
+        return connection.execute(query).fetchall()
+
+
+def resolve_corpus(key: Optional[str]):
+    """
+    Find a corpus by id or name, the newest one of that name wins.
+
+    Args:
+        key: corpus id or name, the newest corpus if None
+
+    Returns:
+        corpus registry row or None if there is no such corpus
+    """
+    for corpus in find_corpora():
+        if key is None or key in (corpus.id, corpus.name):
+            return corpus
+    return None
+
+
+def corpus_path(corpus) -> str:
+    """
+    Get the path of a sqlite corpus file from its registry row.
+    """
+    return os.path.join(os.path.dirname(db.engine.url.database), corpus.location)
+
+
+def corpus_criteria(corpus_id: str):
+    """
+    Get the loader option restricting all corpus tables of a select to one corpus.
+    """
+    return with_loader_criteria(CorpusMixin, lambda cls: cls.corpus_id == corpus_id,
+                                include_aliases=True, propagate_to_loaders=False)
+
+
+def scope_session(corpus) -> None:
+    """
+    Bind the session to the storage of a corpus and restrict its selects to it.
+        Has to be called before the session is used.
+
+    Args:
+        corpus: corpus registry row
+    """
+    g.corpus = corpus
+    # corpora without location are stored in the main database (e.g. snapshots)
+    if db.engine.dialect.name == "sqlite" and corpus.location:
+        schema_name = f"corpus_{corpus.id}"
+        connection = db.session.connection(
+            execution_options={"schema_translate_map": {None: schema_name}})
+        if schema_name not in connection.info:
+            connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema_name}",
+                                       (corpus_path(corpus),))
+            connection.info[schema_name] = True
+
+
+def _scope_request():
+    if request.blueprint in UNSCOPED_BLUEPRINTS:
+        return
+    key = request.args.get("corpus") or current_app.config.get("CORPUS")
+    # requests answered by the in memory store don't touch the database
+    store = current_app.extensions.get("corpus_store")
+    if store is not None and store.serves(request.blueprint, key):
+        g.corpus = store.corpus
+        return
+    corpus = resolve_corpus(key)
+    if corpus is None:
+        if key is not None:
+            abort(404)
+        g.corpus = None
+        return
+    if request.blueprint in LAZY_BLUEPRINTS:
+        g.corpus = corpus
+        return
+    scope_session(corpus)
+
+
+def _restrict_to_corpus(execute_state):
+    corpus = g.get("corpus")
+    if corpus is None or not execute_state.is_select or execute_state.is_column_load:
+        return
+    # relationship loads get their own criteria, criteria propagated from the parent
+    #  query are cached with the corpus of the first request
+    execute_state.statement = execute_state.statement.options(corpus_criteria(corpus.id))
+
+
+def init_app(app) -> None:
+    """
+    Register the corpus scoping with the app, has to be called after db.init_app.
+    """
+    app.before_request(_scope_request)
+    sa.event.listen(db.session, "do_orm_execute", _restrict_to_corpus)
@@ -0,0 +1,485 @@
+"""
+This module contains a small query engine for structured token patterns in the style
+    of the CQP corpus query language, e.g.
+
+        [lemma="love"] [ana="#n.*"]{0,2} [lemma="lady"]
+
+    A query is a sequence of token specifications in brackets, each optionally
+    followed by a quantifier (?, *, +, {n}, {n,} or {n,m}). Inside the brackets
+    attribute tests `attr="regex"` or `attr!="regex"` on word, lemma or ana can be
+    combined with &, |, ! and parentheses, `[]` matches any token and a bare
+    "regex" is short for [word="regex"]. Values are matched as complete regular
+    expressions like in CQP.
+
+    The query is compiled into a nondeterministic automaton which is run over the
+    token stream of every speech in document order (by position), matches never
+    cross speech boundaries.
+    Literal word and lemma tests on mandatory tokens are looked up in the trigram
+    index beforehand, so only speeches containing all of them are streamed.
+"""
+import re
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Callable, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Line, Speech, Token, TokenForm, token_form_association_table
+
+# attributes which can be tested in a token specification and their token columns
+ATTRIBUTES = {"word": "content", "lemma": "lemma", "ana": "ana"}
+# largest bounded repetition of a single token specification
+MAX_REPETITION = 50
+# number of speeches streamed from the database at once
+SPEECH_BATCH_SIZE = 200
+
+_TOKEN_PATTERN = re.compile(
+    r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<number>\d+)|(?P<name>[A-Za-z_]+)'
+    r'|(?P<op>!=|[=&|!()\[\]{}?*+,]))'
+)
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+# a token of the stream as (id, word, lemma, ana, line_id, position)
+StreamToken = Tuple[str, str, str, str, str, int]
+Predicate = Callable[[StreamToken], bool]
+
+
+class CqlSyntaxError(ValueError):
+    """
+    Raised for queries which can't be parsed.
+    """
+
+
+@dataclass
+class Test:
+    """
+    Attribute test of a token specification.
+    """
+    attribute: str
+    value: str
+    negated: bool = False
+
+    @property
+    def literal(self) -> Optional[str]:
+        """
+        The tested value if it contains no regex syntax, None otherwise.
+        """
+        if self.negated or _REGEX_META.intersection(self.value):
+            return None
+        return self.value
+
+
+@dataclass
+class Element:
+    """
+    Token specification of a query with its quantifier.
+    """
+    predicate: Predicate
+    anchors: List[Tuple[str, str]]
+    min_count: int = 1
+    max_count: Optional[int] = 1
+
+
+@dataclass
+class Automaton:
+    """
+    Thompson automaton compiled from a query.
+    """
+    transitions: List[List[Tuple[Predicate, int]]] = field(default_factory=list)
+    epsilon: List[List[int]] = field(default_factory=list)
+    start: int = 0
+    accept: int = 0
+    closures: List[FrozenSet[int]] = field(default_factory=list)
+
+    def add_state(self) -> int:
+        self.transitions.append([])
+        self.epsilon.append([])
+        return len(self.transitions) - 1
+
+    def close(self):
+        """
+        Precompute the epsilon closure of every state.
+        """
+        self.closures = []
+        for state in range(len(self.transitions)):
+            closure, stack = {state}, [state]
+            while stack:
+                for target in self.epsilon[stack.pop()]:
+                    if target not in closure:
+                        closure.add(target)
+                        stack.append(target)
+            self.closures.append(frozenset(closure))
+
+    def match(self, tokens: List[StreamToken], start: int) -> Optional[int]:
+        """
+        Run the automaton from the token at index start.
+
+        Returns:
+            end index of the longest non-empty match or None if there is none
+        """
+        states: Set[int] = set(self.closures[self.start])
+        end = None
+        for position in range(start, len(tokens)):
+            token = tokens[position]
+            next_states = set()
+            for state in states:
+                for predicate, target in self.transitions[state]:
+                    if predicate(token):
+                        next_states.update(self.closures[target])
+            if not next_states:
+                break
+            states = next_states
+            if self.accept in states:
+                end = position + 1
+        return end
+
+
+class CqlQuery:
+    """
+    Class parsing a query and compiling it into an automaton.
+    """
+
+    def __init__(self, query: str):
+        """
+        Args:
+            query: query string
+
+        Raises:
+            CqlSyntaxError: if the query can't be parsed
+        """
+        self.query = query
+        self._tokens = self._tokenize(query)
+        self._position = 0
+        self.elements = self._parse_query()
+        self.automaton = self._compile()
+
+    @property
+    def anchors(self) -> List[Tuple[str, str]]:
+        """
+        Literal (kind, form) tests every match has to contain.
+        """
+        return [anchor for element in self.elements if element.min_count > 0
+                for anchor in element.anchors]
+
+    ###
+    # parse query
+    @staticmethod
+    def _tokenize(query: str) -> List[Tuple[str, str]]:
+        tokens, position = [], 0
+        query = query.rstrip()
+        while position < len(query):
+            match = _TOKEN_PATTERN.match(query, position)
+            if not match:
+                raise CqlSyntaxError(f"unexpected character at {position}: "
+                                     f"{query[position]!r}")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        return tokens
+
+    def _peek(self) -> Optional[str]:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position][1]
+        return None
+
+    def _next(self, kind: str = None, value: str = None) -> str:
+        if self._position >= len(self._tokens):
+            raise CqlSyntaxError("unexpected end of query")
+        token_kind, token_value = self._tokens[self._position]
+        if (kind and token_kind != kind) or (value and token_value != value):
+            raise CqlSyntaxError(f"expected {value or kind} but found {token_value!r}")
+        self._position += 1
+        return token_value
+
+    def _parse_query(self) -> List[Element]:
+        elements = []
+        while self._peek() is not None:
+            elements.append(self._parse_element())
+        if not elements:
+            raise CqlSyntaxError("empty query")
+        if all(element.min_count == 0 for element in elements):
+            raise CqlSyntaxError("query has to match at least one token")
+        return elements
+
+    def _parse_element(self) -> Element:
+        if self._peek() == "[":
+            self._next(value="[")
+            if self._peek() == "]":
+                predicate, anchors = (lambda token: True), []
+            else:
+                predicate, anchors = self._parse_or()
+            self._next(value="]")
+        else:
+            test = Test("word", self._parse_string())
+            predicate, anchors = self._compile_test(test)
+        element = Element(predicate, anchors)
+        self._parse_quantifier(element)
+        return element
+
+    def _parse_quantifier(self, element: Element):
+        quantifier = self._peek()
+        if quantifier in ("?", "*", "+"):
+            self._next()
+            element.min_count, element.max_count = {
+                "?": (0, 1), "*": (0, None), "+": (1, None)}[quantifier]
+        elif quantifier == "{":
+            self._next()
+            element.min_count = element.max_count = int(self._next(kind="number"))
+            if self._peek() == ",":
+                self._next()
+                element.max_count = None
+                if self._peek() != "}":
+                    element.max_count = int(self._next(kind="number"))
+            self._next(value="}")
+            if element.max_count is not None and element.max_count < element.min_count:
+                raise CqlSyntaxError("invalid repetition range")
+        if max(element.min_count, element.max_count or 0) > MAX_REPETITION:
+            raise CqlSyntaxError(f"repetitions are limited to {MAX_REPETITION}")
+
+    def _parse_or(self) -> Tuple[Predicate, List[Tuple[str, str]]]:
+        alternatives = [self._parse_and()]
+        while self._peek() == "|":
+            self._next()
+            alternatives.append(self._parse_and())
+        if len(alternatives) == 1:
+            return alternatives[0]
+        predicates = [predicate for predicate, _ in alternatives]
+        return (lambda token: any(predicate(token) for predicate in predicates)), []
+
+    def _parse_and(self) -> Tuple[Predicate, List[Tuple[str, str]]]:
+        conjuncts = [self._parse_unary()]
+        while self._peek() == "&":
+            self._next()
+            conjuncts.append(self._parse_unary())
+        if len(conjuncts) == 1:
+            return conjuncts[0]
+        predicates = [predicate for predicate, _ in conjuncts]
+        anchors = [anchor for _, conjunct_anchors in conjuncts
+                   for anchor in conjunct_anchors]
+        return (lambda token: all(predicate(token) for predicate in predicates)), anchors
+
+    def _parse_unary(self) -> Tuple[Predicate, List[Tuple[str, str]]]:
+        if self._peek() == "!":
+            self._next()
+            predicate, _ = self._parse_unary()
+            return (lambda token: not predicate(token)), []
+        if self._peek() == "(":
+            self._next()
+            result = self._parse_or()
+            self._next(value=")")
+            return result
+        attribute = self._next(kind="name")
+        if attribute not in ATTRIBUTES:
+            raise CqlSyntaxError(f"unknown attribute {attribute!r}, "
+                                 f"use one of {', '.join(ATTRIBUTES)}")
+        operator = self._next(kind="op")
+        if operator not in ("=", "!="):
+            raise CqlSyntaxError(f"expected = or != but found {operator!r}")
+        return self._compile_test(Test(attribute, self._parse_string(), operator == "!="))
+
+    def _parse_string(self) -> str:
+        value = self._next(kind="string")[1:-1]
+        return re.sub(r'\\(["\\])', r"\1", value)
+
+    @staticmethod
+    def _compile_test(test: Test) -> Tuple[Predicate, List[Tuple[str, str]]]:
+        try:
+            pattern = re.compile(test.value)
+        except re.error as error:
+            raise CqlSyntaxError(f"invalid regular expression {test.value!r}: {error}")
+        index = 1 + list(ATTRIBUTES).index(test.attribute)
+        if test.negated:
+            predicate = lambda token: pattern.fullmatch(token[index] or "") is None
+        else:
+            predicate = lambda token: pattern.fullmatch(token[index] or "") is not None
+        anchors = []
+        if test.literal is not None and test.attribute in ("word", "lemma"):
+            anchors.append((ATTRIBUTES[test.attribute], test.literal.strip().lower()))
+        return predicate, anchors
+
+    ###
+    # compile query
+    def _compile(self) -> Automaton:
+        automaton = Automaton()
+        automaton.start = current = automaton.add_state()
+        for element in self.elements:
+            for _ in range(element.min_count):
+                current = self._add_step(automaton, current, element.predicate)
+            if element.max_count is None:
+                loop = automaton.add_state()
+                automaton.epsilon[current].append(loop)
+                automaton.transitions[loop].append((element.predicate, loop))
+                current = loop
+            else:
+                optional_end = automaton.add_state()
+                for _ in range(element.max_count - element.min_count):
+                    automaton.epsilon[current].append(optional_end)
+                    current = self._add_step(automaton, current, element.predicate)
+                automaton.epsilon[current].append(optional_end)
+                current = optional_end
+        automaton.accept = current
+        automaton.close()
+        return automaton
+
+    @staticmethod
+    def _add_step(automaton: Automaton, state: int, predicate: Predicate) -> int:
+        target = automaton.add_state()
+        automaton.transitions[state].append((predicate, target))
+        return target
+
+
+@dataclass
+class CqlMatch:
+    """
+    Match of a query with the context it was found in.
+    """
+    speech_id: str
+    speech_position: int
+    speaker: str
+    tokens: List[StreamToken]
+    lines: Dict[str, List[StreamToken]]
+
+    @property
+    def cursor(self) -> str:
+        """
+        Opaque position of the match to continue a paginated search after it.
+        """
+        return f"{self.speech_position}:{self.tokens[0][5]}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "speech_id": self.speech_id,
+            "speech_position": self.speech_position,
+            "speaker": self.speaker,
+            "tokens": [{"id": token[0], "word": token[1], "lemma": token[2],
+                        "ana": token[3], "line_id": token[4], "position": token[5]}
+                       for token in self.tokens],
+            "lines": [{"id": line_id, "text": " ".join(token[1] for token in tokens)}
+                      for line_id, tokens in self.lines.items()],
+        }
+
+
+def parse_cursor(cursor: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Get the speech and token position of the match a cursor points at.
+
+    Raises:
+        CqlSyntaxError: for cursors not returned by CqlMatch.cursor
+    """
+    if not cursor:
+        return None, None
+    speech_position, _, token_position = cursor.partition(":")
+    try:
+        return int(speech_position), int(token_position)
+    except ValueError:
+        raise CqlSyntaxError(f"invalid cursor {cursor!r}") from None
+
+
+def candidate_speeches(anchors: List[Tuple[str, str]], session: Session
+                       ) -> Optional[Set[Tuple[int, str]]]:
+    """
+    Look up the speeches containing all anchor forms in the trigram index postings.
+
+    Returns:
+        set of (speech position, speech id) or None if there are no anchors to prune
+        with
+    """
+    speeches = None
+    for kind, form in anchors:
+        query = session.query(Speech.position, Speech.id) \
+            .join(Line, sa.and_(Line.corpus_id == Speech.corpus_id,
+                                Line.speech_id == Speech.id)) \
+            .join(Token, sa.and_(Token.corpus_id == Line.corpus_id, Token.line_id == Line.id)) \
+            .join(token_form_association_table,
+                  sa.and_(token_form_association_table.c.corpus_id == Token.corpus_id,
+                          token_form_association_table.c.token_id == Token.id)) \
+            .join(TokenForm,
+                  sa.and_(TokenForm.corpus_id == token_form_association_table.c.corpus_id,
+                          TokenForm.id == token_form_association_table.c.form_id)) \
+            .filter(TokenForm.kind == kind, TokenForm.form == form) \
+            .distinct()
+        found = {(position, speech_id) for position, speech_id in query}
+        speeches = found if speeches is None else speeches & found
+        if not speeches:
+            break
+    return speeches
+
+
+def _stream_speeches(speech_ids: Optional[List[str]], after: Optional[int],
+                     session: Session
+                     ) -> Iterator[Tuple[Tuple[str, str, int], List[StreamToken]]]:
+    """
+    Stream the tokens of the given speeches, or of all speeches if None, in document
+        order grouped by (speech id, speaker, speech position). The given speeches
+        have to be ordered by position.
+    """
+    columns = (Token.id, Token.content, Token.lemma, Token.ana, Token.line_id,
+               Token.position, Speech.id, Speech.cast_item_id, Speech.position)
+    order = (Speech.position, Token.position)
+    base = session.query(*columns) \
+        .join(Line, sa.and_(Line.corpus_id == Token.corpus_id, Line.id == Token.line_id)) \
+        .join(Speech, sa.and_(Speech.corpus_id == Line.corpus_id, Speech.id == Line.speech_id))
+    if after is not None:
+        base = base.filter(Speech.position >= after)
+
+    if speech_ids is None:
+        batches = [base.order_by(*order).yield_per(1000)]
+    else:
+        batches = (base.filter(Speech.id.in_(speech_ids[i:i + SPEECH_BATCH_SIZE]))
+                   .order_by(*order)
+                   for i in range(0, len(speech_ids), SPEECH_BATCH_SIZE))
+    for rows in batches:
+        for key, group in groupby(rows, key=lambda row: (row[6], row[7], row[8])):
+            yield key, [tuple(row[:6]) for row in group]
+
+
+def search(query: CqlQuery, cursor: str = None, session: Session = None
+           ) -> Iterator[CqlMatch]:
+    """
+    Find the matches of a compiled query in document order.
+
+    Args:
+        query: compiled query
+        cursor: cursor of the last match of the previous page
+        session: session to query, the request session if None
+
+    Returns:
+        iterator over matches after the cursor
+
+    Raises:
+        CqlSyntaxError: for invalid cursors
+    """
+    session = session or db.session
+    after_speech, after_token = parse_cursor(cursor)
+
+    speech_ids = None
+    anchors = query.anchors
+    if anchors:
+        candidates = candidate_speeches(anchors, session)
+        speech_ids = [speech_id for position, speech_id in sorted(candidates)
+                      if after_speech is None or position >= after_speech]
+
+    automaton = query.automaton
+    for (speech_id, speaker, speech_position), tokens in _stream_speeches(
+            speech_ids, after_speech, session):
+        start = 0
+        while start < len(tokens):
+            end = automaton.match(tokens, start)
+            if end is None:
+                start += 1
+                continue
+            if speech_position == after_speech and tokens[start][5] <= after_token:
+                start = end
+                continue
+            matched = tokens[start:end]
+            line_ids = dict.fromkeys(token[4] for token in matched)
+            yield CqlMatch(
+                speech_id=speech_id,
+                speech_position=speech_position,
+                speaker=speaker,
+                tokens=matched,
+                lines={line_id: [token for token in tokens if token[4] == line_id]
+                       for line_id in line_ids}
+            )
+            start = end
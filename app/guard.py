@@ -0,0 +1,370 @@
+"""
+This module contains the cost guard of the webapp's query paths.
+
+    Views pass their queries through `bounded`, which fetches at most the row limit
+    of the endpoint (ROW_LIMITS, DEFAULT_ROW_LIMIT) plus one row to tell if the
+    result was cut off. The statements run for it are explained first: statements
+    estimated to examine more than QUERY_COST_LIMIT rows are rejected if they can't
+    stop once they found enough rows, i.e. they sort, group or have no LIMIT. A LIMIT
+    doesn't stop a scan filtered by LIKE early either: no index serves the pattern
+    and a rare one is only found, or not, at the end of the table. Every
+    statement of a request runs with a database side timeout (STATEMENT_TIMEOUT):
+    max_statement_time on mariadb, a progress handler interrupting the statement on
+    sqlite. Rejected and interrupted queries leave an empty result, truncated ones a
+    partial result, both are signalled to the user to refine the query and rejected
+    queries are recorded for /debug/rejected.
+
+    On sqlite the estimate is derived from EXPLAIN QUERY PLAN and the table sizes,
+    taken from sqlite_stat1 if the database was analyzed (snapshots are) and from
+    the largest rowid otherwise. All corpus tables start their keys with corpus_id,
+    so searches constrained by nothing else are counted as full scans.
+"""
+import re
+import sqlite3
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from sqlalchemy.orm import Query
+
+from app import db
+
+DEFAULT_ROW_LIMIT = 1000
+DEFAULT_COST_LIMIT = 1000000
+DEFAULT_STATEMENT_TIMEOUT = 5.0
+# sqlite virtual machine instructions between two timeout checks
+PROGRESS_STEPS = 10000
+# rows a search on an index is assumed to find without statistics
+DEFAULT_ROWS_PER_KEY = 10
+# number of rejected queries kept for /debug/rejected
+REJECTED_WINDOW = 100
+
+_LIMIT = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_LOOP = re.compile(r"^(SCAN|SEARCH) (?:(\w+)\.)?(\w+)(?: USING .*?(?:\((.*)\))?)?$")
+_LIKE = re.compile(r"\bLIKE\b", re.IGNORECASE)
+_table_rows: Dict[Tuple[str, str], int] = {}
+
+
+class QueryRejected(Exception):
+    """
+    Raised for statements whose estimated cost exceeds the cost limit.
+    """
+
+    def __init__(self, estimate: int, limit: int):
+        super().__init__(f"estimated to examine {estimate} rows, more than {limit}")
+        self.estimate = estimate
+
+
+@dataclass
+class QueryGuard:
+    """
+    Guard state of a single request.
+    """
+    row_limit: int
+    cost_limit: int
+    timeout: float
+    truncated: bool = False
+    # why the query of the request was rejected, cost or timeout
+    rejected: Optional[str] = None
+    # statements are explained while a bounded query runs
+    estimating: bool = False
+    # deadline holders of the sqlite connections used by the request
+    deadlines: List[List] = field(default_factory=list)
+
+    def header(self) -> Optional[str]:
+        if self.rejected:
+            return f"rejected; reason={self.rejected}"
+        if self.truncated:
+            return f"truncated; limit={self.row_limit}"
+        return None
+
+
+class RejectedQueries:
+    """
+    The last rejected queries of this worker.
+    """
+
+    def __init__(self, window: int = REJECTED_WINDOW):
+        self.queries: Deque[Dict] = deque(maxlen=window)
+        self.total = 0
+
+    def add(self, endpoint: str, reason: str, statement: Optional[str] = None,
+            parameters=None, estimate: Optional[int] = None) -> None:
+        self.total += 1
+        current_app.logger.warning("rejected query on %s (%s, estimate %s): %s",
+                                   endpoint, reason, estimate, statement)
+        self.queries.append({"at": datetime.utcnow().isoformat(), "endpoint": endpoint,
+                             "reason": reason, "estimate": estimate,
+                             "statement": statement, "parameters": repr(parameters)})
+
+    def to_dict(self) -> Dict:
+        return {"total": self.total, "queries": list(self.queries)}
+
+
+def current_guard() -> Optional[QueryGuard]:
+    return g.get("query_guard") if has_request_context() else None
+
+
+def is_timeout(error: sa.exc.DBAPIError) -> bool:
+    """
+    Check if a statement failed because it was interrupted by its timeout.
+    """
+    return "interrupted" in str(error.orig) or "max_statement_time" in str(error.orig)
+
+
+def with_statement_timeout(statement: str, timeout: float) -> str:
+    """
+    Limit the run time of a single mariadb statement, the session setting of the
+        pooled connection stays untouched.
+    """
+    return f"SET STATEMENT max_statement_time={timeout:f} FOR {statement}"
+
+
+def set_deadline(connection: sa.engine.Connection, deadline: Optional[float]) -> List:
+    """
+    Interrupt the statements of a sqlite connection still running at a deadline.
+        The progress handler is installed once per DBAPI connection and reads the
+        deadline from a holder kept in the connection info.
+
+    Args:
+        connection: sqlite connection
+        deadline: time.monotonic() deadline, None to let statements run
+
+    Returns:
+        deadline holder of the connection
+    """
+    info = connection.connection.info
+    holder = info.get("deadline")
+    if holder is None:
+        holder = info["deadline"] = [None]
+        connection.connection.dbapi_connection.set_progress_handler(
+            lambda: holder[0] is not None and time.monotonic() > holder[0],
+            PROGRESS_STEPS)
+    holder[0] = deadline
+    return holder
+
+
+###
+# estimate
+def _sqlite_table_rows(cursor, schema: str, table: str) -> int:
+    key = (schema, table)
+    if key not in _table_rows:
+        try:
+            cursor.execute(f"SELECT stat FROM {schema}.sqlite_stat1 WHERE tbl = ? "
+                           f"LIMIT 1", (table,))
+            row = cursor.fetchone()
+        except sqlite3.OperationalError:
+            # not analyzed
+            row = None
+        try:
+            if row:
+                _table_rows[key] = int(row[0].split()[0])
+            else:
+                cursor.execute(f"SELECT max(rowid) FROM {schema}.{table}")
+                _table_rows[key] = cursor.fetchone()[0] or 0
+        except sqlite3.Error:
+            # tables without rowid
+            _table_rows[key] = 0
+    return _table_rows[key]
+
+
+def _sqlite_cost(dbapi_connection, statement: str, parameters) -> Tuple[int, bool]:
+    cursor = dbapi_connection.cursor()
+    try:
+        plan = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        loops: Dict[int, List[int]] = {}
+        stops_early = _LIMIT.search(statement) is not None
+        scans = False
+        for _, parent, _, detail in plan:
+            if detail.startswith("USE TEMP B-TREE"):
+                stops_early = False
+            match = _LOOP.match(detail)
+            if match is None:
+                continue
+            _, schema, table, constraint = match.groups()
+            # aliased tables are reported by their alias only
+            aliased = re.search(rf"(?:(\w+)\.)?(\w+) AS {table}\b", statement)
+            if aliased:
+                schema, table = aliased.groups()
+            rows = _sqlite_table_rows(cursor, schema or "main", table)
+            columns = {term.split("=")[0].split(">")[0].split("<")[0].strip()
+                       for term in (constraint or "").split(" AND ")} - {""}
+            if {"id", "rowid"} & columns:
+                rows = 1
+            elif columns - {"corpus_id"}:
+                rows = min(rows, DEFAULT_ROWS_PER_KEY)
+            else:
+                scans = True
+            loops.setdefault(parent, []).append(rows)
+    finally:
+        cursor.close()
+    return _nested_loop_cost(loops), stops_early and not _filters_scan(statement, scans)
+
+
+def _mariadb_cost(dbapi_connection, statement: str, parameters) -> Tuple[int, bool]:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN {statement}", parameters)
+        columns = [column[0] for column in cursor.description]
+        loops: Dict[int, List[int]] = {}
+        stops_early = _LIMIT.search(statement) is not None
+        scans = False
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            if "filesort" in (row.get("Extra") or "") or \
+                    "temporary" in (row.get("Extra") or ""):
+                stops_early = False
+            if row.get("type") in ("ALL", "index"):
+                scans = True
+            loops.setdefault(row.get("id") or 0, []).append(int(row.get("rows") or 1))
+    finally:
+        cursor.close()
+    return _nested_loop_cost(loops), stops_early and not _filters_scan(statement, scans)
+
+
+def _filters_scan(statement: str, scans: bool) -> bool:
+    """
+    Check if a statement scanning a table is filtered by LIKE, also on the tables
+        joined to the scanned one. The scan runs until enough rows matched, which
+        can be the whole table.
+    """
+    return scans and _LIKE.search(statement) is not None
+
+
+def _nested_loop_cost(loops: Dict[int, List[int]]) -> int:
+    # the tables of a select are joined in nested loops, each level is run once per
+    #  row of the levels before it
+    cost = 0
+    for levels in loops.values():
+        product = 1
+        for rows in levels:
+            product *= max(rows, 1)
+            cost += product
+    return cost
+
+
+def estimate_cost(dbapi_connection, dialect: str, statement: str,
+                  parameters) -> Tuple[int, bool]:
+    """
+    Estimate the rows a select examines from its query plan.
+
+    Args:
+        dbapi_connection: connection to explain the statement on, it has to see the
+            same tables as the statement, e.g. attached corpus files
+        dialect: sqlite or mariadb
+        statement: select as sent to the database
+        parameters: parameters of the statement
+
+    Returns:
+        (estimated rows examined, whether it can stop once it found enough rows)
+    """
+    if dialect == "sqlite":
+        return _sqlite_cost(dbapi_connection, statement, parameters)
+    return _mariadb_cost(dbapi_connection, statement, parameters)
+
+
+###
+# engine events
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    guard = current_guard()
+    if guard is None or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return statement, parameters
+    if guard.estimating and not executemany:
+        estimate, stops_early = estimate_cost(conn.connection.dbapi_connection,
+                                              conn.dialect.name, statement, parameters)
+        if estimate > guard.cost_limit and not stops_early:
+            current_app.extensions["rejected_queries"].add(
+                request.endpoint, "cost", statement, parameters, estimate)
+            raise QueryRejected(estimate, guard.cost_limit)
+    if conn.dialect.name == "sqlite":
+        holder = set_deadline(conn, time.monotonic() + guard.timeout)
+        if holder not in guard.deadlines:
+            guard.deadlines.append(holder)
+        return statement, parameters
+    return with_statement_timeout(statement, guard.timeout), parameters
+
+
+###
+# views
+def bounded(rows: Union[Query, Callable[[int], Sequence], Sequence]) -> List:
+    """
+    Get at most the row limit of the endpoint from the rows of a query and note on
+        the request guard if they were cut off or the query was rejected.
+
+    Args:
+        rows: ORM query, function fetching a given number of rows or rows already
+            in memory
+
+    Returns:
+        list of at most row limit rows, empty if the query was rejected
+    """
+    guard = current_guard()
+    if guard is None:
+        return list(rows.all() if isinstance(rows, Query) else rows)
+    limit = guard.row_limit
+    if isinstance(rows, Query) or callable(rows):
+        guard.estimating = True
+        try:
+            fetched = rows.limit(limit + 1).all() if isinstance(rows, Query) \
+                else list(rows(limit + 1))
+        except QueryRejected:
+            guard.rejected = "cost"
+            return []
+        except sa.exc.OperationalError as error:
+            if not is_timeout(error):
+                raise
+            current_app.extensions["rejected_queries"].add(
+                request.endpoint, "timeout", error.statement, error.params)
+            guard.rejected = "timeout"
+            return []
+        finally:
+            guard.estimating = False
+    else:
+        fetched = list(rows[:limit + 1])
+    if len(fetched) > limit:
+        guard.truncated = True
+    return fetched[:limit]
+
+
+###
+# request hooks
+def _start_request():
+    config = current_app.config
+    g.query_guard = QueryGuard(
+        row_limit=config.get("ROW_LIMITS", {}).get(
+            request.endpoint, config.get("DEFAULT_ROW_LIMIT", DEFAULT_ROW_LIMIT)),
+        cost_limit=config.get("QUERY_COST_LIMIT", DEFAULT_COST_LIMIT),
+        timeout=config.get("STATEMENT_TIMEOUT", DEFAULT_STATEMENT_TIMEOUT),
+    )
+
+
+def _finish_request(response):
+    guard = g.get("query_guard")
+    header = guard.header() if guard else None
+    if header:
+        response.headers["X-Query-Guard"] = header
+    return response
+
+
+def _clear_deadlines(exception=None):
+    guard = g.pop("query_guard", None)
+    # pooled connections are used outside requests as well
+    for holder in guard.deadlines if guard else ():
+        holder[0] = None
+
+
+def init_app(app) -> None:
+    """
+    Register the guard with the app, has to be called after db.init_app.
+    """
+    app.extensions["rejected_queries"] = RejectedQueries()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_clear_deadlines)
+    with app.app_context():
+        sa.event.listen(db.engine, "before_cursor_execute", _before_cursor_execute,
+                        retval=True)
@@ -0,0 +1,121 @@
+"""
+This module contains the loader for nested act -> scene -> speech -> line -> token
+    documents.
+
+    Every level below the requested one is loaded with a single subquery eager load,
+    which joins the level to the query of the levels above it, so a document takes
+    one query per level however many children it has. selectin loads would split
+    their parent keys into batches of 500, a query per batch. Clients can restrict
+    the columns loaded per level with sparse fieldsets.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy.orm import load_only, subqueryload
+
+from app.models import Act, CastItem, Line, Scene, Speech, Token
+
+LEVELS = ["act", "scene", "speech", "line", "token"]
+MODELS = {"act": Act, "scene": Scene, "speech": Speech, "line": Line, "token": Token,
+          "speaker": CastItem}
+# relationship attribute leading from each level to the next
+CHILDREN = {"act": "scenes", "scene": "speeches", "speech": "lines", "line": "tokens"}
+# columns loaded on every level, no matter which fields were requested
+REQUIRED_COLUMNS = {"act": ["corpus_id", "id"], "scene": ["corpus_id", "id", "act_id"],
+                    "speech": ["corpus_id", "id", "scene_id", "cast_item_id"],
+                    "line": ["corpus_id", "id", "speech_id"],
+                    "token": ["corpus_id", "id", "line_id"],
+                    "speaker": ["corpus_id", "id"]}
+
+
+class FieldError(ValueError):
+    """
+    Raised for unknown levels or fields in a projection.
+    """
+
+
+def columns(level: str) -> List[str]:
+    """
+    Get the names of all columns of a level.
+    """
+    return [column.key for column in MODELS[level].__table__.columns]
+
+
+def parse_fields(fields: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Parse sparse fieldsets like {"token": "content,lemma"} and fill in all columns
+        for levels without one.
+
+    Raises:
+        FieldError: for unknown levels or columns
+    """
+    projection = {level: columns(level) for level in MODELS}
+    for level, names in fields.items():
+        if level not in MODELS:
+            raise FieldError(f"unknown level {level!r}")
+        names = [name.strip() for name in names.split(",") if name.strip()]
+        unknown = set(names) - set(columns(level))
+        if unknown:
+            raise FieldError(f"unknown fields for {level}: {', '.join(sorted(unknown))}")
+        projection[level] = names
+    return projection
+
+
+def _column_attributes(level: str, names: Iterable[str]):
+    model = MODELS[level]
+    names = dict.fromkeys(REQUIRED_COLUMNS[level] + list(names))
+    return [getattr(model, name) for name in names]
+
+
+def load(level: str, ids: Optional[Sequence[str]], projection: Dict[str, List[str]],
+         depth: str = "token") -> List:
+    """
+    Load the objects of a level with all their children down to depth.
+
+    Args:
+        level: level of the root objects
+        ids: ids of the root objects, all objects of the level if None
+        projection: columns to load per level
+        depth: deepest level to load
+
+    Returns:
+        list of root objects in document order
+    """
+    if LEVELS.index(depth) < LEVELS.index(level):
+        raise FieldError(f"depth {depth!r} is above level {level!r}")
+    model = MODELS[level]
+    query = model.query.options(load_only(*_column_attributes(level, projection[level])))
+
+    path = None
+    for parent in LEVELS[LEVELS.index(level):LEVELS.index(depth)]:
+        child = LEVELS[LEVELS.index(parent) + 1]
+        relationship_attribute = getattr(MODELS[parent], CHILDREN[parent])
+        path = subqueryload(relationship_attribute) if path is None \
+            else path.subqueryload(relationship_attribute)
+        query = query.options(
+            path.load_only(*_column_attributes(child, projection[child])))
+        if child == "speech":
+            query = query.options(path.subqueryload(Speech.speaker).load_only(
+                *_column_attributes("speaker", projection["speaker"])))
+    if level == "speech":
+        query = query.options(subqueryload(Speech.speaker).load_only(
+            *_column_attributes("speaker", projection["speaker"])))
+
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    return query.order_by(model.position).all()
+
+
+def to_dict(obj, level: str, projection: Dict[str, List[str]], depth: str) -> Dict:
+    """
+    Serialize a loaded object and its children with the projected fields.
+    """
+    document = {name: getattr(obj, name) for name in projection[level]}
+    if level == "speech":
+        document["speaker"] = {name: getattr(obj.speaker, name)
+                               for name in projection["speaker"]} \
+            if obj.speaker is not None else None
+    if level != depth:
+        child = LEVELS[LEVELS.index(level) + 1]
+        document[CHILDREN[level]] = [to_dict(child_obj, child, projection, depth)
+                                     for child_obj in getattr(obj, CHILDREN[level])]
+    return document
@@ -0,0 +1,216 @@
+"""
+This module contains the per request instrumentation of the webapp.
+
+    Every statement sent through the app engine is counted and timed, the rows
+    fetched from its cursor are counted and templates are timed while rendering. The
+    numbers of a request are sent back as Server-Timing header and aggregated per
+    endpoint for /debug/stats. Statements slower than SLOW_QUERY_MS are logged with
+    their query plan once the request is done. The cost estimates of the query guard
+    are made before a statement is timed and are not counted.
+
+    Work done while a streamed response body is generated happens after the headers
+    were sent and is not counted.
+"""
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from jinja2 import Template
+
+from app import db
+
+DEFAULT_SLOW_QUERY_MS = 100
+# number of requests per endpoint kept for the percentiles
+STATS_WINDOW = 1000
+PERCENTILES = (50, 95, 99)
+
+
+class RequestStats:
+    """
+    Measurements of a single request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.template_time = 0.0
+        # (connection, statement, parameters, seconds) of slow statements
+        self.slow: List = []
+
+    def server_timing(self, total: float) -> str:
+        return ", ".join([
+            f'sql;dur={self.sql_time * 1000:.2f};desc="{self.statements} statements"',
+            f'rows;desc="{self.rows} rows"',
+            f"tpl;dur={self.template_time * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ])
+
+
+class _CountingCursor:
+    """
+    Proxy of a DBAPI cursor counting the rows fetched from it.
+    """
+
+    def __init__(self, cursor, stats: RequestStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedTemplate(Template):
+    """
+    Jinja template adding its render time to the request measurements.
+    """
+
+    def render(self, *args, **kwargs):
+        stats = _request_stats()
+        if stats is None:
+            return super().render(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            stats.template_time += time.perf_counter() - started
+
+
+class EndpointStats:
+    """
+    Measurements of the last requests to each endpoint.
+    """
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.samples: Dict[str, Dict[str, Deque[float]]] = defaultdict(
+            lambda: defaultdict(lambda: deque(maxlen=window)))
+
+    def add(self, endpoint: str, stats: RequestStats, total: float) -> None:
+        self.requests[endpoint] += 1
+        samples = self.samples[endpoint]
+        samples["total_ms"].append(total * 1000)
+        samples["sql_ms"].append(stats.sql_time * 1000)
+        samples["template_ms"].append(stats.template_time * 1000)
+        samples["statements"].append(stats.statements)
+        samples["rows"].append(stats.rows)
+
+    def to_dict(self) -> Dict:
+        return {endpoint: {"requests": self.requests[endpoint],
+                           **{name: percentiles(values) for name, values in samples.items()}}
+                for endpoint, samples in sorted(self.samples.items())}
+
+
+def percentiles(values) -> Dict[str, float]:
+    """
+    Get the nearest rank percentiles of the values.
+    """
+    ordered = sorted(values)
+    return {f"p{p}": ordered[min(len(ordered) - 1, (len(ordered) * p - 1) // 100)]
+            for p in PERCENTILES}
+
+
+def _request_stats():
+    return g.get("request_stats") if has_request_context() else None
+
+
+###
+# engine events
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    if stats is None or not conn.info.get("query_started"):
+        return
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    stats.statements += 1
+    stats.sql_time += duration
+    if context is not None and cursor.description is not None:
+        context.cursor = _CountingCursor(cursor, stats)
+    if duration * 1000 >= current_app.config.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS) \
+            and not executemany:
+        stats.slow.append((conn, statement, parameters, duration))
+
+
+def explain(connection: sa.engine.Connection, statement: str, parameters) -> List[str]:
+    """
+    Get the query plan of a statement as lines of text.
+    """
+    prefix = "EXPLAIN QUERY PLAN" if connection.dialect.name == "sqlite" else "EXPLAIN"
+    rows = connection.exec_driver_sql(f"{prefix} {statement}", parameters)
+    return [" | ".join(str(value) for value in row) for row in rows]
+
+
+def _log_slow_statements(stats: RequestStats) -> None:
+    for connection, statement, parameters, duration in stats.slow:
+        try:
+            if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                plan = ["no plan for this kind of statement"]
+            elif connection.closed:
+                with db.engine.connect() as connection:
+                    plan = explain(connection, statement, parameters)
+            else:
+                plan = explain(connection, statement, parameters)
+        except sa.exc.DBAPIError as error:
+            plan = [f"no plan: {error.orig}"]
+        current_app.logger.warning(
+            "slow query on %s (%.1f ms): %s\nparameters: %r\nplan:\n  %s",
+            request.endpoint, duration * 1000, statement, parameters, "\n  ".join(plan))
+
+
+###
+# request hooks
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.started
+    response.headers["Server-Timing"] = stats.server_timing(total)
+    current_app.extensions["endpoint_stats"].add(request.endpoint or "unknown", stats,
+                                                 total)
+    _log_slow_statements(stats)
+    return response
+
+
+def init_app(app) -> None:
+    """
+    Register the instrumentation with the app, has to be called after db.init_app and
+        guard.init_app, engine events are dispatched in the order they were registered.
+    """
+    app.extensions["endpoint_stats"] = EndpointStats()
+    app.jinja_env.template_class = TimedTemplate
+    # measured before the corpus of the request is resolved
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request(_finish_request)
+    with app.app_context():
+        sa.event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        sa.event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,236 @@
+"""
+This module contains the in memory serving mode.
+
+    With IN_MEMORY set, create_app loads one corpus into plain records, tuples and
+    dicts and the read endpoints of the main, query, result, api and suggest blueprints
+    answer from them without touching the database. The store is built before the app is
+    handed to the server, so a pre-forking server loading the app once (gunicorn
+    --preload) shares it copy-on-write between all workers. The loaded objects are
+    moved out of the garbage collector's reach with gc.freeze, otherwise its
+    collections would write to every page and duplicate the store per worker.
+"""
+import gc
+import sys
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+from flask import current_app, g
+
+from app import db
+from app import models
+from app.corpus import resolve_corpus, scope_session
+from app.trigram import default_max_distance, normalize_form, rank_tokens, trigrams, \
+    verify_forms
+
+# stored tables, their relationships to children and parents as
+#  (attribute, child table, referencing column)
+CHILDREN = {
+    "act": [("scenes", "scene", "act_id")],
+    "scene": [("speeches", "speech", "scene_id")],
+    "speech": [("lines", "line", "speech_id")],
+    "line": [("tokens", "token", "line_id")],
+    "cast_item": [("speeches", "speech", "cast_item_id")],
+}
+PARENTS = {
+    "scene": [("act", "act", "act_id")],
+    "speech": [("scene", "scene", "scene_id"), ("speaker", "cast_item", "cast_item_id")],
+    "line": [("speech", "speech", "speech_id")],
+    "token": [("line", "line", "line_id")],
+}
+MODELS = {model.__tablename__: model for model in (
+    models.CastGroup, models.CastItem, models.CastRole, models.Act, models.Scene,
+    models.Speech, models.Line, models.Token, models.TokenForm)}
+# columns filtered with LIKE by the result blueprint
+SEARCH_COLUMNS = {"cast_group": "id", "cast_role": "cast_item_id", "act": "content",
+                  "scene": "content", "speech": "cast_item_id", "line": "speech_id"}
+
+
+class Record:
+    """
+    Read only row of a stored table, subclasses list their attributes as slots.
+    """
+    __slots__ = ()
+
+    def __init__(self, values: Dict):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+def _record_class(table: str) -> type:
+    names = [column.key for column in MODELS[table].__table__.columns]
+    names += [name for name, _, _ in CHILDREN.get(table, []) + PARENTS.get(table, [])]
+    return type(f"{MODELS[table].__name__}Record", (Record,), {"__slots__": tuple(names)})
+
+
+RECORDS = {table: _record_class(table) for table in MODELS}
+
+
+def _intern(value):
+    # ids, forms and lemmas repeat a lot, share one string object per value
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CorpusStore:
+    """
+    Class holding all rows of one corpus needed by the read endpoints.
+    """
+    # blueprints answered from the store
+    BLUEPRINTS = {"main", "query", "result", "api", "suggest"}
+
+    def __init__(self, corpus):
+        """
+        Args:
+            corpus: corpus registry row
+        """
+        self.corpus = corpus
+        self.tables: Dict[str, Tuple[Record, ...]] = {}
+        self.by_id: Dict[str, Dict[str, Record]] = {}
+        self.lowered: Dict[str, Tuple[str, ...]] = {}
+        self.form_trigrams: Dict[str, Tuple[Record, ...]] = {}
+        self.form_tokens: Dict[str, Tuple[Record, ...]] = {}
+
+    def serves(self, blueprint: str, key: Optional[str]) -> bool:
+        """
+        Check if a request to a blueprint for a corpus can be answered from the store.
+        """
+        return blueprint in self.BLUEPRINTS and key in (None, self.corpus.id,
+                                                        self.corpus.name)
+
+    ###
+    # load
+    def load(self) -> None:
+        """
+        Read the corpus from the request session, which has to be scoped to it.
+        """
+        for table, model in MODELS.items():
+            columns = model.__table__.c
+            order = columns.position if "position" in columns else columns.id
+            rows = db.session.execute(
+                sa.select(model.__table__).where(columns.corpus_id == self.corpus.id)
+                .order_by(order))
+            records = tuple(RECORDS[table]({key: _intern(value)
+                                            for key, value in row._mapping.items()})
+                            for row in rows)
+            self.tables[table] = records
+            self.by_id[table] = {record.id: record for record in records}
+        self._link()
+        self._load_search_index()
+        self.lowered = {table: tuple((getattr(record, column) or "").lower()
+                                     for record in self.tables[table])
+                        for table, column in SEARCH_COLUMNS.items()}
+
+    def _link(self):
+        for table, relationships in CHILDREN.items():
+            for attribute, child, column in relationships:
+                children = defaultdict(list)
+                for record in self.tables[child]:
+                    children[getattr(record, column)].append(record)
+                for record in self.tables[table]:
+                    setattr(record, attribute, tuple(children.get(record.id, ())))
+        for table, relationships in PARENTS.items():
+            for attribute, parent, column in relationships:
+                parents = self.by_id[parent]
+                for record in self.tables[table]:
+                    setattr(record, attribute, parents.get(getattr(record, column)))
+
+    def _load_search_index(self):
+        forms = self.by_id["token_form"]
+        trigram_table = models.FormTrigram.__table__
+        form_trigrams = defaultdict(list)
+        for trigram, form_id in db.session.execute(
+                sa.select(trigram_table.c.trigram, trigram_table.c.form_id)
+                .where(trigram_table.c.corpus_id == self.corpus.id)):
+            form_trigrams[_intern(trigram)].append(forms[form_id])
+        self.form_trigrams = {trigram: tuple(found)
+                              for trigram, found in form_trigrams.items()}
+
+        association = models.token_form_association_table
+        tokens = self.by_id["token"]
+        form_tokens = defaultdict(list)
+        for form_id, token_id in db.session.execute(
+                sa.select(association.c.form_id, association.c.token_id)
+                .where(association.c.corpus_id == self.corpus.id)):
+            form_tokens[form_id].append(tokens[token_id])
+        self.form_tokens = {form_id: tuple(found) for form_id, found in form_tokens.items()}
+
+    ###
+    # read
+    def all(self, table: str) -> Tuple[Record, ...]:
+        """
+        Get all records of a table in document order.
+        """
+        return self.tables[table]
+
+    def like(self, table: str, query: str) -> List[Record]:
+        """
+        Get the records whose searched column contains the query, ignoring case
+            like the LIKE filters of the result blueprint.
+        """
+        query = str(query).lower()
+        return [record for record, value in zip(self.tables[table], self.lowered[table])
+                if query in value]
+
+    def get(self, table: str, ids: Optional[Sequence[str]]) -> List[Record]:
+        """
+        Get records by id in document order, all records if ids is None.
+        """
+        if ids is None:
+            return list(self.tables[table])
+        found = (self.by_id[table].get(record_id) for record_id in ids)
+        return sorted((record for record in found if record is not None),
+                      key=lambda record: record.position)
+
+    def fuzzy_tokens(self, query: str, kinds: Sequence[str] = ("content", "lemma"),
+                     max_distance: int = None) -> List[Record]:
+        """
+        Same as app.trigram.fuzzy_tokens, answered from the stored index.
+        """
+        query = normalize_form(query or "")
+        if not query:
+            return []
+        if max_distance is None:
+            max_distance = default_max_distance(query)
+        query_trigrams = trigrams(query)
+        min_shared = max(1, len(query_trigrams) - 3 * max_distance)
+
+        shared = Counter(form for trigram in query_trigrams
+                         for form in self.form_trigrams.get(trigram, ()))
+        candidates: Iterable = ((form, count) for form, count in shared.items()
+                                if count >= min_shared and form.kind in kinds)
+        matches = verify_forms(query, query_trigrams, candidates, max_distance, 50)
+        ranks = {form.id: rank for rank, (form, _, _) in enumerate(matches)}
+        return rank_tokens(ranks, ((form.id, token) for form, _, _ in matches
+                                   for token in self.form_tokens.get(form.id, ())))
+
+
+def current_store() -> Optional[CorpusStore]:
+    """
+    Get the store of the app, if it runs in memory and serves the current request.
+    """
+    store = current_app.extensions.get("corpus_store")
+    if store is not None and g.get("corpus") is store.corpus:
+        return store
+    return None
+
+
+def init_app(app) -> None:
+    """
+    Load the store if the app is configured to run in memory, has to be called after
+        the corpus scoping was registered.
+    """
+    if not app.config.get("IN_MEMORY"):
+        return
+    with app.app_context():
+        corpus = resolve_corpus(app.config.get("CORPUS"))
+        if corpus is None:
+            raise RuntimeError("IN_MEMORY is set but there is no corpus to load")
+        scope_session(corpus)
+        store = CorpusStore(corpus)
+        try:
+            store.load()
+        finally:
+            db.session.remove()
+    app.extensions["corpus_store"] = store
+    gc.collect()
+    gc.freeze()
@@ -1,6 +1,9 @@
 """
 This module contains class definitions for the tables storing objects transformed from
     TEI format xml corpora.
+
+    Every table except `corpus` is keyed by corpus and carries no foreign keys (see
+    ingestion/tei_sql_schema.py), so relationships are read only joins on corpus and id.
 """
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -9,73 +12,100 @@ from app import db
 
 Base = declarative_base()
 
+# schema revision these models are written for, the database is migrated by the
+#  ingestion service (ingestion/migrations)
+SCHEMA_REVISION = "9b2e4c7d1f05"
+
 cast_stage_association_table = sa.Table(
     'cast_stage_association',
     Base.metadata,
-    sa.Column('cast_item_id', sa.ForeignKey('cast_item.id'), primary_key=True),
-    sa.Column('stage_id', sa.ForeignKey('stage.id'), primary_key=True)
+    sa.Column('corpus_id', sa.String(32), primary_key=True),
+    sa.Column('cast_item_id', sa.String(36), primary_key=True),
+    sa.Column('stage_id', sa.String(36), primary_key=True)
 )
 
 
+def _join(parent: str, child: str, column: str) -> str:
+    """
+    Join condition of a child table referencing its parent within the same corpus.
+    """
+    return f"and_({parent}.corpus_id == foreign({child}.corpus_id), " \
+           f"{parent}.id == foreign({child}.{column}))"
+
+
+class CorpusMixin:
+    """
+    Corpus key shared by all tables partitioned by corpus.
+    """
+    corpus_id = sa.Column(sa.String(32), primary_key=True)
+
+
+# corpus information
+class Corpus(db.Model):
+    __tablename__ = "corpus"
+
+    id = sa.Column(sa.String(32), primary_key=True)
+    name = sa.Column(sa.String(255), index=True)
+    # file the corpus is stored in, relative to the main database file (sqlite only)
+    location = sa.Column(sa.String(255))
+    # set once the corpus is completely loaded, none while it is loading
+    created_at = sa.Column(sa.DateTime)
+
+
 # meta information
 # TODO: meta information in TeiHeader missing
 
 # cast information
-# class CastItem(Base):
-#     __tablename__ = "cast_item"
+class CastItem(CorpusMixin, db.Model):
+    __tablename__ = "cast_item"
 
-#     id = sa.Column(sa.String(36), primary_key=True)
-#     # TODO: most of the current relationships are one directional
-#     #  -> figure out where bidrectional relationships are necessary
-#     # cast_roles = relationship("CastRole", back_populates="cast_item")
-#     cast_group_id = sa.Column(sa.Integer, sa.ForeignKey("cast_group.id"))
-#     name = sa.Column(sa.TEXT)
-#     content = sa.Column(sa.TEXT)
-#     # TODO: corresp attrib missing+
-#     stages = relationship(
-#         "Stage",
-#         secondary=cast_stage_association_table,
-#         # back_populates="stage"
-#         backref="stage"
-#     )
+    id = sa.Column(sa.String(36), primary_key=True)
+    cast_group_id = sa.Column(sa.String(36), index=True)
+    name = sa.Column(sa.TEXT)
+    content = sa.Column(sa.TEXT)
+    # TODO: corresp attrib missing+
+    speeches = relationship("Speech", primaryjoin=_join("CastItem", "Speech", "cast_item_id"),
+                            viewonly=True)
 
 
-class CastRole(db.Model):
+class CastRole(CorpusMixin, db.Model):
     __tablename__ = "cast_role"
 
-    # TODO: most of the other primary keys are of type String to directly use the ids
-    #  from the xml document -> find a way to generate unique string keys
-    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True, default=0)
-    # id = sa.Column(sa.String(36), primary_key=True)
-    # cast_item = relationship("CastItem", back_populates="cast_roles")
-    cast_item_id = sa.Column(sa.ForeignKey("cast_item.id"))
+    id = sa.Column(sa.String(36), primary_key=True)
+    cast_item_id = sa.Column(sa.String(36), index=True)
     name = sa.Column(sa.TEXT)
     content = sa.Column(sa.TEXT)
     description = sa.Column(sa.TEXT)
 
 
-class CastGroup(db.Model):
+class CastGroup(CorpusMixin, db.Model):
     __tablename__ = "cast_group"
 
-    # TODO: most of the other primary keys are of type String to directly use the ids
-    #  from the xml document -> find a way to generate unique string keys
-    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True, default=0)
+    id = sa.Column(sa.String(36), primary_key=True)
 
 
 # play information
-class Act(db.Model):
+class Act(CorpusMixin, db.Model):
     __tablename__ = "act"
 
     id = sa.Column(sa.String(36), primary_key=True)
+    # document order of the element within its corpus
+    position = sa.Column(sa.Integer, index=True)
     content = sa.Column(sa.TEXT)
+    scenes = relationship("Scene", primaryjoin=_join("Act", "Scene", "act_id"),
+                          order_by="Scene.position", viewonly=True)
 
 
-class Scene(db.Model):
+class Scene(CorpusMixin, db.Model):
     __tablename__ = "scene"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    act_id = sa.Column(sa.ForeignKey("act.id"))
+    position = sa.Column(sa.Integer, index=True)
+    act_id = sa.Column(sa.String(36), index=True)
     content = sa.Column(sa.TEXT)
+    act = relationship("Act", primaryjoin=_join("Act", "Scene", "act_id"), viewonly=True)
+    speeches = relationship("Speech", primaryjoin=_join("Scene", "Speech", "scene_id"),
+                            order_by="Speech.position", viewonly=True)
 
 
 # class Stage(db.Model):
@@ -92,26 +122,70 @@ class Scene(db.Model):
 #     )
 
 
-class Speech(db.Model):
+class Speech(CorpusMixin, db.Model):
     __tablename__ = "speech"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    scene_id = sa.Column(sa.ForeignKey("scene.id"))
-    cast_item_id = sa.Column(sa.ForeignKey("cast_item.id"))
-
-
-class Line(db.Model):
+    position = sa.Column(sa.Integer, index=True)
+    scene_id = sa.Column(sa.String(36), index=True)
+    cast_item_id = sa.Column(sa.String(36), index=True)
+    scene = relationship("Scene", primaryjoin=_join("Scene", "Speech", "scene_id"),
+                         viewonly=True)
+    speaker = relationship("CastItem",
+                           primaryjoin=_join("CastItem", "Speech", "cast_item_id"),
+                           viewonly=True)
+    lines = relationship("Line", primaryjoin=_join("Speech", "Line", "speech_id"),
+                         order_by="Line.position", viewonly=True)
+
+
+class Line(CorpusMixin, db.Model):
     __tablename__ = "line"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    speech_id = sa.Column(sa.ForeignKey("speech.id"))
+    position = sa.Column(sa.Integer, index=True)
+    speech_id = sa.Column(sa.String(36), index=True)
+    speech = relationship("Speech", primaryjoin=_join("Speech", "Line", "speech_id"),
+                          viewonly=True)
+    tokens = relationship("Token", primaryjoin=_join("Line", "Token", "line_id"),
+                          order_by="Token.position", viewonly=True)
 
 
-class Token(db.Model):
+class Token(CorpusMixin, db.Model):
     __tablename__ = "token"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    line_id = sa.Column(sa.ForeignKey("line.id"))
+    position = sa.Column(sa.Integer, index=True)
+    line_id = sa.Column(sa.String(36), index=True)
     content = sa.Column(sa.TEXT)
     lemma = sa.Column(sa.TEXT)
     ana = sa.Column(sa.TEXT)
+    line = relationship("Line", primaryjoin=_join("Line", "Token", "line_id"),
+                        viewonly=True)
+
+
+# search index information
+token_form_association_table = sa.Table(
+    'token_form_association',
+    db.metadata,
+    sa.Column('corpus_id', sa.String(32), primary_key=True),
+    sa.Column('form_id', sa.String(36), primary_key=True),
+    sa.Column('token_id', sa.String(36), primary_key=True)
+)
+
+
+class TokenForm(CorpusMixin, db.Model):
+    __tablename__ = "token_form"
+
+    id = sa.Column(sa.String(36), primary_key=True)
+    # "content" for token forms, "lemma" for lemmas
+    kind = sa.Column(sa.String(8))
+    form = sa.Column(sa.String(255), index=True)
+    frequency = sa.Column(sa.Integer)
+    trigram_count = sa.Column(sa.Integer)
+
+
+class FormTrigram(CorpusMixin, db.Model):
+    __tablename__ = "form_trigram"
+
+    trigram = sa.Column(sa.String(3), primary_key=True)
+    form_id = sa.Column(sa.String(36), primary_key=True)
@@ -0,0 +1,177 @@
+"""
+This module contains the fan-out of searches over all stored corpora.
+
+    Every corpus is a shard, on sqlite its own database file (see app/corpus.py).
+    A search runs on every shard in parallel with its own read only session, each
+    shard returns its own top k results and these are merged into the overall top k
+    as the shards finish. Shards exceeding the timeout are interrupted and reported
+    instead of holding up the response, so the latency of a search is bounded by the
+    slowest shard instead of the total size of all corpora.
+"""
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.orm import Session
+
+from app import db
+from app.corpus import corpus_criteria, corpus_path, find_corpora
+from app.guard import is_timeout, set_deadline, with_statement_timeout
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_WORKERS = 8
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_engines: Dict[str, sa.engine.Engine] = {}
+
+
+class ShardTimeout(Exception):
+    """
+    Raised inside a shard search which exceeded its timeout.
+    """
+
+
+@dataclass
+class FanOutResult:
+    """
+    Merged results of a search over several shards.
+    """
+    results: List[Any] = field(default_factory=list)
+    shards: int = 0
+    timed_out: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        return {"results": self.results, "shards": self.shards,
+                "timed_out": self.timed_out, "failed": self.failed}
+
+
+def executor(workers: int = DEFAULT_WORKERS) -> ThreadPoolExecutor:
+    """
+    Get the thread pool shared by all searches, created on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="shard")
+    return _executor
+
+
+def _shard_engine(corpus) -> sa.engine.Engine:
+    if db.engine.dialect.name != "sqlite" or not corpus.location:
+        return db.engine
+    path = corpus_path(corpus)
+    if path not in _engines:
+        _engines[path] = sa.create_engine(f"sqlite:///file:{path}?mode=ro&uri=true")
+    return _engines[path]
+
+
+def _limit_statements(connection: sa.engine.Connection, timeout: float) -> None:
+    # only this connection object is listened to, the pooled DBAPI connection keeps
+    #  no setting once it is returned
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        return with_statement_timeout(statement, timeout), parameters
+
+    sa.event.listen(connection, "before_cursor_execute", before_cursor_execute,
+                    retval=True)
+
+
+def _restrict_session(session: Session, corpus_id: str) -> None:
+    def restrict(execute_state):
+        if execute_state.is_select and not execute_state.is_column_load:
+            execute_state.statement = execute_state.statement.options(
+                corpus_criteria(corpus_id))
+
+    sa.event.listen(session, "do_orm_execute", restrict)
+
+
+@contextmanager
+def shard_session(corpus, engine: sa.engine.Engine, timeout: float) -> Iterator[Session]:
+    """
+    Open a read only session on the shard of a corpus, statements still running
+        timeout seconds after it was opened (sqlite) or after they started (mariadb)
+        are aborted.
+
+    Args:
+        corpus: corpus registry row
+        engine: engine of the shard
+        timeout: seconds the session may run
+
+    Returns:
+        context manager yielding the session
+
+    Raises:
+        ShardTimeout: if a statement was aborted
+    """
+    with engine.connect() as connection:
+        is_sqlite = engine.dialect.name == "sqlite"
+        if is_sqlite:
+            set_deadline(connection, time.monotonic() + timeout)
+        else:
+            _limit_statements(connection, timeout)
+        session = Session(bind=connection)
+        # also on corpus files of their own: every key starts with corpus_id, joins
+        #  without it can't search the primary keys and scan the joined table instead
+        _restrict_session(session, corpus.id)
+        try:
+            yield session
+        except sa.exc.OperationalError as error:
+            if is_timeout(error):
+                raise ShardTimeout(corpus.name) from error
+            raise
+        finally:
+            session.close()
+            if is_sqlite:
+                set_deadline(connection, None)
+
+
+def fan_out(search: Callable[[Session, Any], List], key: Callable[[Any], Any],
+            limit: int, corpora: Sequence[str] = None, timeout: float = DEFAULT_TIMEOUT,
+            workers: int = DEFAULT_WORKERS) -> FanOutResult:
+    """
+    Run a search on the shards of the given corpora and merge their top results.
+
+    Args:
+        search: called with a shard session and the corpus registry row, returns
+            at most limit results sorted by key
+        key: sort key of the results
+        limit: number of results to return
+        corpora: ids or names of the corpora to search, all if None
+        timeout: seconds each shard may take
+        workers: size of the thread pool
+
+    Returns:
+        merged top results with the shards that timed out or failed
+    """
+    shards = [corpus for corpus in find_corpora()
+              if corpora is None or corpus.id in corpora or corpus.name in corpora]
+    engines = {corpus.id: _shard_engine(corpus) for corpus in shards}
+
+    def run(corpus):
+        with shard_session(corpus, engines[corpus.id], timeout) as session:
+            return search(session, corpus)
+
+    futures = {executor(workers).submit(run, corpus): corpus for corpus in shards}
+    merged = FanOutResult(shards=len(shards))
+    for future in as_completed(futures):
+        corpus = futures[future]
+        try:
+            results = future.result()
+        except ShardTimeout:
+            merged.timed_out.append(corpus.name)
+            continue
+        except Exception:
+            current_app.logger.exception("search on corpus %s failed", corpus.name)
+            merged.failed.append(corpus.name)
+            continue
+        merged.results = list(heapq.merge(merged.results, results, key=key))[:limit]
+    return merged
@@ -0,0 +1,41 @@
+// fills the datalist of search inputs with data-suggest="<kind>,<kind>" from /suggest
+const SUGGEST_DELAY_MS = 80;
+
+document.querySelectorAll('input[data-suggest]').forEach((input) => {
+  const datalist = document.getElementById(input.getAttribute('list'));
+  const corpus = new URLSearchParams(window.location.search).get('corpus');
+  let timer = null;
+  let pending = null;
+
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(() => {
+      if (pending) {
+        pending.abort();
+      }
+      const prefix = input.value.trim();
+      if (!prefix) {
+        datalist.replaceChildren();
+        return;
+      }
+      const params = new URLSearchParams({ q: prefix, kind: input.dataset.suggest });
+      if (corpus) {
+        params.set('corpus', corpus);
+      }
+      pending = new AbortController();
+      fetch(`/suggest?${params}`, { signal: pending.signal })
+        .then((response) => response.json())
+        .then((data) => {
+          datalist.replaceChildren(...data.suggestions.map((suggestion) => {
+            const option = document.createElement('option');
+            option.value = suggestion.value;
+            if (suggestion.text !== suggestion.value) {
+              option.label = suggestion.text;
+            }
+            return option;
+          }));
+        })
+        .catch(() => {});
+    }, SUGGEST_DELAY_MS);
+  });
+});
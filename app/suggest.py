@@ -0,0 +1,249 @@
+"""
+This module contains the prefix completion of search terms for the query pages.
+
+    The distinct token forms, lemmas and cast names of a corpus are kept in memory
+    as one sorted array of normalized keys per kind. The keys starting with a prefix
+    form a contiguous range of that array, found with two binary searches, and the
+    most frequent entries of the range are returned. Short prefixes match large
+    ranges, so their top entries are computed once when the index is built.
+    Corpora don't change once they are loaded, a new version is a new corpus, so an
+    index is built once per corpus id and kept until newer corpora push it out.
+"""
+import gc
+import heapq
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+from flask import current_app
+
+from app import db
+from app.models import CastItem, Speech, TokenForm
+from app.trigram import normalize_form
+
+KINDS = ("form", "lemma", "cast")
+# kinds of the forms in the token_form table
+FORM_KINDS = {"content": "form", "lemma": "lemma"}
+# prefixes up to this length have their top entries precomputed
+PRECOMPUTED_LENGTH = 2
+MAX_LIMIT = 50
+# indexes of different corpora kept at once
+DEFAULT_CACHE_SIZE = 4
+
+
+@dataclass(frozen=True)
+class Suggestion:
+    """
+    Completion of a prefix, value is what the query pages search for.
+    """
+    text: str
+    kind: str
+    weight: int
+    value: str
+
+    def to_dict(self) -> Dict:
+        return {"text": self.text, "kind": self.kind, "weight": self.weight,
+                "value": self.value}
+
+
+class PrefixIndex:
+    """
+    Class completing prefixes from a sorted array of keys.
+    """
+
+    def __init__(self, suggestions: Iterable[Suggestion]):
+        """
+        Args:
+            suggestions: entries to complete, keyed by their normalized text
+        """
+        entries = sorted(((normalize_form(suggestion.text), suggestion)
+                          for suggestion in suggestions if suggestion.text),
+                         key=lambda entry: (entry[0], -entry[1].weight))
+        self.keys: List[str] = [key for key, _ in entries]
+        self.suggestions: Tuple[Suggestion, ...] = tuple(s for _, s in entries)
+        self.top: Dict[str, Tuple[Suggestion, ...]] = self._precompute()
+
+    def _precompute(self) -> Dict[str, Tuple[Suggestion, ...]]:
+        ranges = defaultdict(list)
+        for key, suggestion in zip(self.keys, self.suggestions):
+            for length in range(1, min(len(key), PRECOMPUTED_LENGTH) + 1):
+                ranges[key[:length]].append(suggestion)
+        return {prefix: tuple(heapq.nlargest(MAX_LIMIT, found,
+                                             key=lambda suggestion: suggestion.weight))
+                for prefix, found in ranges.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def complete(self, prefix: str, limit: int) -> List[Suggestion]:
+        """
+        Get the most frequent entries starting with a normalized prefix.
+
+        Args:
+            prefix: normalized prefix, see app.trigram.normalize_form
+            limit: maximum number of entries, at most MAX_LIMIT
+
+        Returns:
+            list of suggestions, most frequent first
+        """
+        if len(prefix) <= PRECOMPUTED_LENGTH:
+            return list(self.top.get(prefix, ())[:limit])
+        start = bisect_left(self.keys, prefix)
+        # every key of the range sorts before the prefix followed by the last code point
+        end = bisect_left(self.keys, prefix + "\U0010ffff", start)
+        return heapq.nlargest(limit, self.suggestions[start:end],
+                              key=lambda suggestion: suggestion.weight)
+
+
+class SuggestIndex:
+    """
+    Class completing prefixes of the forms, lemmas and cast names of one corpus.
+    """
+
+    def __init__(self, suggestions: Iterable[Suggestion]):
+        by_kind = defaultdict(list)
+        for suggestion in suggestions:
+            by_kind[suggestion.kind].append(suggestion)
+        self.indexes: Dict[str, PrefixIndex] = {kind: PrefixIndex(by_kind[kind])
+                                                for kind in KINDS}
+
+    @classmethod
+    def from_session(cls, session=None) -> "SuggestIndex":
+        """
+        Build the index from a session scoped to a corpus, see app.corpus.scope_session.
+        """
+        session = session or db.session
+        suggestions = [
+            Suggestion(form, FORM_KINDS[kind], frequency or 0, form)
+            for kind, form, frequency in session.execute(
+                sa.select(TokenForm.kind, TokenForm.form, TokenForm.frequency))
+            if kind in FORM_KINDS
+        ]
+        speeches = dict(session.execute(
+            sa.select(Speech.cast_item_id, sa.func.count(Speech.id))
+            .group_by(Speech.cast_item_id)).all())
+        suggestions += [
+            Suggestion(name or cast_item_id, "cast", speeches.get(cast_item_id, 0),
+                       cast_item_id)
+            for cast_item_id, name in session.execute(sa.select(CastItem.id, CastItem.name))
+        ]
+        return cls(suggestions)
+
+    @classmethod
+    def from_store(cls, store) -> "SuggestIndex":
+        """
+        Build the index from the records of an app.memory.CorpusStore.
+        """
+        suggestions = [Suggestion(form.form, FORM_KINDS[form.kind], form.frequency or 0,
+                                  form.form)
+                       for form in store.all("token_form") if form.kind in FORM_KINDS]
+        suggestions += [Suggestion(item.name or item.id, "cast", len(item.speeches),
+                                   item.id)
+                        for item in store.all("cast_item")]
+        return cls(suggestions)
+
+    def suggest(self, prefix: str, kinds: Sequence[str] = KINDS,
+                limit: int = 10) -> List[Suggestion]:
+        """
+        Complete a prefix over several kinds, a text suggested for more than one kind
+            is returned once with its most frequent kind.
+
+        Args:
+            prefix: prefix typed by the user
+            kinds: kinds to complete, see KINDS
+            limit: maximum number of suggestions
+
+        Returns:
+            list of suggestions, most frequent first
+        """
+        prefix = normalize_form(prefix)
+        limit = max(0, min(limit, MAX_LIMIT))
+        if not prefix or not limit:
+            return []
+        candidates = heapq.merge(
+            *(self.indexes[kind].complete(prefix, limit)
+              for kind in kinds if kind in self.indexes),
+            key=lambda suggestion: -suggestion.weight)
+        suggestions, seen = [], set()
+        for suggestion in candidates:
+            if suggestion.text in seen:
+                continue
+            seen.add(suggestion.text)
+            suggestions.append(suggestion)
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+
+class SuggestCache:
+    """
+    Class keeping the indexes of the most recently used corpora.
+    """
+
+    def __init__(self, size: int = DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.indexes: "OrderedDict[str, SuggestIndex]" = OrderedDict()
+        # guards the indexes and the build locks, never held while an index is built
+        self.lock = threading.Lock()
+        # lock per corpus whose index is being built
+        self.building: Dict[str, threading.Lock] = {}
+
+    def _cached(self, corpus_id: str) -> Optional[SuggestIndex]:
+        index = self.indexes.get(corpus_id)
+        if index is not None:
+            self.indexes.move_to_end(corpus_id)
+        return index
+
+    def get(self, corpus_id: str, build) -> SuggestIndex:
+        """
+        Get the index of a corpus, built by calling build if it isn't cached.
+            Concurrent requests for a missing index wait for a single build, the
+            indexes of other corpora are served and built meanwhile.
+        """
+        with self.lock:
+            index = self._cached(corpus_id)
+            if index is not None:
+                return index
+            building = self.building.setdefault(corpus_id, threading.Lock())
+        with building:
+            with self.lock:
+                index = self._cached(corpus_id)
+            if index is not None:
+                return index
+            try:
+                index = build()
+                with self.lock:
+                    self.indexes[corpus_id] = index
+                    while len(self.indexes) > self.size:
+                        self.indexes.popitem(last=False)
+            finally:
+                # requests waiting for a failed build build the index themselves
+                with self.lock:
+                    if self.building.get(corpus_id) is building:
+                        del self.building[corpus_id]
+        return index
+
+
+def current_cache() -> Optional[SuggestCache]:
+    """
+    Get the index cache of the app.
+    """
+    return current_app.extensions.get("suggest_cache")
+
+
+def init_app(app) -> None:
+    """
+    Register the index cache with the app, has to be called after the in memory store
+        was loaded. The index of the stored corpus is built right away, so a
+        pre-forking server shares it between its workers.
+    """
+    cache = SuggestCache(app.config.get("SUGGEST_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    app.extensions["suggest_cache"] = cache
+    store = app.extensions.get("corpus_store")
+    if store is not None:
+        cache.get(store.corpus.id, lambda: SuggestIndex.from_store(store))
+        # like the store, keep the index out of the garbage collector's reach
+        gc.freeze()
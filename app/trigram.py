@@ -0,0 +1,187 @@
+"""
+This module contains the fuzzy lookup of token forms and lemmas in the character
+    trigram index built by the ingestion service.
+
+    `trigrams` mirrors ingestion/ingestion/trigram_index.py and has to stay in sync
+    with it, otherwise lookups won't hit the stored trigrams.
+"""
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import FormTrigram, Token, TokenForm, token_form_association_table
+
+
+def normalize_form(form: str) -> str:
+    """
+    Normalize a query the same way forms are normalized before they are indexed.
+    """
+    return form.strip().lower()
+
+
+def trigrams(form: str) -> Set[str]:
+    """
+    Split a normalized form into its blank padded character trigrams.
+    """
+    padded = f"  {form} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def default_max_distance(form: str) -> int:
+    """
+    Get the number of edits a spelling variant of the form may differ by.
+    """
+    if len(form) <= 2:
+        return 0
+    if len(form) <= 5:
+        return 1
+    return 2
+
+
+def levenshtein(a: str, b: str, max_distance: int) -> int:
+    """
+    Compute the edit distance of two strings, giving up as soon as it exceeds
+        max_distance.
+
+    Returns:
+        edit distance or max_distance + 1 if the strings are further apart
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def fuzzy_forms(query: str, kinds: Sequence[str] = ("content", "lemma"),
+                max_distance: int = None, limit: int = 50, session: Session = None
+                ) -> List[Tuple[TokenForm, int, float]]:
+    """
+    Find the indexed forms within max_distance edits of the query.
+        Candidates are all forms sharing enough trigrams with the query to possibly
+        be that close, every edit destroys at most three trigrams. The candidates
+        are then verified by their edit distance.
+
+    Args:
+        query: form or lemma to search for
+        kinds: kinds of forms to search
+        max_distance: maximum edit distance, derived from the query length if None
+        limit: maximum number of forms to return
+        session: session to query, the request session if None
+
+    Returns:
+        list of (form, edit distance, trigram jaccard similarity) tuples, closest
+            and most frequent forms first
+    """
+    # missing form fields are passed as None
+    query = normalize_form(query or "")
+    if not query:
+        return []
+    session = session or db.session
+    if max_distance is None:
+        max_distance = default_max_distance(query)
+    query_trigrams = trigrams(query)
+    min_shared = max(1, len(query_trigrams) - 3 * max_distance)
+
+    shared = sa.func.count(FormTrigram.trigram).label("shared")
+    candidates = dict(
+        session.query(FormTrigram.form_id, shared)
+        .filter(FormTrigram.trigram.in_(query_trigrams))
+        .group_by(FormTrigram.form_id)
+        .having(shared >= min_shared)
+        .all()
+    )
+    if not candidates:
+        return []
+
+    forms = session.query(TokenForm).filter(
+        TokenForm.id.in_(candidates), TokenForm.kind.in_(kinds))
+    return verify_forms(query, query_trigrams,
+                        ((form, candidates[form.id]) for form in forms), max_distance, limit)
+
+
+def verify_forms(query: str, query_trigrams: Set[str],
+                 candidates: Iterable[Tuple[TokenForm, int]], max_distance: int,
+                 limit: int) -> List[Tuple[TokenForm, int, float]]:
+    """
+    Keep the candidate forms within max_distance edits of the query and rank them.
+
+    Args:
+        query: normalized query
+        query_trigrams: trigrams of the query
+        candidates: (form, number of trigrams shared with the query) tuples
+        max_distance: maximum edit distance
+        limit: maximum number of forms to return
+
+    Returns:
+        list of (form, edit distance, trigram jaccard similarity) tuples, closest
+            and most frequent forms first
+    """
+    matches = []
+    for form, common in candidates:
+        distance = levenshtein(query, form.form, max_distance)
+        if distance > max_distance:
+            continue
+        jaccard = common / (len(query_trigrams) + form.trigram_count - common)
+        matches.append((form, distance, jaccard))
+
+    # a frequent variant one edit away beats a rare one sharing more trigrams, the
+    #  similarity only breaks ties
+    matches.sort(key=lambda match: (match[1], -match[0].frequency, -match[2]))
+    return matches[:limit]
+
+
+def fuzzy_tokens(query: str, kinds: Sequence[str] = ("content", "lemma"),
+                 max_distance: int = None, limit: int = None) -> List[Token]:
+    """
+    Get the tokens whose form or lemma is a spelling variant of the query by
+        following the postings of the matching forms.
+
+    Args:
+        limit: maximum number of tokens, all if None
+
+    Returns:
+        list of tokens, tokens of the closest forms first and in document order
+    """
+    ranks: Dict[str, int] = {
+        form.id: rank
+        for rank, (form, _, _) in enumerate(fuzzy_forms(query, kinds, max_distance))
+    }
+    if not ranks:
+        return []
+
+    association = token_form_association_table
+    postings = db.session.query(association.c.form_id, Token) \
+        .join(Token, sa.and_(Token.corpus_id == association.c.corpus_id,
+                             Token.id == association.c.token_id)) \
+        .filter(association.c.form_id.in_(ranks))
+    if limit is not None:
+        # a token has a posting of its form and of its lemma at most
+        postings = postings \
+            .order_by(sa.case(ranks, value=association.c.form_id), Token.id) \
+            .limit(len(kinds) * limit)
+    return rank_tokens(ranks, postings.all())[:limit]
+
+
+def rank_tokens(ranks: Dict[str, int], postings: Iterable[Tuple[str, Token]]) -> List[Token]:
+    """
+    Order the tokens of the postings by the best rank of their forms, then by id.
+    """
+    tokens = {}
+    for form_id, token in postings:
+        rank = ranks[form_id]
+        if token.id not in tokens or rank < tokens[token.id][0]:
+            tokens[token.id] = (rank, token)
+    return [token for _, token in sorted(tokens.values(), key=lambda t: (t[0], t[1].id))]
@@ -0,0 +1,44 @@
+from flask import Blueprint, abort, jsonify, request
+
+from app import hierarchy
+from app.memory import current_store
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+
+def _fields():
+    """
+    Collect the sparse fieldsets passed as fields[<level>]=<column>,<column>.
+    """
+    return {key[len("fields["):-1]: value for key, value in request.args.items()
+            if key.startswith("fields[") and key.endswith("]")}
+
+
+def _document(level, ids):
+    try:
+        projection = hierarchy.parse_fields(_fields())
+        depth = request.args.get("depth", "token")
+        if depth not in hierarchy.LEVELS:
+            raise hierarchy.FieldError(f"unknown depth {depth!r}")
+        store = current_store()
+        objects = store.get(hierarchy.MODELS[level].__tablename__, ids) if store else \
+            hierarchy.load(level, ids, projection, depth)
+    except hierarchy.FieldError as error:
+        return jsonify(error=str(error)), 400
+    if ids is not None and not objects:
+        abort(404)
+    return jsonify([hierarchy.to_dict(obj, level, projection, depth) for obj in objects])
+
+
+@bp.route('/<level>')
+def collection(level):
+    if level not in hierarchy.LEVELS[:2]:
+        abort(404)
+    return _document(level, None)
+
+
+@bp.route('/<level>/<item_id>')
+def item(level, item_id):
+    if level not in hierarchy.LEVELS:
+        abort(404)
+    return _document(level, [item_id])
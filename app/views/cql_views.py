@@ -0,0 +1,39 @@
+import json
+from itertools import islice
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+from app.cql import CqlQuery, CqlSyntaxError, parse_cursor, search
+
+bp = Blueprint('cql', __name__, url_prefix='/cql')
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+@bp.route('/', methods=["GET", "POST"])
+def cql():
+    """
+    Stream the matches of a CQL query as newline delimited json.
+        The last line holds the cursor to request the next page with, or null if
+        there are no more matches.
+    """
+    params = request.values
+    cursor = params.get("cursor")
+    try:
+        query = CqlQuery(params.get("q", ""))
+        parse_cursor(cursor)
+    except CqlSyntaxError as error:
+        return jsonify(error=str(error)), 400
+    limit = max(1, min(params.get("limit", DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+    def generate():
+        matches = search(query, cursor=cursor)
+        last = None
+        for match in islice(matches, limit):
+            last = match
+            yield json.dumps(match.to_dict()) + "\n"
+        has_more = last is not None and next(matches, None) is not None
+        yield json.dumps({"next": last.cursor if has_more else None}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
@@ -0,0 +1,19 @@
+from flask import Blueprint, current_app, jsonify
+
+bp = Blueprint('debug', __name__, url_prefix='/debug')
+
+
+@bp.route('/stats')
+def stats():
+    """
+    Percentiles of the request measurements per endpoint, collected by this worker.
+    """
+    return jsonify(current_app.extensions["endpoint_stats"].to_dict())
+
+
+@bp.route('/rejected')
+def rejected():
+    """
+    The last queries rejected by the cost guard of this worker.
+    """
+    return jsonify(current_app.extensions["rejected_queries"].to_dict())
@@ -1,19 +1,26 @@
 from flask import Blueprint, render_template
 from werkzeug.utils import redirect
 
+from app.guard import bounded
+from app.memory import current_store
 from app.models import CastGroup, CastRole, Act, Scene, Speech, Line, Token
 
 bp = Blueprint('main', __name__, url_prefix='/')
 
 @bp.route('/')
 def base():
-    cast_group = CastGroup.query.all()
-    cast_role = CastRole.query.all()
-    act = Act.query.all()
-    scene = Scene.query.all()
-    speech = Speech.query.all()
-    line = Line.query.all()
-    token = Token.query.all()
+    store = current_store()
+    if store:
+        return render_template('start.html', **{
+            table: bounded(store.all(table)) for table in
+            ("cast_group", "cast_role", "act", "scene", "speech", "line", "token")})
+    cast_group = bounded(CastGroup.query)
+    cast_role = bounded(CastRole.query)
+    act = bounded(Act.query)
+    scene = bounded(Scene.query)
+    speech = bounded(Speech.query)
+    line = bounded(Line.query)
+    token = bounded(Token.query)
     return render_template('start.html', cast_group=cast_group, cast_role=cast_role, act=act,
                             scene=scene, speech=speech, line=line, token=token)
 
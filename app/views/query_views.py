@@ -1,6 +1,8 @@
 from flask import Blueprint, render_template
 from werkzeug.utils import redirect
 
+from app.guard import bounded
+from app.memory import current_store
 from app.models import CastGroup, CastRole, Act, Scene, Speech, Line, Token
 
 bp = Blueprint('query', __name__, url_prefix='/query')
@@ -8,36 +10,43 @@ bp = Blueprint('query', __name__, url_prefix='/query')
 
 @bp.route('/cast_group')
 def cast_group():
-    cast_group = CastGroup.query.all()
+    store = current_store()
+    cast_group = bounded(store.all("cast_group") if store else CastGroup.query)
     return render_template('/queries/cast_group.html', cast_group=cast_group)
 
 @bp.route('/cast_role')
 def cast_role():
-    cast_role = CastRole.query.all()
+    store = current_store()
+    cast_role = bounded(store.all("cast_role") if store else CastRole.query)
     return render_template('/queries/cast_role.html', cast_role=cast_role)
 
 
 @bp.route('/act')
 def act():
-    act = Act.query.all()
+    store = current_store()
+    act = bounded(store.all("act") if store else Act.query)
     return render_template('/queries/act.html', act=act)
 
 @bp.route('/scene')
 def scene():
-    scene = Scene.query.all()
+    store = current_store()
+    scene = bounded(store.all("scene") if store else Scene.query)
     return render_template('/queries/scene.html', scene=scene)
 
 @bp.route('/speech')
 def speech():
-    speech = Speech.query.all()
+    store = current_store()
+    speech = bounded(store.all("speech") if store else Speech.query)
     return render_template('/queries/speech.html', speech=speech)
 
 @bp.route('/line')
 def line():
-    line = Line.query.all()
+    store = current_store()
+    line = bounded(store.all("line") if store else Line.query)
     return render_template('/queries/line.html', line=line)
 
 @bp.route('/token')
 def token():
-    token = Token.query.all()
+    store = current_store()
+    token = bounded(store.all("token") if store else Token.query)
     return render_template('/queries/token.html', token=token)
\ No newline at end of file
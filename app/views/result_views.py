@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, url_for, request
 from werkzeug.utils import redirect
 
-from app.models import CastGroup, CastRole, Act, Scene, Speech, Line, Token
+from app.guard import bounded
+from app.memory import current_store
+from app.models import CastGroup, CastRole, Act, Scene, Speech, Line
+from app.trigram import fuzzy_tokens
 
 bp = Blueprint('result', __name__, url_prefix='/result')
 
@@ -9,42 +12,57 @@ bp = Blueprint('result', __name__, url_prefix='/result')
 @bp.route('/cast_group', methods=["POST"])
 def cast_group2():
     query = request.form.get("query")
-    cast_group = CastGroup.query.filter(CastGroup.id.like('%{}%'.format(query))).all()
+    store = current_store()
+    cast_group = bounded(store.like("cast_group", query) if store else
+                         CastGroup.query.filter(CastGroup.id.like('%{}%'.format(query))))
     return render_template('/results/cast_group.html', cast_group=cast_group)
 
 @bp.route('/cast_role', methods=["POST"])
 def cast_role2():
     query = request.form.get("query")
-    cast_role = CastRole.query.filter(CastRole.cast_item_id.like('%{}%'.format(query))).all()
+    store = current_store()
+    cast_role = bounded(store.like("cast_role", query) if store else
+                        CastRole.query.filter(CastRole.cast_item_id.like('%{}%'.format(query))))
     return render_template('/results/cast_role.html', cast_role=cast_role)
 
 
 @bp.route('/act', methods=["POST"])
 def act2():
     query = request.form.get("query")
-    act = Act.query.filter(Act.content.like('%{}%'.format(query))).all()
+    store = current_store()
+    act = bounded(store.like("act", query) if store else
+                  Act.query.filter(Act.content.like('%{}%'.format(query))))
     return render_template('/results/act.html', act=act)
 
 @bp.route('/scene', methods=["POST"])
 def scene2():
     query = request.form.get("query")
-    scene = Scene.query.filter(Scene.content.like('%{}%'.format(query))).all()
+    store = current_store()
+    scene = bounded(store.like("scene", query) if store else
+                    Scene.query.filter(Scene.content.like('%{}%'.format(query))))
     return render_template('/results/scene.html', scene=scene)
 
 @bp.route('/speech', methods=["POST"])
 def speech2():
     query = request.form.get("query")
-    speech = Speech.query.filter(Speech.cast_item_id.like('%{}%'.format(query))).all()
+    store = current_store()
+    speech = bounded(store.like("speech", query) if store else
+                     Speech.query.filter(Speech.cast_item_id.like('%{}%'.format(query))))
     return render_template('/results/speech.html', speech=speech)
 
 @bp.route('/line', methods=["POST"])
 def line2():
     query = request.form.get("query")
-    line = Line.query.filter(Line.speech_id.like('%{}%'.format(query))).all()
+    store = current_store()
+    line = bounded(store.like("line", query) if store else
+                   Line.query.filter(Line.speech_id.like('%{}%'.format(query))))
     return render_template('/results/line.html', line=line)
 
 @bp.route('/token', methods=["POST"])
 def token2():
     query = request.form.get("query")
-    token = Token.query.filter(Token.content.like('%{}%'.format(query))).all()
+    # spelling variants are looked up in the trigram index instead of scanning
+    store = current_store()
+    token = bounded(store.fuzzy_tokens(query) if store else
+                    lambda limit: fuzzy_tokens(query, limit=limit))
     return render_template('/results/token.html', token=token)
\ No newline at end of file
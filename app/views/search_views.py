@@ -0,0 +1,65 @@
+from itertools import islice
+
+from flask import Blueprint, current_app, jsonify, request
+
+from app.cql import CqlQuery, CqlSyntaxError, search
+from app.shards import DEFAULT_TIMEOUT, DEFAULT_WORKERS, fan_out
+from app.trigram import fuzzy_forms
+
+bp = Blueprint('search', __name__, url_prefix='/search')
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def _fan_out(search_shard, key):
+    params = request.values
+    return fan_out(
+        search_shard, key,
+        limit=max(1, min(params.get("limit", DEFAULT_LIMIT, type=int), MAX_LIMIT)),
+        corpora=params.getlist("corpus") or None,
+        timeout=current_app.config.get("SHARD_TIMEOUT", DEFAULT_TIMEOUT),
+        workers=current_app.config.get("SHARD_WORKERS", DEFAULT_WORKERS),
+    )
+
+
+@bp.route('/forms', methods=["GET", "POST"])
+def forms():
+    """
+    Find the spelling variants of a form or lemma in all corpora, closest and most
+        frequent first.
+    """
+    query = request.values.get("q", "")
+    limit = max(1, min(request.values.get("limit", DEFAULT_LIMIT, type=int), MAX_LIMIT))
+
+    def search_shard(session, corpus):
+        return [{"corpus": corpus.name, "corpus_id": corpus.id, "kind": form.kind,
+                 "form": form.form, "frequency": form.frequency, "distance": distance,
+                 "jaccard": jaccard}
+                for form, distance, jaccard in fuzzy_forms(query, limit=limit,
+                                                           session=session)]
+
+    result = _fan_out(search_shard, key=lambda match: (
+        match["distance"], -match["frequency"], -match["jaccard"]))
+    return jsonify(result.to_dict())
+
+
+@bp.route('/cql', methods=["GET", "POST"])
+def cql():
+    """
+    Find the first matches of a CQL query in every corpus, ordered by corpus name.
+    """
+    try:
+        query = CqlQuery(request.values.get("q", ""))
+    except CqlSyntaxError as error:
+        return jsonify(error=str(error)), 400
+    limit = max(1, min(request.values.get("limit", DEFAULT_LIMIT, type=int), MAX_LIMIT))
+
+    def search_shard(session, corpus):
+        return [dict(match.to_dict(), corpus=corpus.name, corpus_id=corpus.id)
+                for match in islice(search(query, session=session), limit)]
+
+    result = _fan_out(search_shard, key=lambda match: (
+        match["corpus"], match["corpus_id"], match["speech_position"],
+        match["tokens"][0]["position"]))
+    return jsonify(result.to_dict())
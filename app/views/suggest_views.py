@@ -0,0 +1,46 @@
+from flask import Blueprint, current_app, g, jsonify, request
+
+from app import db
+from app.corpus import scope_session
+from app.suggest import KINDS, SuggestIndex, current_cache
+
+bp = Blueprint('suggest', __name__, url_prefix='/suggest')
+
+DEFAULT_LIMIT = 10
+
+
+def _index():
+    # the corpus was resolved for the request by app/corpus.py
+    corpus = g.get("corpus")
+    if corpus is None:
+        return None
+    store = current_app.extensions.get("corpus_store")
+    if store is not None and corpus is store.corpus:
+        return current_cache().get(store.corpus.id, lambda: SuggestIndex.from_store(store))
+
+    def build():
+        # the session is only scoped to the corpus, and its file attached, to build
+        #  the index, cached indexes answer without touching the corpus
+        scope_session(corpus)
+        return SuggestIndex.from_session(db.session)
+
+    return current_cache().get(corpus.id, build)
+
+
+@bp.route('', methods=["GET"])
+def suggest():
+    """
+    Complete the prefix q with the most frequent forms, lemmas and cast names of a
+        corpus, restricted to the kinds passed as kind=<kind>,<kind>.
+    """
+    kinds = [kind for value in request.args.getlist("kind") for kind in value.split(",")
+             if kind] or KINDS
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        return jsonify(error=f"unknown kind {sorted(unknown)[0]!r}"), 400
+    index = _index()
+    if index is None:
+        return jsonify(suggestions=[])
+    suggestions = index.suggest(request.args.get("q", ""), kinds,
+                                request.args.get("limit", DEFAULT_LIMIT, type=int))
+    return jsonify(suggestions=[suggestion.to_dict() for suggestion in suggestions])
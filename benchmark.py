@@ -0,0 +1,310 @@
+"""
+This module benchmarks the webapp against a synthetic corpus.
+
+    A TEI corpus of the requested size is generated and loaded with the ingestion
+    parser into a fresh sqlite database, or into a mariadb given by --mariadb. The
+    webapp is then created against that database and a weighted mix of start page,
+    /query/<entity> and /result/<entity> requests is replayed from concurrent
+    clients. Throughput, latency percentiles and memory per endpoint are written as
+    json, so runs before and after a change can be compared.
+
+    Requests go through the Flask test client in this process, they measure the
+    app and database but not a web server. Peak memory per endpoint is the peak of
+    python allocations while a single request runs alone, measured in a separate
+    sequential pass.
+
+    usage: python benchmark.py --acts 5 --concurrency 8 --requests 2000 -o bench.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import sqlalchemy as sa
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# the ingestion package, after the webapp so its app module does not shadow the webapp
+sys.path.append(os.path.join(BASE_DIR, "ingestion"))
+
+import config  # noqa: E402
+from app.instrumentation import percentiles  # noqa: E402
+
+CORPUS_NAME = "benchmark"
+CAST = ["Valentine", "Proteus", "Julia", "Silvia", "Launce", "Speed", "Thurio"]
+# (form, lemma, ana) of the synthetic tokens, spelling variants included
+WORDS = [
+    ("love", "love", "#n1"), ("loue", "love", "#n1"), ("lady", "lady", "#n1"),
+    ("my", "my", "#po"), ("sweet", "sweet", "#j"), ("cease", "cease", "#vvb"),
+    ("to", "to", "#pc-acp"), ("persuade", "persuade", "#vvi"),
+    ("gentle", "gentle", "#j"), ("friend", "friend", "#n1"), ("the", "the", "#d"),
+    ("and", "and", "#cc"), ("heart", "heart", "#n1"), ("hart", "heart", "#n1"),
+    ("madam", "madam", "#n1"), ("sir", "sir", "#n1"), ("fair", "fair", "#j"),
+]
+# (weight, method, path) of the replayed requests, {entity} is filled in by the mix
+ENTITIES = ["cast_group", "cast_role", "act", "scene", "speech", "line", "token"]
+MIX = [(1, "GET", "/")] \
+    + [(2, "GET", f"/query/{entity}") for entity in ENTITIES] \
+    + [(3, "POST", f"/result/{entity}") for entity in ENTITIES]
+# values posted as query to the result pages
+RESULT_QUERIES = {
+    "cast_group": ["", "group"], "cast_role": CAST, "act": ["ACT 1", "ACT"],
+    "scene": ["Scene 1", "Scene"], "speech": CAST, "line": ["sp-0001", "sp-00"],
+    "token": ["love", "lovee", "hart", "gentel"],
+}
+
+
+###
+# synthetic corpus
+def synthetic_tei(acts: int, scenes: int, speeches: int, lines: int, tokens: int,
+                  seed: int = 0) -> str:
+    """
+    Generate a TEI play with the given number of elements per parent element.
+
+    Returns:
+        xml string
+    """
+    rng = random.Random(seed)
+    out = ['<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><titleStmt>'
+           '<title>Benchmark</title></titleStmt></fileDesc></teiHeader><text><front>'
+           '<castList>']
+    for name in CAST:
+        out.append(f'<castItem xml:id="{name}_B"><role><name>{name}</name></role>'
+                   f'<roleDesc>a character</roleDesc></castItem>')
+    out.append('</castList></front><body>')
+    counters = defaultdict(int)
+
+    def next_id(kind):
+        counters[kind] += 1
+        return f"{kind}-{counters[kind]:07d}"
+
+    for act in range(1, acts + 1):
+        out.append(f'<div type="act" n="{act}"><head>ACT {act}</head>')
+        for scene in range(1, scenes + 1):
+            out.append(f'<div type="scene" n="{scene}"><head>Scene {scene}</head>')
+            first, second = rng.sample(CAST, 2)
+            out.append(f'<stage xml:id="{next_id("stg")}" who="#{first}_B #{second}_B">'
+                       f'Enter {first} and {second}</stage>')
+            for _ in range(speeches):
+                speaker = rng.choice(CAST)
+                out.append(f'<sp xml:id="{next_id("sp")}" who="#{speaker}_B">'
+                           f'<speaker>{speaker}</speaker>')
+                for _ in range(lines):
+                    out.append(f'<l xml:id="{next_id("ftln")}">')
+                    for _ in range(tokens):
+                        form, lemma, ana = rng.choice(WORDS)
+                        out.append(f'<w xml:id="{next_id("w")}" lemma="{lemma}" '
+                                   f'ana="{ana}">{form}</w> ')
+                    out.append('</l>')
+                out.append('</sp>')
+            out.append('</div>')
+        out.append('</div>')
+    out.append('</body></text></TEI>')
+    return "".join(out)
+
+
+def load_corpus(xml_string: str, sqlite_path: str = None, mariadb: str = None) -> str:
+    """
+    Load the corpus with the ingestion parser.
+
+    Args:
+        xml_string: TEI corpus
+        sqlite_path: path of the sqlite database to create, without .db suffix
+        mariadb: mariadb url, used instead of sqlite if given
+
+    Returns:
+        sqlalchemy url of the database for the webapp
+    """
+    from ingestion.tei_xml_parser import TeiXmlParser
+
+    if mariadb:
+        url = sa.engine.make_url(mariadb)
+        parser = TeiXmlParser(url.username, url.password, url.host, url.port,
+                              url.database)
+        app_url = str(url.set(drivername="mariadb+mariadbconnector"))
+    else:
+        # the connector opens sqlite databases relative to the parent of the working
+        #  directory
+        relative = os.path.relpath(sqlite_path, os.path.dirname(os.getcwd()))
+        parser = TeiXmlParser(None, None, None, None, relative)
+        app_url = f"sqlite:///{sqlite_path}.db"
+    parser.upgrade_schema()
+    parser.parse(xml_string, corpus_name=CORPUS_NAME, replace=True)
+    parser.engine.dispose()
+    return app_url
+
+
+###
+# replay
+def latency(values: List[float]) -> Dict[str, float]:
+    return {name: round(value, 3) for name, value in percentiles(values).items()} \
+        if values else {}
+
+
+def request_plan(count: int, seed: int) -> List[Tuple[str, str, Dict]]:
+    """
+    Draw the requests to replay from the mix.
+
+    Returns:
+        list of (method, path, form data) tuples
+    """
+    rng = random.Random(seed)
+    weights = [weight for weight, _, _ in MIX]
+    plan = []
+    for weight, method, path in rng.choices(MIX, weights=weights, k=count):
+        data = {}
+        if method == "POST":
+            data = {"query": rng.choice(RESULT_QUERIES[path.rsplit("/", 1)[1]])}
+        plan.append((method, path, data))
+    return plan
+
+
+def replay(app, plan: List[Tuple[str, str, Dict]], concurrency: int) -> Dict:
+    """
+    Send the planned requests from concurrent clients.
+
+    Returns:
+        results with overall and per endpoint throughput and latency
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    position = iter(range(len(plan)))
+
+    def client():
+        test_client = app.test_client()
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            method, path, data = plan[index]
+            started = time.perf_counter()
+            response = test_client.open(path, method=method, data=data)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies[path].append(elapsed)
+                if response.status_code >= 400:
+                    errors[path] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    every = [latency for values in latencies.values() for latency in values]
+    return {
+        "total": {"requests": len(every), "errors": sum(errors.values()),
+                  "seconds": round(wall_time, 3),
+                  "throughput_rps": round(len(every) / wall_time, 2),
+                  "latency_ms": latency(every)},
+        "endpoints": {path: {"requests": len(values), "errors": errors[path],
+                             "throughput_rps": round(len(values) / wall_time, 2),
+                             "latency_ms": latency(values)}
+                      for path, values in sorted(latencies.items())},
+    }
+
+
+def measure_memory(app, plan: List[Tuple[str, str, Dict]], samples: int) -> Dict[str, float]:
+    """
+    Get the peak of python allocations per endpoint while single requests run alone.
+
+    Returns:
+        dict of endpoint path and peak in kilobytes
+    """
+    test_client = app.test_client()
+    peaks = defaultdict(float)
+    seen = defaultdict(int)
+    tracemalloc.start()
+    try:
+        for method, path, data in plan:
+            if seen[path] >= samples:
+                continue
+            seen[path] += 1
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            test_client.open(path, method=method, data=data)
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[path] = max(peaks[path], (peak - baseline) / 1024)
+    finally:
+        tracemalloc.stop()
+    return {path: round(peak, 1) for path, peak in peaks.items()}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__,
+                                         formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument("-o", "--output", help="json file to write, stdout if omitted")
+    arg_parser.add_argument("--acts", type=int, default=5)
+    arg_parser.add_argument("--scenes", type=int, default=3, help="scenes per act")
+    arg_parser.add_argument("--speeches", type=int, default=20, help="speeches per scene")
+    arg_parser.add_argument("--lines", type=int, default=4, help="lines per speech")
+    arg_parser.add_argument("--tokens", type=int, default=8, help="tokens per line")
+    arg_parser.add_argument("--requests", type=int, default=1000,
+                            help="number of requests to replay")
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--memory-samples", type=int, default=3,
+                            help="requests per endpoint measured for peak memory")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--mariadb", help="mariadb url to load the corpus into, "
+                                              "e.g. mariadb://user:pw@localhost:3306/bench")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                            help="override a webapp config value, e.g. IN_MEMORY=1")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        xml_string = synthetic_tei(args.acts, args.scenes, args.speeches, args.lines,
+                                   args.tokens, args.seed)
+        started = time.perf_counter()
+        config.SQLALCHEMY_DATABASE_URI = load_corpus(
+            xml_string, os.path.join(workdir, "benchmark"), args.mariadb)
+        load_seconds = time.perf_counter() - started
+        overrides = dict(setting.split("=", 1) for setting in args.set)
+        for key, value in overrides.items():
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            setattr(config, key, value)
+        config.CORPUS = CORPUS_NAME
+
+        from app import create_app
+        app = create_app()
+        plan = request_plan(args.requests, args.seed)
+        # one pass of every endpoint first, so caches and pools are warm
+        replay(app, [(method, path, {"query": ""} if method == "POST" else {})
+                     for _, method, path in MIX], 1)
+        results = replay(app, plan, args.concurrency)
+        memory = measure_memory(app, plan, args.memory_samples)
+
+    for path, endpoint in results["endpoints"].items():
+        endpoint["peak_alloc_kb"] = memory.get(path)
+    report = {
+        "settings": {**vars(args), "database": "mariadb" if args.mariadb else "sqlite",
+                     "overrides": overrides},
+        "corpus": {"tokens": args.acts * args.scenes * args.speeches * args.lines
+                   * args.tokens, "load_seconds": round(load_seconds, 3)},
+        **results,
+        # kilobytes on linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file_pointer:
+            file_pointer.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,34 @@
 import os
+import sqlite3
 
 BASE_DIR = os.path.dirname(__file__)
 
 SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(os.path.join(BASE_DIR, 'verona.db'))
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# read only snapshot built with ingestion/local_snapshot.py, served instead of verona.db
+SNAPSHOT = os.getenv("TT_SNAPSHOT")
+if SNAPSHOT:
+    SNAPSHOT = os.path.abspath(SNAPSHOT)
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(SNAPSHOT)
+    # immutable files are read without locking or checking for changes
+    SQLALCHEMY_ENGINE_OPTIONS = {"creator": lambda: sqlite3.connect(
+        'file:{}?mode=ro&immutable=1'.format(SNAPSHOT), uri=True, check_same_thread=False)}
+# bytes of a sqlite database memory mapped by each connection
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+# serve the corpus from memory, loaded once at startup (see app/memory.py)
+IN_MEMORY = os.getenv("TT_IN_MEMORY", "").lower() in ("1", "true", "yes")
+# statements taking longer are logged with their query plan
+SLOW_QUERY_MS = 100
+# expose the request measurements of each worker on /debug/stats and the rejected
+#  queries with their parameters on /debug/rejected, only for development
+DEBUG_STATS = os.getenv("TT_DEBUG_STATS", "0").lower() in ("1", "true", "yes")
+# prefix indexes of different corpora kept by the suggest endpoint
+SUGGEST_CACHE_SIZE = 4
+# rows shown per endpoint, queries matching more are cut off (see app/guard.py)
+DEFAULT_ROW_LIMIT = 1000
+ROW_LIMITS = {"result.token2": 500}
+# statements estimated to examine more rows are rejected unless they can stop early
+QUERY_COST_LIMIT = 1000000
+# seconds a statement of a request may run
+STATEMENT_TIMEOUT = 5.0
@@ -4,14 +4,20 @@ according to the openapi3 schema defined in $TT_APP_SPEC_DIR/$TT_APP_SPEC_FILE
 using connexion.
 This service should the offer at least one endpoint to start the ETL pipeline for a
 provided TEI xml corpus.
+Every request is parsed by its own parser, so the service can run with several
+worker processes and threads (gunicorn -c gunicorn.conf.py "app:create_app()").
+Large or compressed corpora are best sent to /ingest/stream, which writes the request
+body to disk in chunks instead of reading it into memory like the connexion endpoints.
 """
 import os
+import shutil
+import tempfile
+from pathlib import Path
 
-import connexion
+import flask
 from dotenv import load_dotenv
 
-from ingestion.tei_xml_parser import TeiXmlParser
-from ingestion.tei_sql_schema import Base
+from ingestion.database_connector import DatabaseConnector
 
 # load env vars from .env file
 load_dotenv("app.env")
@@ -21,36 +27,133 @@ DB_PASSWORD = os.getenv("TT_DB_PASSWORD")
 DB_HOST = os.getenv("TT_DB_HOST")
 DB_PORT = os.getenv("TT_DB_PORT")
 DB_NAME = os.getenv("TT_DB_NAME")
+# directory of the parse cache, corpora are always parsed if unset
+PARSE_CACHE = os.getenv("TT_PARSE_CACHE")
+# processes parsing the acts of a large corpus, jobs already run side by side in the
+#  gunicorn workers, so a job parses serially by default
+PARSE_WORKERS = int(os.getenv("TT_PARSE_WORKERS", "1"))
 # get env vars specifying service
 APP_SPEC_DIR = os.getenv("TT_APP_SPEC_DIR", "openapi/")
 APP_SPEC_FILE = os.getenv("TT_APP_SPEC_FILE")
-APP_PORT = int(os.getenv("TT_APP_PORT"))
+APP_PORT = int(os.getenv("TT_APP_PORT", "8080"))
+# directory of streamed uploads while they are parsed, the system default if unset
+UPLOAD_DIR = os.getenv("TT_UPLOAD_DIR")
+# bytes copied from a streamed request body at once
+CHUNK_SIZE = 1024 * 1024
 
-# connect to db and initialize parser
-PARSER = TeiXmlParser(
-    host=DB_HOST,
-    port=DB_PORT,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    database=DB_NAME
-)
 
+def new_parser():
+    """
+    Create the parser of a single ingestion job, parsers hold the state of the
+        corpus they load. All parsers of a process share the engine and its pool.
+    """
+    # lxml and the parser are loaded with the first job, not at startup
+    from ingestion.tei_xml_parser import TeiXmlParser
 
-def ingest(xml_string=None):
-    PARSER.parse(xml_string)
+    return TeiXmlParser(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+        cache_dir=PARSE_CACHE,
+        workers=PARSE_WORKERS
+    )
 
 
-if __name__ == '__main__':
-    # create defined schema in database
-    # this is probably pretty dumb to do on every startup...
-    # TODO: only do this when no database is present
-    Base.metadata.create_all(PARSER.engine)
+class UnreadableCorpus(ValueError):
+    """
+    Raised for request content which isn't a readable corpus, answered with 400.
+    """
+
+
+def parse(source, corpus_name: str, replace: bool) -> str:
+    from lxml import etree
+    from ingestion.corpus_source import CorpusSourceError
+
+    parser = new_parser()
+    try:
+        return parser.parse(source, corpus_name=corpus_name, replace=replace)
+    except etree.XMLSyntaxError as error:
+        raise UnreadableCorpus(f"corpus isn't well-formed xml: {error}") from error
+    except CorpusSourceError as error:
+        # unsupported, truncated or corrupt compressed content
+        raise UnreadableCorpus(f"corpus can't be read: {error}") from error
+    finally:
+        parser.close()
+
+
+def ingest(body=None, file=None, corpus_name="corpus", replace=False):
+    # connexion passes the form fields as body, uploaded files are spooled to disk by
+    #  werkzeug and parsed from there. The xml string is always parsed as document,
+    #  it is never opened as a path on the server.
+    source = body.get("xml_string") if isinstance(body, dict) else body
+    if file is not None:
+        source = file.stream
+    if not source:
+        return {"detail": "no corpus in request"}, 400
+    if not isinstance(source, (str, bytes)) and not hasattr(source, "read"):
+        return {"detail": "xml_string has to be a string"}, 400
+    try:
+        return {"corpus_id": parse(source, corpus_name, replace)}
+    except UnreadableCorpus as error:
+        return {"detail": str(error)}, 400
+
+
+def ingest_stream():
+    """
+    Ingest the raw request body, plain or compressed xml.
+        Registered on the flask app directly, connexion would read the whole body
+        into memory for validation.
+    """
+    corpus_name = flask.request.args.get("corpus_name", "corpus")
+    replace = flask.request.args.get("replace", "false").lower() in ("1", "true")
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".upload") as upload:
+        shutil.copyfileobj(flask.request.stream, upload, CHUNK_SIZE)
+        upload.flush()
+        if upload.tell() == 0:
+            return flask.jsonify({"detail": "empty request body"}), 400
+        try:
+            corpus_id = parse(Path(upload.name), corpus_name, replace)
+        except UnreadableCorpus as error:
+            return flask.jsonify({"detail": str(error)}), 400
+    return flask.jsonify({"corpus_id": corpus_id})
+
+
+def upgrade_schema() -> None:
+    """
+    Migrate the database to the schema revision of the parser, once before the
+        service starts. A database which is up to date costs a single query.
+    """
+    connector = DatabaseConnector(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    connector.upgrade_schema()
+    connector.close()
+    # don't hand pooled connections down to forked workers
+    connector.engine.dispose()
+
+
+def create_app():
+    """
+    Create the service, the wsgi app run by gunicorn (see gunicorn.conf.py).
+    """
+    import connexion
 
     app = connexion.App(
         __name__,
         specification_dir=APP_SPEC_DIR
     )
     app.add_api(APP_SPEC_FILE)
-    # TODO: it would probably be great to run this with gunicorn instead of the flask
-    #  wsgi
-    app.run(port=APP_PORT)
+    app.app.add_url_rule("/ingest/stream", view_func=ingest_stream, methods=["POST"])
+    return app
+
+
+if __name__ == '__main__':
+    # development server, run the service with gunicorn otherwise
+    upgrade_schema()
+    create_app().run(port=APP_PORT)
@@ -1,3 +1,3 @@
 #!/bin/bash
 
-python app.py
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py "app:create_app()"
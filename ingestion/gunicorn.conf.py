@@ -0,0 +1,24 @@
+"""
+gunicorn settings of the ingestion service.
+
+    Parsing is cpu bound and holds the GIL, so corpora are ingested in parallel by
+    worker processes. The threads of a worker keep accepting uploads while a corpus
+    is parsed. Every worker has its own connection pool, keep workers * threads * 2
+    below the connection limit of the database.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('TT_APP_PORT', '8080')}"
+workers = int(os.getenv("TT_WORKERS", min(4, multiprocessing.cpu_count())))
+worker_class = "gthread"
+threads = int(os.getenv("TT_THREADS", "4"))
+# large corpora take minutes to upload and parse
+timeout = int(os.getenv("TT_WORKER_TIMEOUT", "900"))
+graceful_timeout = 60
+
+
+def on_starting(server):
+    # once in the arbiter, before the workers are forked
+    from app import upgrade_schema
+    upgrade_schema()
@@ -0,0 +1,133 @@
+"""
+This module contains the pre-scan of a TEI file for the byte regions of its acts, so
+    the acts of a single large corpus can be parsed in parallel.
+
+    The scan walks the div tags between <body> and </body> of the raw file, counting
+    their depth to find where each div[@type='act'] ends. Comments, CDATA sections
+    and processing instructions are skipped, so tags inside them aren't counted.
+    What remains once the acts are cut out, the skeleton, is a small well-formed
+    document with the header and the castList. An act region is parsed on its own
+    by wrapping it in an element declaring the namespaces in scope at the body.
+
+    Only uncompressed files with an ascii compatible encoding and without an internal
+    DTD subset, whose entities the act regions couldn't resolve, can be split.
+"""
+import mmap
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from xml.sax.saxutils import quoteattr
+
+from lxml import etree
+
+from .corpus_source import MAGIC_LENGTH, compression
+
+_MARKUP = re.compile(
+    rb"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<(/?)(?:[\w.-]+:)?div\b([^>]*)>",
+    re.DOTALL)
+_ACT = re.compile(rb"""\btype\s*=\s*["']act["']""")
+_BODY_START = re.compile(rb"<(?:[\w.-]+:)?body\b[^>]*>")
+_BODY_END = re.compile(rb"</(?:[\w.-]+:)?body\s*>")
+_INTERNAL_SUBSET = re.compile(rb"<!DOCTYPE[^>\[]*\[")
+# encodings whose markup isn't ascii
+_WIDE_ENCODINGS = ("utf-16", "utf-32", "ucs")
+
+
+@dataclass
+class ActRegions:
+    """
+    Byte regions of the acts of a file and the context needed to parse them.
+    """
+    path: str
+    regions: List[Tuple[int, int]]
+    # document left once the acts are cut out
+    skeleton: bytes = field(repr=False, default=b"")
+    # wrapper around a region making it a document of its own
+    prolog: bytes = field(repr=False, default=b"")
+    epilog: bytes = field(repr=False, default=b"")
+
+    def skeleton_tree(self) -> etree._ElementTree:
+        return etree.ElementTree(etree.fromstring(self.skeleton,
+                                                  etree.XMLParser(huge_tree=True)))
+
+    def region_document(self, index: int) -> bytes:
+        """
+        Read an act region from the file as document of its own.
+        """
+        start, end = self.regions[index]
+        with open(self.path, "rb") as file_pointer:
+            file_pointer.seek(start)
+            return self.prolog + file_pointer.read(end - start) + self.epilog
+
+
+def _scan(data, start: int, end: int) -> Optional[List[Tuple[int, int]]]:
+    regions = []
+    depth = 0
+    act_start = act_depth = None
+    for match in _MARKUP.finditer(data, start, end):
+        if match.group(2) is None:
+            # comment, cdata or processing instruction
+            continue
+        closing, attributes = match.groups()
+        if closing:
+            depth -= 1
+            if act_start is not None and depth == act_depth:
+                regions.append((act_start, match.end()))
+                act_start = None
+        elif not attributes.rstrip().endswith(b"/"):
+            if act_start is None and _ACT.search(attributes):
+                act_start, act_depth = match.start(), depth
+            depth += 1
+    if depth != 0 or act_start is not None:
+        # unbalanced divs, leave the file to the serial parser
+        return None
+    return regions
+
+
+def scan_acts(path: str, min_acts: int = 2) -> Optional[ActRegions]:
+    """
+    Find the act regions of a TEI file.
+
+    Args:
+        path: path of the file
+        min_acts: minimum number of acts worth splitting the file for
+
+    Returns:
+        act regions or None if the file can't be split or has too few acts
+    """
+    with open(path, "rb") as file_pointer:
+        if compression(file_pointer.read(MAGIC_LENGTH)) is not None:
+            return None
+        file_pointer.seek(0, 2)
+        if file_pointer.tell() == 0:
+            return None
+        file_pointer.seek(0)
+        with mmap.mmap(file_pointer.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:2] in (b"\xff\xfe", b"\xfe\xff"):
+                return None
+            body_start = _BODY_START.search(data)
+            body_end = body_start and _BODY_END.search(data, body_start.end())
+            if body_end is None:
+                return None
+            regions = _scan(data, body_start.end(), body_end.start())
+            if regions is None or len(regions) < min_acts:
+                return None
+            first, last = regions[0][0], regions[-1][1]
+            if _INTERNAL_SUBSET.search(data, 0, first):
+                return None
+            act_regions = ActRegions(path=path, regions=regions,
+                                     skeleton=data[:first] + data[last:])
+
+    skeleton = act_regions.skeleton_tree()
+    encoding = skeleton.docinfo.encoding or "UTF-8"
+    if encoding.lower().startswith(_WIDE_ENCODINGS):
+        return None
+    body = next(element for element in skeleton.iter()
+                if isinstance(element.tag, str) and etree.QName(element).localname == "body")
+    declarations = " ".join(f"xmlns:{prefix}={quoteattr(uri)}" if prefix
+                            else f"xmlns={quoteattr(uri)}"
+                            for prefix, uri in body.nsmap.items())
+    prolog = f'<?xml version="1.0" encoding="{encoding}"?>\n<acts {declarations}>'
+    act_regions.prolog = prolog.encode(encoding)
+    act_regions.epilog = "</acts>".encode(encoding)
+    return act_regions
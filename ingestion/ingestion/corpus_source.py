@@ -0,0 +1,234 @@
+"""
+This module contains the reading of corpus sources into lxml trees.
+
+    A source can be a file path, a binary file object, bytes, a memory mapped file or
+    an xml string. Plain strings are always read as documents, never as paths, so
+    request content can't name files on the server: paths have to be os.PathLike.
+    Sources compressed with gzip, bz2, xz or zstd are recognized by their magic bytes
+    and decompressed while lxml reads them, zstd needs the optional zstandard
+    package. Uncompressed files are read by libxml2 directly from disk and streams
+    are fed to lxml in chunks, so no copy of the whole document is held in python.
+    The content hash of a source identifies the corpus in the parse cache.
+"""
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Union
+
+from lxml import etree
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+Source = Union[str, os.PathLike, bytes, bytearray, memoryview, mmap.mmap, BinaryIO]
+
+# longest magic number checked
+MAGIC_LENGTH = 6
+MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+# bytes read at once while hashing a source
+HASH_CHUNK_SIZE = 1024 * 1024
+# raised by the decompressors for truncated or corrupt input
+DECOMPRESSION_ERRORS = (EOFError, OSError, zlib.error, lzma.LZMAError) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class CorpusSourceError(ValueError):
+    """
+    Raised for sources which can't be read.
+    """
+
+
+def _open_zstd(stream: BinaryIO) -> BinaryIO:
+    if zstandard is None:
+        raise CorpusSourceError("zstd compressed corpora need the zstandard package")
+    return zstandard.ZstdDecompressor().stream_reader(stream, closefd=False)
+
+
+DECOMPRESSORS: Dict[str, Callable[[BinaryIO], BinaryIO]] = {
+    "gzip": lambda stream: gzip.GzipFile(fileobj=stream, mode="rb"),
+    "bz2": bz2.BZ2File,
+    "xz": lzma.LZMAFile,
+    "zstd": _open_zstd,
+}
+
+
+def compression(head: bytes) -> Optional[str]:
+    """
+    Get the compression format from the first bytes of a source.
+
+    Returns:
+        name of the format or None if the source isn't compressed
+    """
+    for magic, name in MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+class _PrefixedStream(io.RawIOBase):
+    """
+    Unseekable stream with the bytes already read from it put back in front.
+    """
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _peek(stream: BinaryIO):
+    """
+    Read the magic bytes of a stream without consuming them.
+
+    Returns:
+        tuple of the bytes and a stream still starting with them
+    """
+    if hasattr(stream, "peek"):
+        return stream.peek(MAGIC_LENGTH)[:MAGIC_LENGTH], stream
+    if stream.seekable():
+        position = stream.tell()
+        head = stream.read(MAGIC_LENGTH)
+        stream.seek(position)
+        return head, stream
+    head = stream.read(MAGIC_LENGTH)
+    return head, io.BufferedReader(_PrefixedStream(head, stream))
+
+
+@contextmanager
+def _decompressed(stream: BinaryIO, name: Optional[str]) -> Iterator[BinaryIO]:
+    if name is None:
+        yield stream
+        return
+    # the errors of reading the decompressed stream surface where the document is read
+    try:
+        with DECOMPRESSORS[name](stream) as decompressed:
+            yield decompressed
+    except DECOMPRESSION_ERRORS as error:
+        raise CorpusSourceError(f"corpus isn't valid {name} data: {error}") from error
+
+
+@contextmanager
+def open_source(source: Source) -> Iterator[Union[str, bytes, BinaryIO]]:
+    """
+    Open a source for reading its document.
+
+    Args:
+        source: xml string, os.PathLike path, bytes, memory map or binary file
+            object, the latter are read from their current position and not closed
+
+    Returns:
+        context manager yielding the path of an uncompressed file, the bytes of an
+        uncompressed document or a binary stream of the decompressed document
+
+    Raises:
+        CorpusSourceError: for unsupported sources and, once read, compressed sources
+            which are truncated or corrupt
+    """
+    if isinstance(source, str):
+        yield source.encode("utf-8")
+    elif isinstance(source, os.PathLike):
+        path = os.fspath(source)
+        with open(path, "rb") as stream:
+            name = compression(stream.read(MAGIC_LENGTH))
+            if name is None:
+                # let the reader open the file itself
+                yield path
+            else:
+                stream.seek(0)
+                with _decompressed(stream, name) as decompressed:
+                    yield decompressed
+    elif isinstance(source, mmap.mmap):
+        # read in chunks from the mapped pages, no copy of the whole map
+        source.seek(0)
+        with _decompressed(source, compression(source[:MAGIC_LENGTH])) as decompressed:
+            yield decompressed
+    elif isinstance(source, bytes) and compression(source[:MAGIC_LENGTH]) is None:
+        yield source
+    elif isinstance(source, (bytes, bytearray, memoryview)) or hasattr(source, "read"):
+        stream = source if hasattr(source, "read") else io.BytesIO(source)
+        head, stream = _peek(stream)
+        with _decompressed(stream, compression(head)) as decompressed:
+            yield decompressed
+    else:
+        raise CorpusSourceError(f"can't read a corpus from {type(source).__name__}")
+
+
+def read_tree(source: Source, huge_tree: bool = True) -> etree._ElementTree:
+    """
+    Parse a corpus from any supported source.
+
+    Args:
+        source: see open_source
+        huge_tree: lift the libxml2 limits on depth and text size
+
+    Returns:
+        parsed document
+    """
+    parser = etree.XMLParser(huge_tree=huge_tree)
+    if isinstance(source, str):
+        # the string is already decoded, ignore the encoding it declares
+        parser = etree.XMLParser(huge_tree=huge_tree, encoding="utf-8")
+    with open_source(source) as opened:
+        if isinstance(opened, bytes):
+            return etree.ElementTree(etree.fromstring(opened, parser))
+        return etree.parse(opened, parser)
+
+
+def content_hash(source: Source) -> str:
+    """
+    Get the sha256 digest of the decompressed document of a source, the same for
+        a corpus however it is compressed or passed.
+        File objects are moved back to their position afterwards, so unseekable
+        streams can't be hashed.
+
+    Args:
+        source: see open_source
+
+    Returns:
+        hex digest
+    """
+    position = None
+    if hasattr(source, "read") and not isinstance(source, mmap.mmap):
+        if not source.seekable():
+            raise CorpusSourceError("can't hash a corpus from an unseekable stream")
+        position = source.tell()
+    digest = hashlib.sha256()
+    try:
+        with open_source(source) as opened:
+            if isinstance(opened, bytes):
+                digest.update(opened)
+                return digest.hexdigest()
+            with ExitStack() as stack:
+                if isinstance(opened, str):
+                    opened = stack.enter_context(open(opened, "rb"))
+                for chunk in iter(lambda: opened.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+    finally:
+        if position is not None:
+            source.seek(position)
+    return digest.hexdigest()
@@ -1,13 +1,99 @@
 """
 This module contains the DatabaseConnector class to connect and load data into a
     mariadb service using sqlalchemy.
+
+    Every parsed corpus gets its own storage: a list partition of each table on
+    mariadb or a database file attached to the connection on sqlite. Dropping or
+    replacing a corpus is therefore a partition or file operation instead of deleting
+    its rows table by table.
+
+    Connectors of the same database share one engine and its connection pool, so a
+    connector can be created per ingestion job. A corpus is loaded on its own
+    connection and committed every FLUSH_SIZE rows, it only becomes visible once its
+    created_at is set after the last batch.
+
+    On mariadb a transaction writing a table holds its metadata lock until it
+    commits, and adding or dropping a partition needs the locks exclusively. The short
+    batch transactions of a load let the partition ddl of other jobs in between two
+    batches, concurrent jobs don't wait for each other's loads. Partition ddl runs
+    outside of any loading transaction and waits at most DDL_LOCK_WAIT seconds at a
+    time for the locks: reads queue behind a waiting ddl, so it gives up and is
+    retried instead of stalling them.
 """
-from typing import List
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
 
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
 
-from .tei_sql_schema import Base
+from .tei_sql_schema import Base, Corpus, CORPUS_TABLES, SCHEMA_REVISION
+
+# connection pool of mariadb engines, a loading corpus holds up to two connections
+POOL_SIZE = int(os.getenv("TT_DB_POOL_SIZE", "8"))
+POOL_OVERFLOW = int(os.getenv("TT_DB_POOL_OVERFLOW", "8"))
+# seconds before pooled connections are replaced, below the server's wait_timeout
+POOL_RECYCLE = 3600
+# loading corpora only write their own partitions, skip the gap locks of the
+#  default repeatable read level
+ISOLATION_LEVEL = "READ COMMITTED"
+# seconds sqlite waits for the lock of a database file held by another job
+SQLITE_TIMEOUT = 30
+# rows of a loading corpus committed at once
+FLUSH_SIZE = 1000
+# seconds a partition ddl waits for the metadata locks of a table at a time
+DDL_LOCK_WAIT = int(os.getenv("TT_DB_DDL_LOCK_WAIT", "2"))
+# pause between two attempts of a partition ddl, lets the queued reads through
+DDL_RETRY_PAUSE = 1.0
+# seconds a new corpus waits for its partitions, i.e. for the batches and ddl of the
+#  jobs running already
+ADD_PARTITION_TIMEOUT = int(os.getenv("TT_DB_PARTITION_TIMEOUT", "600"))
+# seconds dropped corpora wait for their partitions to be dropped, partitions left are
+#  dropped by later jobs (see drop_stale_partitions)
+DROP_PARTITION_TIMEOUT = 10
+# mariadb errors of partition ddl
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_DROP_PARTITION_NON_EXISTENT = 1507
+
+_engines: Dict[str, sa.engine.Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def database_uri(user: str, password: str, host: str, port: str, database: str) -> str:
+    """
+    Get the url of a mariadb database, or of a sqlite database relative to the parent
+        of the working directory if no host is given.
+    """
+    if host:
+        return f"mariadb+mariadbconnector://{user}:{password}@{host}:{port}/{database}"
+    return f"sqlite:///../{database}.db"
+
+
+def get_engine(uri: str) -> sa.engine.Engine:
+    """
+    Get the engine of a database, created once per process.
+
+    Args:
+        uri: sqlalchemy url of the database
+
+    Returns:
+        shared engine
+    """
+    with _engines_lock:
+        if uri not in _engines:
+            if uri.startswith("sqlite"):
+                options = {"connect_args": {"timeout": SQLITE_TIMEOUT}}
+            else:
+                options = {"pool_size": POOL_SIZE, "max_overflow": POOL_OVERFLOW,
+                           "pool_recycle": POOL_RECYCLE, "pool_pre_ping": True,
+                           "isolation_level": ISOLATION_LEVEL}
+            _engines[uri] = sa.create_engine(uri, **options)
+        return _engines[uri]
 
 
 class DatabaseConnector:
@@ -27,6 +113,9 @@ class DatabaseConnector:
         """
         self.engine = None
         self.session = None
+        self.corpus_id = None
+        self._corpus_stack = ExitStack()
+        self._unflushed = 0
 
         self.user = user
         self.password = password
@@ -41,26 +130,350 @@ class DatabaseConnector:
         Initiate the connection to the database service and populate the necessary
         obj variables
         """
-        uri = f"sqlite:///../{self.database}.db"
-        if self.host:
-            uri = f"mariadb+mariadbconnector://{self.user}:{self.password}" \
-                  f"@{self.host}:{self.port}/{self.database}"
-        self.engine = sa.create_engine(uri)
+        self.engine = get_engine(database_uri(self.user, self.password, self.host,
+                                              self.port, self.database))
 
         session = sessionmaker(self.engine)
         # session.configure(bind=self.engine)
         self.session = session()
 
+    ###
+    # schema
+    def schema_revision(self) -> Optional[str]:
+        """
+        Get the migration revision of the database schema with a single query.
+
+        Returns:
+            revision id, None if the schema isn't versioned
+        """
+        with self.engine.connect() as connection:
+            try:
+                return connection.exec_driver_sql(
+                    "SELECT version_num FROM alembic_version").scalar()
+            except sa.exc.DBAPIError:
+                return None
+
     def database_exists(self) -> bool:
         """
-        Check if name of the database is in the list of existing databases.
+        Check if the schema of the database is initialized, either versioned or
+            created before the migrations existed.
 
         Returns: Boolean
         """
-        # TODO: I feel like this is not working as I thought... The database seems to
-        #  exists even if its schema isn't initialized
-        existing_databases = [db[0] for db in self.engine.execute("SHOW DATABASES;")]
-        return self.database in existing_databases
+        return self.schema_revision() is not None \
+            or sa.inspect(self.engine).has_table(Corpus.__tablename__)
+
+    def upgrade_schema(self) -> None:
+        """
+        Bring the schema of the database to SCHEMA_REVISION.
+            An up to date database costs a single query, alembic and the migrations
+            are only loaded otherwise. On sqlite only the corpus registry lives in
+            the main database file, the other tables are created in the corpus files.
+        """
+        revision = self.schema_revision()
+        if revision == SCHEMA_REVISION:
+            return
+        from . import schema_migrations
+        schema_migrations.upgrade(self.engine, revision,
+                                  legacy=revision is None and self.database_exists())
+
+    ###
+    # corpus storage
+    @property
+    def is_sqlite(self) -> bool:
+        return self.engine.dialect.name == "sqlite"
+
+    def corpus_path(self, location: str) -> str:
+        """
+        Get the path of a corpus database file.
+
+        Args:
+            location: location stored in the corpus registry
+
+        Returns:
+            path relative to the working directory
+        """
+        return os.path.join(os.path.dirname(self.engine.url.database), location)
+
+    @staticmethod
+    def partition_name(corpus_id: str) -> str:
+        return f"p_{corpus_id}"
+
+    def find_corpora(self, name: str = None) -> List[Corpus]:
+        """
+        Get the registered corpora which are completely loaded, oldest first.
+
+        Args:
+            name: only get corpora with this name
+
+        Returns:
+            list of corpus registry rows
+        """
+        query = sa.select(Corpus.__table__).where(Corpus.created_at.isnot(None)) \
+            .order_by(Corpus.created_at)
+        if name is not None:
+            query = query.where(Corpus.name == name)
+        with self.engine.connect() as connection:
+            return connection.execute(query).fetchall()
+
+    def create_corpus(self, name: str) -> str:
+        """
+        Register a new corpus and create its storage.
+
+        Args:
+            name: name of the corpus, several corpora may share a name
+
+        Returns:
+            string id of the new corpus
+        """
+        corpus_id = uuid.uuid4().hex
+        location = None
+        if self.is_sqlite:
+            stem = os.path.splitext(os.path.basename(self.engine.url.database))[0]
+            location = os.path.join(f"{stem}_corpora", f"{corpus_id}.db")
+            os.makedirs(os.path.dirname(self.corpus_path(location)), exist_ok=True)
+
+        # created_at is set by loading_corpus once the corpus is complete, the corpus
+        #  is registered before its partitions so they are never taken as stale
+        with self.engine.begin() as connection:
+            connection.execute(Corpus.__table__.insert().values(
+                id=corpus_id, name=name, location=location))
+        if not self.is_sqlite:
+            partition = self.partition_name(corpus_id)
+            left = self.alter_partitions(
+                CORPUS_TABLES, f"ADD PARTITION (PARTITION {partition} "
+                               f"VALUES IN ('{corpus_id}'))", ADD_PARTITION_TIMEOUT)
+            if left:
+                self.drop_corpus(corpus_id)
+                raise TimeoutError(f"the partitions of corpus {corpus_id} couldn't be "
+                                   f"added within {ADD_PARTITION_TIMEOUT}s")
+        return corpus_id
+
+    def alter_partitions(self, tables: List[sa.Table], specification: str,
+                         timeout: float) -> List[sa.Table]:
+        """
+        Alter the partitions of tables (mariadb only), each table on its own and
+            outside of any loading transaction. Every statement waits at most
+            DDL_LOCK_WAIT seconds for the metadata lock of its table, tables whose
+            lock wasn't granted are retried until the timeout.
+
+        Args:
+            tables: tables to alter
+            specification: partition specification of the alter table statements
+            timeout: seconds until tables still locked are given up
+
+        Returns:
+            tables which couldn't be altered
+        """
+        deadline = time.monotonic() + timeout
+        left = list(tables)
+        while True:
+            for table in list(left):
+                try:
+                    with self.engine.begin() as connection:
+                        connection.exec_driver_sql(
+                            f"ALTER TABLE {table.name} WAIT {DDL_LOCK_WAIT} "
+                            f"{specification}")
+                except sa.exc.DBAPIError as error:
+                    code = getattr(error.orig, "errno", None)
+                    if code == ER_DROP_PARTITION_NON_EXISTENT:
+                        # dropped by a concurrent job already
+                        left.remove(table)
+                    elif code != ER_LOCK_WAIT_TIMEOUT:
+                        raise
+                else:
+                    left.remove(table)
+            if not left or time.monotonic() + DDL_RETRY_PAUSE > deadline:
+                return left
+            time.sleep(DDL_RETRY_PAUSE)
+
+    def drop_stale_partitions(self) -> None:
+        """
+        Drop the partitions of corpora which are no longer registered (mariadb only),
+            left by drops that didn't get the locks of their tables in time.
+        """
+        if self.is_sqlite:
+            return
+        with self.engine.connect() as connection:
+            partitions = connection.exec_driver_sql(
+                "SELECT TABLE_NAME, PARTITION_NAME FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND PARTITION_NAME LIKE 'p\\_%' "
+                "AND PARTITION_NAME != 'p_empty'").all()
+            registered = {self.partition_name(corpus_id) for corpus_id, in
+                          connection.execute(sa.select(Corpus.id))}
+        tables = {table.name: table for table in CORPUS_TABLES}
+        stale = defaultdict(list)
+        for table_name, partition in partitions:
+            if partition not in registered and table_name in tables:
+                stale[partition].append(tables[table_name])
+        for partition, partition_tables in stale.items():
+            self.alter_partitions(partition_tables, f"DROP PARTITION {partition}", 0)
+
+    @contextmanager
+    def corpus_connection(self, corpus_id: str) -> Iterator[sa.engine.Connection]:
+        """
+        Open a connection scoped to the storage of a corpus.
+            On sqlite the corpus file is attached and all unqualified tables are
+            translated to it.
+
+        Args:
+            corpus_id: id of the corpus
+
+        Returns:
+            context manager yielding the connection
+        """
+        with self.engine.connect() as connection:
+            if self.is_sqlite:
+                location, = connection.execute(
+                    sa.select(Corpus.location).where(Corpus.id == corpus_id)).one()
+                schema_name = f"corpus_{corpus_id}"
+                connection.exec_driver_sql(f"ATTACH DATABASE ? AS {schema_name}",
+                                           (self.corpus_path(location),))
+                connection = connection.execution_options(
+                    schema_translate_map={None: schema_name})
+                Base.metadata.create_all(connection, tables=CORPUS_TABLES)
+            yield connection
+
+    def stream(self, statement: sa.sql.Select, batch_size: int, *tables,
+               corpus_id: str = None) -> Iterator[sa.engine.Row]:
+        """
+        Run a statement on its own connection to the exported corpus with a server
+            side cursor.
+
+        Args:
+            statement: ordered select statement
+            batch_size: number of rows fetched at once
+            tables: tables of the statement to restrict to the exported corpus
+            corpus_id: id of the exported corpus, the corpus of this connector if
+                omitted
+
+        Returns:
+            iterator over the result rows
+        """
+        corpus_id = corpus_id or self.corpus_id
+        statement = statement.where(*(table.c.corpus_id == corpus_id
+                                      for table in tables))
+        with self.corpus_connection(corpus_id) as connection:
+            result = connection.execution_options(stream_results=True) \
+                .execute(statement)
+            for rows in iter(lambda: result.fetchmany(batch_size), []):
+                yield from rows
+
+    def use_corpus(self, corpus_id: str) -> None:
+        """
+        Scope the session of this connector to a corpus.
+
+        Args:
+            corpus_id: id of the corpus
+        """
+        self.release_corpus()
+        connection = self._corpus_stack.enter_context(self.corpus_connection(corpus_id))
+        # the loaded objects are still used by the parser after their batch is committed
+        self.session = sessionmaker(bind=connection, expire_on_commit=False)()
+        self.corpus_id = corpus_id
+
+    def release_corpus(self) -> None:
+        """
+        Close the corpus scoped session, if there is one. Rows which weren't
+            committed are rolled back.
+        """
+        if self.corpus_id is None:
+            return
+        self.session.close()
+        self._corpus_stack.close()
+        self.session = sessionmaker(self.engine)()
+        self.corpus_id = None
+        self._corpus_stack = ExitStack()
+        self._unflushed = 0
+
+    def close(self) -> None:
+        """
+        Release the corpus and session of this connector, the shared engine stays
+            open.
+        """
+        self.release_corpus()
+        self.session.close()
+
+    def _written(self, count: int) -> None:
+        """
+        Commit written rows, the rows of a loading corpus in batches of FLUSH_SIZE
+            rows.
+        """
+        if self.corpus_id is None:
+            self.session.commit()
+            return
+        self._unflushed += count
+        if self._unflushed >= FLUSH_SIZE:
+            self.session.commit()
+            self._unflushed = 0
+
+    @contextmanager
+    def loading_corpus(self, name: str, replace: bool = False) -> Iterator[str]:
+        """
+        Create a new corpus and scope the session to it while it is loaded.
+            The rows are committed in batches, the corpus only becomes visible with
+            its created_at, once it is complete. A corpus which fails to load is
+            dropped again with the batches committed already.
+
+        Args:
+            name: name to register the corpus under
+            replace: drop the loaded corpora of the same name which were completed
+                before this one, corpora still loading in other jobs are kept
+
+        Returns:
+            context manager yielding the id of the new corpus
+        """
+        corpus_id = self.create_corpus(name)
+        self.use_corpus(corpus_id)
+        try:
+            yield corpus_id
+            self.session.commit()
+        except Exception:
+            self.drop_corpus(corpus_id)
+            raise
+        self.release_corpus()
+
+        created_at = datetime.utcnow()
+        with self.engine.begin() as connection:
+            connection.execute(Corpus.__table__.update()
+                               .where(Corpus.id == corpus_id)
+                               .values(created_at=created_at))
+        # older corpora are only dropped once this one is committed, their partition
+        #  ddl doesn't wait for the locks of this load
+        if replace:
+            for corpus in self.find_corpora(name):
+                if corpus.id != corpus_id and corpus.created_at <= created_at:
+                    self.drop_corpus(corpus.id)
+        self.drop_stale_partitions()
+
+    def drop_corpus(self, corpus_id: str) -> None:
+        """
+        Unregister a corpus and drop its partitions or delete its file.
+            Partitions whose tables stay locked by other jobs longer than
+            DROP_PARTITION_TIMEOUT are left to drop_stale_partitions, the corpus is
+            invisible once it is unregistered.
+
+        Args:
+            corpus_id: id of the corpus
+        """
+        if self.corpus_id == corpus_id:
+            self.release_corpus()
+        with self.engine.begin() as connection:
+            location = connection.execute(
+                sa.select(Corpus.location).where(Corpus.id == corpus_id)).scalar()
+            deleted = connection.execute(
+                Corpus.__table__.delete().where(Corpus.id == corpus_id)).rowcount
+
+        if not deleted:
+            # already dropped by a concurrent job replacing the same corpus
+            return
+        if self.is_sqlite:
+            if location and os.path.exists(self.corpus_path(location)):
+                os.remove(self.corpus_path(location))
+            return
+        self.alter_partitions(CORPUS_TABLES,
+                              f"DROP PARTITION {self.partition_name(corpus_id)}",
+                              DROP_PARTITION_TIMEOUT)
 
     def insert(self, element: Base) -> None:
         """
@@ -70,7 +483,7 @@ class DatabaseConnector:
             element: db object inheriting from Base specified in tei_sql_schema
         """
         self.session.add(element)
-        self.session.commit()
+        self._written(1)
 
     def merge(self, element: Base) -> None:
         """
@@ -80,7 +493,7 @@ class DatabaseConnector:
             element: db object inheriting from Base specified in tei_sql_schema
         """
         self.session.merge(element)
-        self.session.commit()
+        self._written(1)
 
     def bulk_insert(self, elements: List[Base]) -> None:
         """
@@ -91,4 +504,17 @@ class DatabaseConnector:
                 tei_sql_schema
         """
         self.session.add_all(elements)
-        self.session.commit()
+        self._written(len(elements))
+
+    def insert_rows(self, table: sa.Table, rows: List[Dict]) -> None:
+        """
+        Insert plain rows into a table without creating db objects first.
+
+        Args:
+            table: table specified in tei_sql_schema
+            rows: list of dicts mapping column names to values
+        """
+        if not rows:
+            return
+        self.session.execute(table.insert(), rows)
+        self._written(len(rows))
@@ -0,0 +1,309 @@
+"""
+This module contains the ParseCache class keeping the transformed rows of parsed
+    corpora on disk, so a corpus can be loaded again without parsing its xml.
+
+    A cache file holds the rows of one corpus, without corpus_id, and is named after
+    the content hash of the corpus and the parser version. The rows are stored column
+    by column in row groups: each column of a row group is one zlib compressed block
+    of a null mask and either 64 bit integers or string lengths followed by the utf-8
+    encoded strings. A json footer lists the tables, columns and block sizes:
+
+        MAGIC | blocks ... | footer json | footer length (uint32) | MAGIC
+
+    Replaying a cache file inserts its rows into a new corpus of any DatabaseConnector.
+    All blocks are decoded once before, so a damaged file raises ParseCacheError
+    before any row is loaded. Columns missing in the cache are left to their defaults
+    and cached columns the schema doesn't have anymore are skipped.
+"""
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime
+from itertools import accumulate
+from typing import Dict, Iterator, List
+
+import sqlalchemy as sa
+
+from .database_connector import DatabaseConnector
+from . import tei_sql_schema as schema
+
+MAGIC = b"TTPC"
+FORMAT_VERSION = 1
+FOOTER = struct.Struct("<I")
+# rows per row group, bounds the memory used while writing and replaying
+ROW_GROUP_SIZE = 50000
+
+
+class ParseCacheError(ValueError):
+    """
+    Raised for cache files which can't be read.
+    """
+
+
+def _column_kind(column: sa.Column) -> str:
+    if isinstance(column.type, sa.Integer):
+        return "int"
+    if isinstance(column.type, sa.String):
+        return "str"
+    raise ParseCacheError(f"can't cache column {column} of type {column.type}")
+
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_column(kind: str, values: List) -> bytes:
+    """
+    Encode the values of a column in a row group as one compressed block.
+
+    Args:
+        kind: int or str
+        values: column values, None for null
+
+    Returns:
+        compressed block
+    """
+    mask = bytes(value is None for value in values)
+    if kind == "int":
+        payload = _little_endian(array("q", (value or 0 for value in values))).tobytes()
+    else:
+        strings = ["" if value is None else value for value in values]
+        lengths = _little_endian(array("I", map(len, strings))).tobytes()
+        payload = lengths + "".join(strings).encode("utf-8")
+    return zlib.compress(mask + payload)
+
+
+def decode_column(kind: str, rows: int, block: bytes) -> List:
+    """
+    Decode a block written by encode_column.
+
+    Args:
+        kind: int or str
+        rows: number of rows in the row group
+        block: compressed block
+
+    Returns:
+        column values, None for null
+    """
+    try:
+        data = zlib.decompress(block)
+        mask, data = data[:rows], data[rows:]
+        if kind == "int":
+            values = _little_endian(array("q", data[:8 * rows])).tolist()
+        else:
+            lengths = _little_endian(array("I", data[:4 * rows]))
+            text = data[4 * rows:].decode("utf-8")
+            ends = list(accumulate(lengths))
+            if ends and ends[-1] != len(text):
+                raise ValueError("string lengths don't match the text")
+            values = [text[end - length:end] for end, length in zip(ends, lengths)]
+    except (zlib.error, UnicodeDecodeError, ValueError) as error:
+        raise ParseCacheError(f"can't decode a {kind} block: {error}") from error
+    if len(mask) != rows or len(values) != rows:
+        raise ParseCacheError(f"{kind} block doesn't hold {rows} rows")
+    return [None if null else value for null, value in zip(mask, values)]
+
+
+class ParseCache:
+    """
+    Class storing and replaying the rows of parsed corpora.
+    """
+
+    def __init__(self, directory: str, parser_version: str):
+        """
+        Args:
+            directory: directory of the cache files, created if missing
+            parser_version: version of the parser writing the rows, cache files of
+                other versions are ignored
+        """
+        self.directory = directory
+        self.parser_version = parser_version
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, content_hash: str) -> str:
+        """
+        Get the path of the cache file of a corpus.
+
+        Args:
+            content_hash: content hash of the corpus, see corpus_source.content_hash
+        """
+        return os.path.join(self.directory,
+                            f"{content_hash}-{self.parser_version}.ttpc")
+
+    def __contains__(self, content_hash: str) -> bool:
+        return os.path.exists(self.path(content_hash))
+
+    ###
+    # save
+    def save(self, connector: DatabaseConnector, content_hash: str, corpus_id: str,
+             row_group_size: int = ROW_GROUP_SIZE) -> str:
+        """
+        Write the rows of a stored corpus into the cache.
+            The file is written next to its final path and only moved there once it
+            is complete.
+
+        Args:
+            connector: connector of the database holding the corpus
+            content_hash: content hash of the corpus source
+            corpus_id: id of the stored corpus
+            row_group_size: number of rows per row group
+
+        Returns:
+            path of the cache file
+        """
+        target = self.path(content_hash)
+        partial = f"{target}.partial"
+        footer = {"format": FORMAT_VERSION, "parser_version": self.parser_version,
+                  "content_hash": content_hash,
+                  "created_at": datetime.utcnow().isoformat(), "tables": []}
+        with open(partial, "wb") as file_pointer:
+            file_pointer.write(MAGIC)
+            for table in schema.CORPUS_TABLES:
+                footer["tables"].append(
+                    self._write_table(file_pointer, connector, table, corpus_id,
+                                      row_group_size))
+            encoded = json.dumps(footer).encode("utf-8")
+            file_pointer.write(encoded + FOOTER.pack(len(encoded)) + MAGIC)
+        os.replace(partial, target)
+        return target
+
+    @staticmethod
+    def _write_table(file_pointer, connector: DatabaseConnector, table: sa.Table,
+                     corpus_id: str, row_group_size: int) -> Dict:
+        columns = [column for column in table.columns if column.name != "corpus_id"]
+        kinds = [_column_kind(column) for column in columns]
+        order = [table.c.position] if "position" in table.c else list(table.primary_key)
+        statement = sa.select(*columns).order_by(*order)
+        entry = {"name": table.name,
+                 "columns": [{"name": column.name, "kind": kind}
+                             for column, kind in zip(columns, kinds)],
+                 "row_groups": []}
+
+        def write_group(rows):
+            sizes = []
+            for index, kind in enumerate(kinds):
+                block = encode_column(kind, [row[index] for row in rows])
+                file_pointer.write(block)
+                sizes.append(len(block))
+            entry["row_groups"].append({"rows": len(rows), "sizes": sizes})
+
+        rows = []
+        for row in connector.stream(statement, row_group_size, table,
+                                    corpus_id=corpus_id):
+            rows.append(tuple(row))
+            if len(rows) == row_group_size:
+                write_group(rows)
+                rows = []
+        if rows:
+            write_group(rows)
+        return entry
+
+    ###
+    # replay
+    def footer(self, content_hash: str) -> Dict:
+        """
+        Read the footer of a cache file.
+
+        Raises:
+            ParseCacheError: if the file isn't a readable cache file
+        """
+        with open(self.path(content_hash), "rb") as file_pointer:
+            return self._read_footer(file_pointer)
+
+    @staticmethod
+    def _read_footer(file_pointer) -> Dict:
+        if file_pointer.read(len(MAGIC)) != MAGIC:
+            raise ParseCacheError(f"{file_pointer.name} is no parse cache file")
+        # a file cut off after the magic bytes has no trailer to seek back to
+        if os.fstat(file_pointer.fileno()).st_size < 2 * len(MAGIC) + FOOTER.size:
+            raise ParseCacheError(f"{file_pointer.name} is incomplete")
+        file_pointer.seek(-(FOOTER.size + len(MAGIC)), os.SEEK_END)
+        trailer = file_pointer.read()
+        if trailer[FOOTER.size:] != MAGIC:
+            raise ParseCacheError(f"{file_pointer.name} is incomplete")
+        length, = FOOTER.unpack(trailer[:FOOTER.size])
+        try:
+            file_pointer.seek(-(length + FOOTER.size + len(MAGIC)), os.SEEK_END)
+            footer = json.loads(file_pointer.read(length))
+        except (OSError, ValueError) as error:
+            raise ParseCacheError(f"{file_pointer.name} has no readable footer") from error
+        if not isinstance(footer, dict) or footer.get("format") != FORMAT_VERSION:
+            raise ParseCacheError(f"{file_pointer.name} has an unknown format")
+        return footer
+
+    def rows(self, content_hash: str) -> Iterator[tuple]:
+        """
+        Read the cached rows row group by row group.
+
+        Args:
+            content_hash: content hash of the corpus
+
+        Returns:
+            iterator over (table name, column names, list of row dicts) tuples
+        """
+        with open(self.path(content_hash), "rb") as file_pointer:
+            footer = self._read_footer(file_pointer)
+            file_pointer.seek(len(MAGIC))
+            for table in footer["tables"]:
+                names = [column["name"] for column in table["columns"]]
+                kinds = [column["kind"] for column in table["columns"]]
+                for group in table["row_groups"]:
+                    columns = [decode_column(kind, group["rows"], file_pointer.read(size))
+                               for kind, size in zip(kinds, group["sizes"])]
+                    yield table["name"], names, [dict(zip(names, values))
+                                                 for values in zip(*columns)]
+
+    def validate(self, content_hash: str) -> None:
+        """
+        Decode every block of a cache file without keeping the rows, so a damaged
+            file is found before any of its rows are written.
+
+        Args:
+            content_hash: content hash of the corpus
+
+        Raises:
+            ParseCacheError: if the file or one of its blocks can't be read
+        """
+        try:
+            for _ in self.rows(content_hash):
+                pass
+        except (KeyError, TypeError) as error:
+            raise ParseCacheError(f"{self.path(content_hash)} has a broken footer") \
+                from error
+
+    def replay(self, content_hash: str, target: DatabaseConnector,
+               corpus_name: str = "corpus", replace: bool = False) -> str:
+        """
+        Load a cached corpus into the database of a connector as new corpus.
+
+        Args:
+            content_hash: content hash of the corpus
+            target: connector of the database to load into
+            corpus_name: name to register the corpus under
+            replace: drop the stored corpora of the same name once this one is loaded
+
+        Returns:
+            string id of the new corpus
+
+        Raises:
+            ParseCacheError: if the cache file can't be read, nothing is loaded then
+        """
+        tables = {table.name: table for table in schema.CORPUS_TABLES}
+        self.validate(content_hash)
+        with target.loading_corpus(corpus_name, replace) as corpus_id:
+            for name, columns, rows in self.rows(content_hash):
+                table = tables.get(name)
+                if table is None:
+                    continue
+                skipped = [column for column in columns if column not in table.c]
+                for row in rows:
+                    for column in skipped:
+                        del row[column]
+                    row["corpus_id"] = corpus_id
+                target.insert_rows(table, rows)
+        return corpus_id
@@ -0,0 +1,98 @@
+"""
+This module runs the alembic migrations of the TEI schema in ingestion/migrations.
+
+    It imports alembic and the migration scripts, so DatabaseConnector only loads it
+    when the schema of a database isn't at SCHEMA_REVISION. Databases created with
+    create_all before the migrations existed are stamped with the baseline revision
+    instead of being created again.
+"""
+import os
+from typing import Iterator, Optional
+
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from .tei_sql_schema import Corpus, SCHEMA_REVISION
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+# first revision with the corpus registry, the schema as create_all built it before the
+#  migrations
+BASELINE_REVISION = "3f6c2d1a9b80"
+
+
+def alembic_config(connection: sa.engine.Connection = None) -> Config:
+    """
+    Get the alembic config of the migrations, running them on a connection.
+    """
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade(engine: sa.engine.Engine, revision: Optional[str] = None,
+            legacy: bool = False) -> None:
+    """
+    Migrate a database to the head revision in one transaction, as far as the
+        database supports transactional ddl.
+
+    Args:
+        engine: engine of the database
+        revision: current revision of the database, None if it isn't versioned
+        legacy: the schema was created before the migrations and is stamped with
+            the baseline revision first
+
+    Raises:
+        RuntimeError: if the database is at a revision these migrations don't know
+    """
+    script = ScriptDirectory.from_config(alembic_config())
+    head = script.get_current_head()
+    if head != SCHEMA_REVISION:
+        raise RuntimeError(f"SCHEMA_REVISION {SCHEMA_REVISION} isn't the head revision "
+                           f"{head} of the migrations")
+    if revision is not None and \
+            revision not in {script_revision.revision
+                             for script_revision in script.walk_revisions()}:
+        raise RuntimeError(
+            f"the database schema is at revision {revision}, which isn't part of the "
+            f"migrations in {MIGRATIONS_DIR}. It was probably migrated by a newer "
+            f"release, run that release of the ingestion service and webapp. If the "
+            f"revision was stamped by hand, check which revision the schema matches and "
+            f"stamp it with `alembic stamp <revision>` before upgrading.")
+    with engine.begin() as connection:
+        config = alembic_config(connection)
+        if legacy:
+            command.stamp(config, BASELINE_REVISION)
+        command.upgrade(config, "head")
+
+
+def corpus_schemas(connection: sa.engine.Connection) -> Iterator[Optional[str]]:
+    """
+    Get the schemas holding corpus tables, for revisions altering them.
+        On mariadb that's the default schema, on sqlite each corpus file is attached
+        while its schema is used.
+
+    Args:
+        connection: connection of the migration, op.get_bind()
+
+    Returns:
+        iterator over schema names, None for the default schema
+    """
+    if connection.dialect.name != "sqlite":
+        yield None
+        return
+    main_path = connection.engine.url.database
+    locations = connection.execute(
+        sa.select(Corpus.id, Corpus.location).where(Corpus.location.isnot(None))).all()
+    for corpus_id, location in locations:
+        schema_name = f"corpus_{corpus_id}"
+        connection.exec_driver_sql(
+            f"ATTACH DATABASE ? AS {schema_name}",
+            (os.path.join(os.path.dirname(main_path), location),))
+        try:
+            yield schema_name
+        finally:
+            connection.exec_driver_sql(f"DETACH DATABASE {schema_name}")
@@ -0,0 +1,104 @@
+"""
+This module contains the SqliteSnapshot class to publish a stored corpus as compact,
+    read only sqlite file for the webapp.
+
+    Rows are copied in document order into tables without indexes, so consecutive
+    elements end up on the same pages, and the indexes are built afterwards in one go. The finished file is analyzed, vacuumed and made read only,
+    it is meant to be opened with `immutable=1`, which skips all locking.
+"""
+import os
+from typing import List
+
+import sqlalchemy as sa
+
+from .database_connector import DatabaseConnector
+from . import tei_sql_schema as schema
+
+# sqlite page size of the snapshot, larger pages suit sequential reads
+PAGE_SIZE = 8192
+
+
+class SqliteSnapshot(DatabaseConnector):
+    """
+    Class copying corpora from the connected database into sqlite snapshot files.
+    """
+
+    def build(self, target: str, corpus_id: str, batch_size: int = 1000) -> None:
+        """
+        Write a stored corpus into a new snapshot file.
+            The snapshot is written next to the target and only moved there once it
+            is complete.
+
+        Args:
+            target: path of the snapshot file, replaced if it exists
+            corpus_id: id of the corpus to copy
+            batch_size: number of rows copied at once
+        """
+        self.corpus_id = corpus_id
+        partial = f"{target}.partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+
+        snapshot = sa.create_engine(f"sqlite:///{partial}")
+        try:
+            with snapshot.connect() as connection:
+                connection.exec_driver_sql(f"PRAGMA page_size = {PAGE_SIZE}")
+                connection.exec_driver_sql("PRAGMA journal_mode = OFF")
+                connection.exec_driver_sql("PRAGMA synchronous = OFF")
+                with connection.begin():
+                    self.copy_registry(connection)
+                    for table in schema.CORPUS_TABLES:
+                        connection.execute(sa.schema.CreateTable(table))
+                        self.copy_table(connection, table, batch_size)
+                    self.create_indexes(connection)
+                connection.exec_driver_sql("ANALYZE")
+                connection.exec_driver_sql("VACUUM")
+                connection.exec_driver_sql("PRAGMA journal_mode = DELETE")
+        finally:
+            snapshot.dispose()
+
+        os.chmod(partial, 0o444)
+        os.replace(partial, target)
+
+    def copy_registry(self, connection: sa.engine.Connection) -> None:
+        """
+        Copy the registry row of the corpus, without location as the snapshot
+            holds the corpus tables itself, and the schema revision.
+        """
+        corpus = schema.Corpus.__table__
+        with self.engine.connect() as source:
+            row = source.execute(
+                sa.select(corpus).where(corpus.c.id == self.corpus_id)).one()
+        schema.Corpus.__table__.create(connection)
+        connection.execute(corpus.insert(), [dict(row._mapping, location=None)])
+        # the tables are created from the current schema, stamp its revision
+        connection.exec_driver_sql(
+            "CREATE TABLE alembic_version (version_num VARCHAR(32) PRIMARY KEY)")
+        connection.exec_driver_sql("INSERT INTO alembic_version VALUES (?)",
+                                   (schema.SCHEMA_REVISION,))
+
+    def copy_table(self, connection: sa.engine.Connection, table: sa.Table,
+                   batch_size: int) -> None:
+        """
+        Copy the rows of the corpus in document order, rows of tables without
+            position in key order.
+        """
+        order = [table.c.position] if "position" in table.c else list(table.primary_key)
+        rows = self.stream(sa.select(table).order_by(*order), batch_size, table)
+        batch: List[dict] = []
+        for row in rows:
+            batch.append(dict(row._mapping))
+            if len(batch) == batch_size:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+    @staticmethod
+    def create_indexes(connection: sa.engine.Connection) -> None:
+        """
+        Create the indexes of the schema.
+        """
+        for table in schema.CORPUS_TABLES:
+            for index in table.indexes:
+                index.create(connection)
@@ -4,6 +4,13 @@ This module contains class definitions for the tables storing objects transforme
 
     In all honesty, this is a toy project so this probably wont describe  anything
     except https://dracor.org/api/corpora/shake/play/two-gentlemen-of-verona/tei
+
+    Every table except `corpus` is keyed by the corpus its rows belong to, so ids taken
+    from xml:id attributes only have to be unique within their corpus.
+    On mariadb these tables are list partitioned by corpus_id, on sqlite every corpus
+    lives in its own database file (see DatabaseConnector). Partitioned InnoDB tables
+    can't carry foreign keys, so references between the tables are plain indexed
+    columns and relationships are declared with explicit, read only joins.
 """
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -11,100 +18,196 @@ import sqlalchemy as sa
 
 Base = declarative_base()
 
+# head revision of the migrations in ingestion/migrations this schema is defined by
+SCHEMA_REVISION = "9b2e4c7d1f05"
+
+
+class CorpusMixin:
+    """
+    Corpus key shared by all tables partitioned by corpus.
+    """
+    corpus_id = sa.Column(sa.String(32), primary_key=True)
+
+
 cast_stage_association_table = sa.Table(
     'cast_stage_association',
     Base.metadata,
-    sa.Column('cast_item_id', sa.ForeignKey('cast_item.id'), primary_key=True),
-    sa.Column('stage_id', sa.ForeignKey('stage.id'), primary_key=True)
+    sa.Column('corpus_id', sa.String(32), primary_key=True),
+    sa.Column('cast_item_id', sa.String(36), primary_key=True),
+    sa.Column('stage_id', sa.String(36), primary_key=True)
 )
 
 
+# corpus information
+class Corpus(Base):
+    __tablename__ = "corpus"
+
+    id = sa.Column(sa.String(32), primary_key=True)
+    name = sa.Column(sa.String(255), index=True)
+    # file the corpus is stored in, relative to the main database file (sqlite only)
+    location = sa.Column(sa.String(255))
+    # set once the corpus is completely loaded, none while it is loading
+    created_at = sa.Column(sa.DateTime)
+
+
 # meta information
 # TODO: meta information in TeiHeader missing
 
 # cast information
-class CastItem(Base):
+class CastItem(CorpusMixin, Base):
     __tablename__ = "cast_item"
 
     id = sa.Column(sa.String(36), primary_key=True)
     # TODO: most of the current relationships are one to many
     #  -> figure out where bidrectional relationships are necessary
-    cast_group_id = sa.Column(sa.ForeignKey("cast_group.id"))
+    cast_group_id = sa.Column(sa.String(36), index=True)
     name = sa.Column(sa.TEXT)
     content = sa.Column(sa.TEXT)
     # TODO: corresp. attrib missing
     stages = relationship(
         "Stage",
         secondary=cast_stage_association_table,
-        backref="stage"
+        primaryjoin="and_(CastItem.corpus_id == "
+                    "foreign(cast_stage_association.c.corpus_id), "
+                    "CastItem.id == foreign(cast_stage_association.c.cast_item_id))",
+        secondaryjoin="and_(Stage.corpus_id == "
+                      "foreign(cast_stage_association.c.corpus_id), "
+                      "Stage.id == foreign(cast_stage_association.c.stage_id))",
+        viewonly=True
     )
 
 
-class CastRole(Base):
+class CastRole(CorpusMixin, Base):
     __tablename__ = "cast_role"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    cast_item_id = sa.Column(sa.ForeignKey("cast_item.id"))
+    cast_item_id = sa.Column(sa.String(36), index=True)
     name = sa.Column(sa.TEXT)
     content = sa.Column(sa.TEXT)
     description = sa.Column(sa.TEXT)
 
 
-class CastGroup(Base):
+class CastGroup(CorpusMixin, Base):
     __tablename__ = "cast_group"
 
     id = sa.Column(sa.String(36), primary_key=True)
 
 
 # play information
-class Act(Base):
+class Act(CorpusMixin, Base):
     __tablename__ = "act"
 
     id = sa.Column(sa.String(36), primary_key=True)
+    # document order of the element within its corpus,
+    #  shared by all play information tables
+    position = sa.Column(sa.Integer, index=True)
     content = sa.Column(sa.TEXT)
 
 
-class Scene(Base):
+class Scene(CorpusMixin, Base):
     __tablename__ = "scene"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    act_id = sa.Column(sa.ForeignKey("act.id"))
+    position = sa.Column(sa.Integer, index=True)
+    act_id = sa.Column(sa.String(36), index=True)
     content = sa.Column(sa.TEXT)
 
 
-class Stage(Base):
+class Stage(CorpusMixin, Base):
     __tablename__ = "stage"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    scene_id = sa.Column(sa.ForeignKey("scene.id"), index=True)
+    position = sa.Column(sa.Integer, index=True)
+    scene_id = sa.Column(sa.String(36), index=True)
     content = sa.Column(sa.TEXT)
     cast = relationship(
         "CastItem",
         secondary=cast_stage_association_table,
-        backref="cast_item"
+        primaryjoin="and_(Stage.corpus_id == "
+                    "foreign(cast_stage_association.c.corpus_id), "
+                    "Stage.id == foreign(cast_stage_association.c.stage_id))",
+        secondaryjoin="and_(CastItem.corpus_id == "
+                      "foreign(cast_stage_association.c.corpus_id), "
+                      "CastItem.id == foreign(cast_stage_association.c.cast_item_id))",
+        viewonly=True
     )
 
 
-class Speech(Base):
+class Speech(CorpusMixin, Base):
     __tablename__ = "speech"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    scene_id = sa.Column(sa.ForeignKey("scene.id"))
-    cast_item_id = sa.Column(sa.ForeignKey("cast_item.id"))
+    position = sa.Column(sa.Integer, index=True)
+    scene_id = sa.Column(sa.String(36), index=True)
+    cast_item_id = sa.Column(sa.String(36), index=True)
 
 
-class Line(Base):
+class Line(CorpusMixin, Base):
     __tablename__ = "line"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    speech_id = sa.Column(sa.ForeignKey("speech.id"))
+    position = sa.Column(sa.Integer, index=True)
+    speech_id = sa.Column(sa.String(36), index=True)
 
 
-class Token(Base):
+class Token(CorpusMixin, Base):
     __tablename__ = "token"
 
     id = sa.Column(sa.String(36), primary_key=True)
-    line_id = sa.Column(sa.ForeignKey("line.id"))
+    position = sa.Column(sa.Integer, index=True)
+    line_id = sa.Column(sa.String(36), index=True)
     content = sa.Column(sa.TEXT)
     lemma = sa.Column(sa.TEXT)
     ana = sa.Column(sa.TEXT)
+
+
+# search index information
+token_form_association_table = sa.Table(
+    'token_form_association',
+    Base.metadata,
+    sa.Column('corpus_id', sa.String(32), primary_key=True),
+    sa.Column('form_id', sa.String(36), primary_key=True),
+    sa.Column('token_id', sa.String(36), primary_key=True)
+)
+
+
+class TokenForm(CorpusMixin, Base):
+    __tablename__ = "token_form"
+
+    id = sa.Column(sa.String(36), primary_key=True)
+    # "content" for token forms, "lemma" for lemmas
+    kind = sa.Column(sa.String(8))
+    form = sa.Column(sa.String(255), index=True)
+    frequency = sa.Column(sa.Integer)
+    trigram_count = sa.Column(sa.Integer)
+    tokens = relationship(
+        "Token",
+        secondary=token_form_association_table,
+        primaryjoin="and_(TokenForm.corpus_id == "
+                    "foreign(token_form_association.c.corpus_id), "
+                    "TokenForm.id == foreign(token_form_association.c.form_id))",
+        secondaryjoin="and_(Token.corpus_id == "
+                      "foreign(token_form_association.c.corpus_id), "
+                      "Token.id == foreign(token_form_association.c.token_id))",
+        viewonly=True
+    )
+
+
+class FormTrigram(CorpusMixin, Base):
+    __tablename__ = "form_trigram"
+
+    trigram = sa.Column(sa.String(3), primary_key=True)
+    form_id = sa.Column(sa.String(36), primary_key=True)
+
+
+# tables stored per corpus, in creation order
+CORPUS_TABLES = [table for table in Base.metadata.sorted_tables
+                 if "corpus_id" in table.c]
+
+# mariadb can't create a list partitioned table without partitions,
+#  so every table starts with an empty placeholder partition
+for _table in CORPUS_TABLES:
+    sa.event.listen(_table, "after_create", sa.DDL(
+        "ALTER TABLE %(table)s PARTITION BY LIST COLUMNS(corpus_id) "
+        "(PARTITION p_empty VALUES IN (''))"
+    ).execute_if(dialect=("mysql", "mariadb")))
@@ -4,14 +4,37 @@ This module contains the TeiXmlParser class to Extract, Load and Transform data
 
     In all honesty, this is a toy project so this probably wont parse anything except
     https://dracor.org/api/corpora/shake/play/two-gentlemen-of-verona/tei properly.
+
+    Parsers with several workers split large files into their acts (see
+    act_regions.py) and parse each act in a worker process with an ActParser. The
+    rows of the acts are loaded in document order, their positions shifted by the
+    positions of the acts before them, so the stored corpus is the same as if the
+    file was parsed in one piece.
 """
+import dataclasses
+import multiprocessing
+import os
 import uuid
-from typing import Dict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
 
+import sqlalchemy as sa
 from lxml import etree
 
+from .act_regions import ActRegions, scan_acts
+from .corpus_source import CorpusSourceError, Source, content_hash, read_tree
 from .database_connector import DatabaseConnector
+from .parse_cache import ParseCache, ParseCacheError
 from . import tei_sql_schema as schema
+from .trigram_index import get_form_id, normalize_form, trigrams
+
+# version of the rows produced for a corpus, has to be raised whenever the
+#  transformation changes so cached rows of older versions aren't replayed
+PARSER_VERSION = "1"
+# files below this size are parsed in one piece, starting workers costs more
+PARALLEL_MIN_SIZE = 16 * 1024 * 1024
 
 
 class TeiXmlParser(DatabaseConnector):
@@ -22,7 +45,8 @@ class TeiXmlParser(DatabaseConnector):
         parsed corpora into the connected database.
     """
 
-    def __init__(self, user: str, password: str, host: str, port: str, database: str):
+    def __init__(self, user: str, password: str, host: str, port: str, database: str,
+                 cache_dir: str = None, workers: int = 1):
         """
         Args:
             user: username to connect to the database service
@@ -30,38 +54,94 @@ class TeiXmlParser(DatabaseConnector):
             host: host url
             port: service port
             database: name of the target database
+            cache_dir: directory of the parse cache, corpora are always parsed if
+                omitted
+            workers: number of processes parsing the acts of large files, files
+                are parsed in this process if 1
         """
         super().__init__(user, password, host, port, database)
+        self.cache = ParseCache(cache_dir, PARSER_VERSION) if cache_dir else None
+        self.workers = workers
         self.tree = None
         self.root = None
         self.xmlns_header = None
 
         self.temp_cast = {}
+        self.temp_forms = defaultdict(list)
+        self.position = 0
 
-    def parse(self, xml_string: str):
+    def parse(self, source: Source, corpus_name: str = "corpus",
+              replace: bool = False) -> str:
         """
         Extract the content from the xml corpus, transform it to sqlalchemy objects and
             load it into the connected database.
+            Every parse creates a new corpus, a corpus which fails to load is dropped
+            again. With a cache directory the rows of a corpus parsed before are
+            replayed from the cache instead.
 
         Args:
-            xml_string: string containing xml corpus
-        """
-        self.tree = etree.fromstring(xml_string)
-        self.root = None
-        if isinstance(self.tree, etree._Element):
-            self.root = self.tree
-        else:
-            self.root = self.tree.getroot()
+            source: xml corpus as os.PathLike path, binary file object, bytes,
+                memory map or string, optionally compressed, see
+                ingestion.corpus_source
+            corpus_name: name to register the corpus under
+            replace: drop the stored corpora of the same name once this one is loaded
+
+        Returns:
+            string id of the new corpus
+        """
+        source_hash = None
+        if self.cache is not None:
+            try:
+                source_hash = content_hash(source)
+            except CorpusSourceError:
+                # unseekable streams are parsed without cache
+                pass
+        if source_hash is not None and source_hash in self.cache:
+            try:
+                return self.cache.replay(source_hash, self, corpus_name, replace)
+            except ParseCacheError:
+                # parse again and overwrite the unreadable cache file
+                pass
+
+        act_regions = self.scan(source)
+        self.tree = act_regions.skeleton_tree() if act_regions else read_tree(source)
+        self.root = self.tree.getroot()
         self.xmlns_header = list(self.root.nsmap.values())[0]
+        self.temp_cast = {}
+        self.temp_forms = defaultdict(list)
+        self.position = 0
+
+        with self.loading_corpus(corpus_name, replace) as corpus_id:
+            # parse meta information
+            # TODO: parse meta information
 
-        # parse meta information
-        # TODO: parse meta information
+            # parse cast information
+            self.parse_cast_list(self.tree)
 
-        # parse cast information
-        self.parse_cast_list(self.tree)
+            # parse play information
+            if act_regions is None:
+                self.parse_body(self.tree)
+            else:
+                self.parse_acts(act_regions)
 
-        # parse play information
-        self.parse_body(self.tree)
+            # build search index
+            self.build_token_index()
+
+        if source_hash is not None:
+            self.cache.save(self, source_hash, corpus_id)
+        return corpus_id
+
+    def scan(self, source: Source) -> Optional[ActRegions]:
+        """
+        Find the act regions of a source worth parsing in parallel.
+
+        Returns:
+            act regions or None if the source is parsed in one piece
+        """
+        if self.workers < 2 or not isinstance(source, os.PathLike) \
+                or os.path.getsize(source) < PARALLEL_MIN_SIZE:
+            return None
+        return scan_acts(os.fspath(source))
 
     ###
     # parse meta information
@@ -77,6 +157,16 @@ class TeiXmlParser(DatabaseConnector):
         """
         return f"\u007b{self.xmlns_header}\u007d{tag}"
 
+    def next_position(self) -> int:
+        """
+        Get the document order position for the next parsed play element.
+
+        Returns:
+            int position
+        """
+        self.position += 1
+        return self.position
+
     ###
     # parse cast information
     def parse_cast_list(self, tree: etree._ElementTree):
@@ -97,6 +187,7 @@ class TeiXmlParser(DatabaseConnector):
             cast_group: xml subtree to parse
         """
         db_cast_group = schema.CastGroup(
+            corpus_id=self.corpus_id,
             id=str(uuid.uuid4())
         )
         self.insert(db_cast_group)
@@ -142,6 +233,7 @@ class TeiXmlParser(DatabaseConnector):
         name_obj = cast_item.find(f"{self.xmlns('role')}/{self.xmlns('name')}")
 
         db_cast_item = schema.CastItem(
+            corpus_id=self.corpus_id,
             id=self.get_cast_item_id(cast_item).strip("#"),
             cast_group_id=cast_group_id,
             content=" ".join([el.strip() for el in cast_item.itertext() if el.strip()]),
@@ -165,6 +257,7 @@ class TeiXmlParser(DatabaseConnector):
         desc_obj = cast_item.find(f"{self.xmlns('roleDesc')}")
 
         db_cast_role = schema.CastRole(
+            corpus_id=self.corpus_id,
             id=str(uuid.uuid4()),
             cast_item_id=cast_item_id or cast_item.attrib.get("sameAs"),
             content=content,
@@ -187,6 +280,53 @@ class TeiXmlParser(DatabaseConnector):
         for act in body.findall(f".//{act_query}"):
             self.parse_act(act)
 
+    def parse_acts(self, act_regions: ActRegions):
+        """
+        Parse the act regions of a file in worker processes and load their rows in
+            document order. At most two acts per worker are parsed ahead of the act
+            being loaded.
+
+        Args:
+            act_regions: act regions found by scan
+        """
+        # the workers read their regions from the file, the skeleton stays here
+        task_regions = dataclasses.replace(act_regions, skeleton=b"")
+        cast_ids = list(self.temp_cast)
+        # workers are started fresh instead of forking a process with open
+        #  connections and, in the service, other threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            submitted = (pool.submit(parse_act_region, task_regions, index,
+                                     self.xmlns_header, self.corpus_id, cast_ids)
+                         for index in range(len(act_regions.regions)))
+            pending = deque(islice(submitted, 2 * self.workers))
+            while pending:
+                rows, forms, positions = pending.popleft().result()
+                pending.extend(islice(submitted, 1))
+                self.load_act_rows(rows, forms, positions)
+
+    def load_act_rows(self, rows: Dict[str, List[Dict]],
+                      forms: Dict[Tuple[str, str], List[str]], positions: int):
+        """
+        Load the rows of an act parsed by an ActParser after the acts before it.
+
+        Args:
+            rows: rows of the act by table name, positions counted from 1
+            forms: token ids by (kind, normalized form) in document order
+            positions: number of positions used by the act
+        """
+        for table in schema.CORPUS_TABLES:
+            table_rows = rows.get(table.name)
+            if not table_rows:
+                continue
+            if "position" in table.c:
+                for row in table_rows:
+                    row["position"] += self.position
+            self.insert_rows(table, table_rows)
+        self.position += positions
+        for key, token_ids in forms.items():
+            self.temp_forms[key].extend(token_ids)
+
     def parse_act(self, act: etree._Element):
         """
         Parse act instance
@@ -196,7 +336,9 @@ class TeiXmlParser(DatabaseConnector):
         """
         act_head = act.find(f".//{self.xmlns('head')}")
         db_act = schema.Act(
+            corpus_id=self.corpus_id,
             id=str(uuid.uuid4()),
+            position=self.next_position(),
             content=" ".join([el.strip() for el in act_head.itertext() if el.strip()]),
         )
         self.insert(db_act)
@@ -215,18 +357,23 @@ class TeiXmlParser(DatabaseConnector):
         """
         scene_head = scene.find(f".//{self.xmlns('head')}")
         db_scene = schema.Scene(
+            corpus_id=self.corpus_id,
             id=str(uuid.uuid4()),
+            position=self.next_position(),
             act_id=act_id,
             content=" ".join([el.strip() for el in scene_head.itertext() if el.strip()])
         )
         self.insert(db_scene)
 
-        stage_query = self.xmlns('stage[@who]')
-        for stage in scene.findall(f".//{stage_query}"):
-            self.parse_stage(stage, scene_id=db_scene.id)
-
-        for speech in scene.findall(f".//{self.xmlns('sp')}"):
-            self.parse_speech(speech, scene_id=db_scene.id)
+        # walk stages and speeches in document order,
+        #  stages within speeches are parsed along with their speech
+        stage_tag, speech_tag = self.xmlns('stage'), self.xmlns('sp')
+        for element in scene.iter(stage_tag, speech_tag):
+            if element.tag == speech_tag:
+                self.parse_speech(element, scene_id=db_scene.id)
+            elif "who" in element.attrib \
+                    and next(element.iterancestors(speech_tag), None) is None:
+                self.parse_stage(element, scene_id=db_scene.id)
 
     @staticmethod
     def get_id(attrib: Dict) -> str:
@@ -251,13 +398,19 @@ class TeiXmlParser(DatabaseConnector):
             scene_id: int id of the parent scene
         """
         db_stage = schema.Stage(
+            corpus_id=self.corpus_id,
             id=self.get_id(stage.attrib),
+            position=self.next_position(),
             scene_id=scene_id,
             content=" ".join([el.strip() for el in stage.itertext() if el.strip()]),
-            cast=[self.temp_cast[cast.strip("#")]
-                  for cast in stage.attrib["who"].split()],
         )
         self.insert(db_stage)
+        self.insert_rows(schema.cast_stage_association_table, [
+            {"corpus_id": self.corpus_id, "cast_item_id": self.temp_cast[cast].id,
+             "stage_id": db_stage.id}
+            for cast in dict.fromkeys(cast.strip("#")
+                                      for cast in stage.attrib["who"].split())
+        ])
 
     def parse_speech(self, speech: etree._Element, scene_id: str):
         """
@@ -271,14 +424,20 @@ class TeiXmlParser(DatabaseConnector):
             List of objects containing this speech and all its children.
         """
         db_speech = schema.Speech(
+            corpus_id=self.corpus_id,
             id=self.get_id(speech.attrib),
+            position=self.next_position(),
             scene_id=scene_id,
             cast_item_id=speech.attrib["who"].split()[0].strip("#")
         )
         self.insert(db_speech)
 
-        for line in speech.findall(f".//{self.xmlns('l')}"):
-            self.parse_line(line, speech_id=db_speech.id)
+        line_tag, stage_tag = self.xmlns('l'), self.xmlns('stage')
+        for element in speech.iter(line_tag, stage_tag):
+            if element.tag == line_tag:
+                self.parse_line(element, speech_id=db_speech.id)
+            elif "who" in element.attrib:
+                self.parse_stage(element, scene_id=scene_id)
 
     def parse_line(self, line, speech_id: str):
         """
@@ -289,7 +448,9 @@ class TeiXmlParser(DatabaseConnector):
             speech_id: str id name of the parent speech
         """
         db_line = schema.Line(
+            corpus_id=self.corpus_id,
             id=self.get_id(line.attrib),
+            position=self.next_position(),
             speech_id=speech_id
         )
         self.insert(db_line)
@@ -308,10 +469,99 @@ class TeiXmlParser(DatabaseConnector):
             line_id: str id name of the parent line
         """
         db_token = schema.Token(
+            corpus_id=self.corpus_id,
             id=self.get_id(token.attrib),
+            position=self.next_position(),
             line_id=line_id,
             content=" ".join([el.strip() for el in token.itertext() if el.strip()]),
             lemma=token.attrib["lemma"],
             ana=token.attrib["ana"],
         )
         self.insert(db_token)
+
+        for kind, form in (("content", db_token.content), ("lemma", db_token.lemma)):
+            form = normalize_form(form)
+            if form:
+                self.temp_forms[(kind, form)].append(db_token.id)
+
+    ###
+    # build search index
+    def build_token_index(self):
+        """
+        Build the character trigram index over the distinct token forms and lemmas
+            collected while parsing the tokens.
+        """
+        new_forms, new_trigrams, postings = [], [], []
+        for (kind, form), token_ids in self.temp_forms.items():
+            form_id = get_form_id(kind, form)
+            postings.extend({"corpus_id": self.corpus_id, "form_id": form_id,
+                             "token_id": token_id}
+                            for token_id in dict.fromkeys(token_ids))
+            form_trigrams = trigrams(form)
+            new_forms.append(schema.TokenForm(
+                corpus_id=self.corpus_id,
+                id=form_id,
+                kind=kind,
+                form=form,
+                frequency=len(token_ids),
+                trigram_count=len(form_trigrams)
+            ))
+            new_trigrams.extend({"corpus_id": self.corpus_id, "trigram": trigram,
+                                 "form_id": form_id}
+                                for trigram in form_trigrams)
+
+        self.bulk_insert(new_forms)
+        self.insert_rows(schema.FormTrigram.__table__, new_trigrams)
+        self.insert_rows(schema.token_form_association_table, postings)
+
+
+class ActParser(TeiXmlParser):
+    """
+    Class parsing single acts in a worker process, the rows are collected instead
+        of being written to the database.
+    """
+
+    def __init__(self, xmlns_header: str, corpus_id: str, cast_ids: List[str]):
+        """
+        Args:
+            xmlns_header: main namespace of the document
+            corpus_id: id of the loading corpus
+            cast_ids: ids of the cast items parsed from the castList
+        """
+        # workers don't connect to the database, so DatabaseConnector isn't set up
+        self.xmlns_header = xmlns_header
+        self.corpus_id = corpus_id
+        self.temp_cast = {cast_id: schema.CastItem(corpus_id=corpus_id, id=cast_id)
+                          for cast_id in cast_ids}
+        self.temp_forms = defaultdict(list)
+        self.position = 0
+        self.rows: Dict[str, List[Dict]] = defaultdict(list)
+
+    def insert(self, element: schema.Base) -> None:
+        self.rows[element.__table__.name].append(
+            {column.key: getattr(element, column.key)
+             for column in element.__table__.columns})
+
+    def bulk_insert(self, elements: List[schema.Base]) -> None:
+        for element in elements:
+            self.insert(element)
+
+    def insert_rows(self, table: sa.Table, rows: List[Dict]) -> None:
+        self.rows[table.name].extend(rows)
+
+
+def parse_act_region(act_regions: ActRegions, index: int, xmlns_header: str,
+                     corpus_id: str, cast_ids: List[str]
+                     ) -> Tuple[Dict[str, List[Dict]], Dict[Tuple[str, str], List[str]], int]:
+    """
+    Parse one act region of a file, run in the worker processes of
+        TeiXmlParser.parse_acts.
+
+    Returns:
+        (rows by table name, token ids by form, number of positions used) of the act
+    """
+    document = etree.fromstring(act_regions.region_document(index),
+                                etree.XMLParser(huge_tree=True))
+    parser = ActParser(xmlns_header, corpus_id, cast_ids)
+    parser.parse_act(document[0])
+    return dict(parser.rows), dict(parser.temp_forms), parser.position
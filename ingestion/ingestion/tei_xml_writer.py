@@ -0,0 +1,330 @@
+"""
+This module contains the TeiXmlWriter class to rebuild TEI formatted xml documents
+    from corpora stored in the database.
+
+    Rows are read with ordered server side cursors and written with an incremental
+    lxml xmlfile writer, so the memory used doesn't grow with the size of the export.
+"""
+import heapq
+from contextlib import ExitStack
+from itertools import groupby
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+import sqlalchemy as sa
+from lxml import etree
+
+from .database_connector import DatabaseConnector
+from . import tei_sql_schema as schema
+
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+XML_ID = f"{{{XML_NS}}}id"
+
+# nesting depth of the play elements opened while writing the body
+ACT, SCENE, SPEECH, LINE = range(4)
+
+
+def tei(tag: str) -> str:
+    """
+    Wrap the tag with the TEI namespace.
+    """
+    return f"{{{TEI_NS}}}{tag}"
+
+
+def write_element(xf, tag: str, text: str = None, attrib: dict = None):
+    """
+    Write a TEI element without children.
+        Elements are written through the xmlfile writer instead of being built
+        separately, so they share the namespace declarations of the document.
+    """
+    with xf.element(tei(tag), attrib or {}):
+        if text:
+            xf.write(text)
+
+
+class _OpenElements:
+    """
+    Stack of the play elements currently opened in the xmlfile writer.
+    """
+
+    def __init__(self, xf):
+        self.xf = xf
+        self.stack: List[Tuple[int, str, ExitStack]] = []
+
+    def key(self, depth: int) -> Optional[str]:
+        """
+        Get the id of the open element at depth or None if there is none.
+        """
+        if depth < len(self.stack):
+            return self.stack[depth][1]
+        return None
+
+    def close(self, depth: int):
+        """
+        Close all open elements at depth or deeper.
+        """
+        while len(self.stack) > depth:
+            _, _, element = self.stack.pop()
+            element.close()
+
+    def open(self, depth: int, key: str, tag: str, attrib: dict):
+        """
+        Open a new element at depth, closing the previous one first.
+        """
+        self.close(depth)
+        element = ExitStack()
+        element.enter_context(self.xf.element(tei(tag), attrib))
+        self.stack.append((depth, key, element))
+
+
+class TeiXmlWriter(DatabaseConnector):
+    """
+    Class exporting corpora from the connected database as TEI formatted xml.
+    """
+
+    def export(self, target: Union[str, BinaryIO], corpus_id: str, act_id: str = None,
+               cast_item_id: str = None, title: str = None,
+               batch_size: int = 1000):
+        """
+        Write a stored corpus, or a subset of it, as TEI xml document.
+
+        Args:
+            target: path or binary file object to write to
+            corpus_id: id of the corpus to export
+            act_id: only export the act with this id
+            cast_item_id: only export the speeches of this cast item
+            title: title written to the teiHeader
+            batch_size: number of rows fetched from the cursors at once
+        """
+        self.corpus_id = corpus_id
+        with etree.xmlfile(target, encoding="utf-8") as xf:
+            xf.write_declaration()
+            # the xml prefix is declared explicitly, otherwise xmlfile binds xml:id
+            #  to a generated prefix
+            with xf.element(tei("TEI"), nsmap={None: TEI_NS, "xml": XML_NS}):
+                self.write_header(xf, title)
+                with xf.element(tei("text")):
+                    with xf.element(tei("front")):
+                        self.write_cast_list(xf, cast_item_id)
+                    with xf.element(tei("body")):
+                        self.write_body(xf, act_id, cast_item_id, batch_size)
+
+    ###
+    # write meta information
+    @staticmethod
+    def write_header(xf, title: str = None):
+        """
+        Write a minimal teiHeader.
+
+        Args:
+            xf: lxml xmlfile writer
+            title: title of the exported corpus
+        """
+        with xf.element(tei("teiHeader")), xf.element(tei("fileDesc")):
+            with xf.element(tei("titleStmt")):
+                write_element(xf, "title", title or "Exported corpus")
+            with xf.element(tei("publicationStmt")):
+                write_element(xf, "p", "Exported from the text technology database.")
+            with xf.element(tei("sourceDesc")):
+                write_element(xf, "p", "Rebuilt from the stored play information.")
+
+    ###
+    # write cast information
+    def write_cast_list(self, xf, cast_item_id: str = None):
+        """
+        Write one castList per stored CastGroup.
+
+        Args:
+            xf: lxml xmlfile writer
+            cast_item_id: only write this cast item
+        """
+        statement = sa.select(
+            schema.CastItem.cast_group_id, schema.CastItem.id, schema.CastItem.name,
+            schema.CastItem.content, schema.CastRole.description
+        ).outerjoin(schema.CastRole, sa.and_(
+            schema.CastRole.corpus_id == schema.CastItem.corpus_id,
+            schema.CastRole.cast_item_id == schema.CastItem.id)) \
+            .order_by(schema.CastItem.cast_group_id, schema.CastItem.id)
+        if cast_item_id is not None:
+            statement = statement.where(schema.CastItem.id == cast_item_id)
+
+        rows = self.stream(statement, 1000, schema.CastItem.__table__,
+                           schema.CastRole.__table__)
+        for _, cast_group in groupby(rows, key=lambda row: row.cast_group_id):
+            with xf.element(tei("castList")):
+                for _, cast_item in groupby(cast_group, key=lambda row: row.id):
+                    self.write_cast_item(xf, list(cast_item))
+
+    @staticmethod
+    def write_cast_item(xf, rows: List[sa.engine.Row]):
+        """
+        Write a castItem element from the rows of one cast item and its roles.
+        """
+        first = rows[0]
+        descriptions = [row.description for row in rows if row.description]
+        with xf.element(tei("castItem"), {XML_ID: first.id}):
+            if not (first.name or descriptions):
+                xf.write(first.content)
+                return
+            with xf.element(tei("role")):
+                write_element(xf, "name", first.name or first.content)
+            for description in descriptions:
+                write_element(xf, "roleDesc", description)
+
+    ###
+    # write play information
+    def body_rows(self, act_id: str = None, cast_item_id: str = None,
+                  batch_size: int = 1000) -> Iterator[Tuple[int, bool, sa.engine.Row]]:
+        """
+        Stream the speeches with their lines and tokens merged with the stages in
+            document order.
+
+        Returns:
+            iterator over (position, is stage, row) tuples
+        """
+        speeches = sa.select(
+            schema.Act.id.label("act_id"), schema.Act.content.label("act_head"),
+            schema.Scene.id.label("scene_id"), schema.Scene.content.label("scene_head"),
+            schema.Speech.id.label("speech_id"), schema.Speech.cast_item_id,
+            schema.Line.id.label("line_id"), schema.Token.id.label("token_id"),
+            schema.Token.content, schema.Token.lemma, schema.Token.ana,
+            sa.func.coalesce(schema.Token.position, schema.Line.position,
+                             schema.Speech.position).label("position")
+        ).select_from(schema.Speech) \
+            .join(schema.Scene, schema.Scene.id == schema.Speech.scene_id) \
+            .join(schema.Act, schema.Act.id == schema.Scene.act_id) \
+            .outerjoin(schema.Line, sa.and_(
+                schema.Line.corpus_id == schema.Speech.corpus_id,
+                schema.Line.speech_id == schema.Speech.id)) \
+            .outerjoin(schema.Token, sa.and_(
+                schema.Token.corpus_id == schema.Line.corpus_id,
+                schema.Token.line_id == schema.Line.id)) \
+            .order_by(schema.Speech.position, schema.Line.position, schema.Token.position)
+
+        stages = sa.select(
+            schema.Act.id.label("act_id"), schema.Act.content.label("act_head"),
+            schema.Scene.id.label("scene_id"), schema.Scene.content.label("scene_head"),
+            schema.Stage.id.label("stage_id"), schema.Stage.content,
+            schema.Stage.position,
+            schema.cast_stage_association_table.c.cast_item_id
+        ).select_from(schema.Stage) \
+            .join(schema.Scene, schema.Scene.id == schema.Stage.scene_id) \
+            .join(schema.Act, schema.Act.id == schema.Scene.act_id) \
+            .outerjoin(schema.cast_stage_association_table, sa.and_(
+                schema.cast_stage_association_table.c.corpus_id == schema.Stage.corpus_id,
+                schema.cast_stage_association_table.c.stage_id == schema.Stage.id)) \
+            .order_by(schema.Stage.position,
+                      schema.cast_stage_association_table.c.cast_item_id)
+
+        if act_id is not None:
+            speeches = speeches.where(schema.Act.id == act_id)
+            stages = stages.where(schema.Act.id == act_id)
+        if cast_item_id is not None:
+            speeches = speeches.where(schema.Speech.cast_item_id == cast_item_id)
+
+        speech_rows = ((row.position, False, row) for row in self.stream(
+            speeches, batch_size, schema.Speech.__table__, schema.Scene.__table__,
+            schema.Act.__table__))
+        if cast_item_id is not None:
+            # stages don't belong to a single speaker
+            return speech_rows
+
+        stage_rows = (
+            (position, True, list(group)) for position, group in
+            groupby(self.stream(stages, batch_size, schema.Stage.__table__,
+                                schema.Scene.__table__, schema.Act.__table__),
+                    key=lambda row: row.position)
+        )
+        return heapq.merge(speech_rows, stage_rows, key=lambda item: item[0])
+
+    def write_body(self, xf, act_id: str = None, cast_item_id: str = None,
+                   batch_size: int = 1000):
+        """
+        Write the acts, scenes, stages, speeches, lines and tokens in document order.
+            Stages are held back until the next speech row shows whether they were
+            placed within a speech or between speeches.
+
+        Args:
+            xf: lxml xmlfile writer
+            act_id: only export the act with this id
+            cast_item_id: only export the speeches of this cast item
+            batch_size: number of rows fetched from the cursors at once
+        """
+        open_elements = _OpenElements(xf)
+        pending_stages = []
+        for _, is_stage, row in self.body_rows(act_id, cast_item_id, batch_size):
+            if is_stage:
+                pending_stages.append(row)
+                continue
+            for stage in pending_stages:
+                self.write_stage(xf, open_elements, stage, row)
+            pending_stages = []
+
+            self.open_scene(open_elements, row)
+            if open_elements.key(SPEECH) != row.speech_id:
+                open_elements.open(SPEECH, row.speech_id, "sp", {
+                    XML_ID: row.speech_id, "who": f"#{row.cast_item_id}"})
+            if row.line_id is None:
+                continue
+            if open_elements.key(LINE) != row.line_id:
+                open_elements.open(LINE, row.line_id, "l", {XML_ID: row.line_id})
+            elif row.token_id is not None:
+                # the tail text of the tokens isn't stored, separate them by a space
+                xf.write(" ")
+            if row.token_id is not None:
+                self.write_token(xf, row)
+        for stage in pending_stages:
+            self.write_stage(xf, open_elements, stage, None)
+        open_elements.close(ACT)
+
+    @staticmethod
+    def open_scene(open_elements: _OpenElements, row: sa.engine.Row):
+        """
+        Make sure the act and scene of the row are the open ones.
+        """
+        if open_elements.key(ACT) != row.act_id:
+            open_elements.open(ACT, row.act_id, "div", {"type": "act"})
+            write_element(open_elements.xf, "head", row.act_head)
+        if open_elements.key(SCENE) != row.scene_id:
+            open_elements.open(SCENE, row.scene_id, "div", {"type": "scene"})
+            write_element(open_elements.xf, "head", row.scene_head)
+
+    def write_stage(self, xf, open_elements: _OpenElements,
+                    rows: List[sa.engine.Row], next_row: Optional[sa.engine.Row]):
+        """
+        Write a held back stage into the open speech if the next row continues that
+            speech, otherwise between the speeches of its scene.
+
+        Args:
+            xf: lxml xmlfile writer
+            open_elements: currently open play elements
+            rows: rows of the stage, one per cast item on stage
+            next_row: speech row following the stage
+        """
+        first = rows[0]
+        in_speech = next_row is not None and next_row.scene_id == first.scene_id \
+            and open_elements.key(SPEECH) == next_row.speech_id
+        if in_speech:
+            if open_elements.key(LINE) != next_row.line_id:
+                open_elements.close(LINE)
+        else:
+            open_elements.close(SPEECH)
+            self.open_scene(open_elements, first)
+
+        attrib = {XML_ID: first.stage_id}
+        who = " ".join(f"#{row.cast_item_id}" for row in rows if row.cast_item_id)
+        if who:
+            attrib["who"] = who
+        write_element(xf, "stage", first.content, attrib)
+
+    @staticmethod
+    def write_token(xf, row: sa.engine.Row):
+        """
+        Write a w element from a token row.
+        """
+        attrib = {XML_ID: row.token_id}
+        if row.lemma is not None:
+            attrib["lemma"] = row.lemma
+        if row.ana is not None:
+            attrib["ana"] = row.ana
+        write_element(xf, "w", row.content, attrib)
@@ -0,0 +1,56 @@
+"""
+This module contains the helpers to build the character trigram index over the
+    distinct token forms and lemmas of a parsed corpus.
+
+    The webapp keeps its own copy of `trigrams` in app/trigram.py to look forms up
+    in this index, so both implementations have to stay in sync.
+"""
+import uuid
+from typing import Set
+
+# namespace used to derive stable ids for token forms
+FORM_NAMESPACE = uuid.UUID("4b6a0d57-3c1e-4d9b-9f0e-1f6b4c2a7d10")
+
+
+def normalize_form(form: str) -> str:
+    """
+    Normalize a token form or lemma before it is indexed.
+
+    Args:
+        form: raw token content or lemma
+
+    Returns:
+        lowercased and stripped form
+    """
+    return form.strip().lower()
+
+
+def trigrams(form: str) -> Set[str]:
+    """
+    Split a normalized form into its character trigrams.
+        The form is padded with two leading and one trailing blank, so that every
+        character is covered by three trigrams and a single edit destroys at most
+        three of them.
+
+    Args:
+        form: normalized form
+
+    Returns:
+        set of trigrams
+    """
+    padded = f"  {form} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_form_id(kind: str, form: str) -> str:
+    """
+    Get the stable id of an indexed form.
+
+    Args:
+        kind: "content" for token forms or "lemma" for lemmas
+        form: normalized form
+
+    Returns:
+        string of uuid5 id
+    """
+    return str(uuid.uuid5(FORM_NAMESPACE, f"{kind}:{form}"))
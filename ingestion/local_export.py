@@ -0,0 +1,43 @@
+"""
+This module connects to a running mariadb service and exports the stored corpus, or a
+subset of it, as TEI xml document.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from ingestion.tei_xml_writer import TeiXmlWriter
+
+# load env vars from .env file
+load_dotenv("_app.env")
+# get env vars specifying database connection
+DB_USER = os.getenv("TT_DB_USER")
+DB_PASSWORD = os.getenv("TT_DB_PASSWORD")
+DB_HOST = os.getenv("TT_DB_HOST")
+DB_PORT = os.getenv("TT_DB_PORT")
+DB_NAME = os.getenv("TT_DB_NAME", "verona")
+CORPUS_NAME = os.getenv("TT_CORPUS_NAME", "verona")
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("output", help="path of the xml file to write")
+    arg_parser.add_argument("--corpus", default=CORPUS_NAME,
+                            help="name of the corpus, its newest version is exported")
+    arg_parser.add_argument("--act", help="only export the act with this id")
+    arg_parser.add_argument("--speaker", help="only export speeches of this cast item")
+    arg_parser.add_argument("--title", help="title written to the teiHeader")
+    args = arg_parser.parse_args()
+
+    writer = TeiXmlWriter(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    corpora = writer.find_corpora(args.corpus)
+    if not corpora:
+        arg_parser.error(f"no corpus named {args.corpus!r}")
+    writer.export(args.output, corpora[-1].id, act_id=args.act,
+                  cast_item_id=args.speaker, title=args.title or args.corpus)
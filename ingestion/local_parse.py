@@ -3,11 +3,11 @@ This module connects to a running mariadb service, loads a xml TEI corpus and tr
 run the ETL pipeline.
 """
 import os
+from pathlib import Path
 
 from dotenv import load_dotenv
 
 from ingestion.tei_xml_parser import TeiXmlParser
-from ingestion.tei_sql_schema import Base
 
 # load env vars from .env file
 load_dotenv("_app.env")
@@ -17,6 +17,13 @@ DB_PASSWORD = os.getenv("TT_DB_PASSWORD")
 DB_HOST = os.getenv("TT_DB_HOST")
 DB_PORT = os.getenv("TT_DB_PORT")
 DB_NAME = os.getenv("TT_DB_NAME", "verona")
+# directory of the parse cache, corpora are always parsed if unset
+PARSE_CACHE = os.getenv("TT_PARSE_CACHE")
+# processes parsing the acts of a large corpus
+PARSE_WORKERS = int(os.getenv("TT_PARSE_WORKERS", os.cpu_count() or 1))
+CORPUS_NAME = os.getenv("TT_CORPUS_NAME", "verona")
+# plain or compressed corpus file
+CORPUS_PATH = os.getenv("TT_CORPUS_PATH", "../data/corpus.xml")
 
 # connect to db and initialize parser
 PARSER = TeiXmlParser(
@@ -24,18 +31,15 @@ PARSER = TeiXmlParser(
     port=DB_PORT,
     user=DB_USER,
     password=DB_PASSWORD,
-    database=DB_NAME
+    database=DB_NAME,
+    cache_dir=PARSE_CACHE,
+    workers=PARSE_WORKERS
 )
 
 if __name__ == '__main__':
-    # create defined schema in database
-    # this is probably pretty dumb to do on every startup...
-    # TODO: only do this when no database is present
-    #   It wont cause direct issues if you do,
-    #   but outside of a toy project you shouldn't do this
-    Base.metadata.create_all(PARSER.engine)
+    # migrate the database to the schema of the parser, a single query if it is
+    PARSER.upgrade_schema()
 
-    # load corpus from data dir and initiate parser
-    with open("../data/corpus.xml") as file_pointer:
-        xml_string = file_pointer.read()
-        PARSER.parse(xml_string)
+    # parse corpus from data dir, the parser reads the file itself
+    # replace the previously parsed version of the corpus
+    PARSER.parse(Path(CORPUS_PATH), corpus_name=CORPUS_NAME, replace=True)
@@ -0,0 +1,39 @@
+"""
+This module connects to a running mariadb service and copies the stored corpus into a
+read only sqlite snapshot for the webapp.
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+
+from ingestion.sqlite_snapshot import SqliteSnapshot
+
+# load env vars from .env file
+load_dotenv("_app.env")
+# get env vars specifying database connection
+DB_USER = os.getenv("TT_DB_USER")
+DB_PASSWORD = os.getenv("TT_DB_PASSWORD")
+DB_HOST = os.getenv("TT_DB_HOST")
+DB_PORT = os.getenv("TT_DB_PORT")
+DB_NAME = os.getenv("TT_DB_NAME", "verona")
+CORPUS_NAME = os.getenv("TT_CORPUS_NAME", "verona")
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("output", help="path of the snapshot file to write")
+    arg_parser.add_argument("--corpus", default=CORPUS_NAME,
+                            help="name of the corpus, its newest version is copied")
+    args = arg_parser.parse_args()
+
+    snapshot = SqliteSnapshot(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME
+    )
+    corpora = snapshot.find_corpora(args.corpus)
+    if not corpora:
+        arg_parser.error(f"no corpus named {args.corpus!r}")
+    snapshot.build(args.output, corpora[-1].id)
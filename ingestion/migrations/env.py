@@ -0,0 +1,63 @@
+"""
+Alembic environment of the TEI schema.
+
+    Migrations run on the connection handed over by ingestion.schema_migrations, or on
+    the database configured by the TT_DB_* env vars when alembic is run directly.
+"""
+import os
+from logging.config import fileConfig
+
+from alembic import context
+from dotenv import load_dotenv
+
+from ingestion import tei_sql_schema as schema
+from ingestion.database_connector import database_uri, get_engine
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+target_metadata = schema.Base.metadata
+
+
+def configured_uri() -> str:
+    load_dotenv("app.env")
+    return database_uri(
+        user=os.getenv("TT_DB_USER"),
+        password=os.getenv("TT_DB_PASSWORD"),
+        host=os.getenv("TT_DB_HOST"),
+        port=os.getenv("TT_DB_PORT"),
+        database=os.getenv("TT_DB_NAME", "verona")
+    )
+
+
+def run(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # sqlite alters tables by copying them
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_offline():
+    context.configure(url=configured_uri(), target_metadata=target_metadata,
+                      literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        run(connection)
+        return
+    with get_engine(configured_uri()).connect() as connection:
+        run(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,115 @@
+"""tei schema with corpus registry and partitioned corpus tables
+
+Revision ID: 3f6c2d1a9b80
+Revises: 4ed23ce9b57c
+Create Date: 2026-10-19 12:00:00.000000
+
+Play tables of the legacy schema, without corpus_id, are renamed to legacy_<table> so
+the corpus tables can take their names, their rows are moved into a corpus by a
+later revision.
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2d1a9b80'
+down_revision = '4ed23ce9b57c'
+branch_labels = None
+depends_on = None
+
+ID = sa.String(36)
+CORPUS_ID = sa.String(32)
+
+# (table, columns without corpus_id, primary key columns without corpus_id,
+#  indexed columns)
+CORPUS_TABLES = [
+    ("cast_item", [("id", ID), ("cast_group_id", ID), ("name", sa.TEXT),
+                   ("content", sa.TEXT)], ["id"], ["cast_group_id"]),
+    ("cast_role", [("id", ID), ("cast_item_id", ID), ("name", sa.TEXT),
+                   ("content", sa.TEXT), ("description", sa.TEXT)],
+     ["id"], ["cast_item_id"]),
+    ("cast_group", [("id", ID)], ["id"], []),
+    ("act", [("id", ID), ("position", sa.Integer), ("content", sa.TEXT)],
+     ["id"], ["position"]),
+    ("scene", [("id", ID), ("position", sa.Integer), ("act_id", ID),
+               ("content", sa.TEXT)], ["id"], ["position", "act_id"]),
+    ("stage", [("id", ID), ("position", sa.Integer), ("scene_id", ID),
+               ("content", sa.TEXT)], ["id"], ["position", "scene_id"]),
+    ("cast_stage_association", [("cast_item_id", ID), ("stage_id", ID)],
+     ["cast_item_id", "stage_id"], []),
+    ("speech", [("id", ID), ("position", sa.Integer), ("scene_id", ID),
+                ("cast_item_id", ID)], ["id"], ["position", "scene_id", "cast_item_id"]),
+    ("line", [("id", ID), ("position", sa.Integer), ("speech_id", ID)],
+     ["id"], ["position", "speech_id"]),
+    ("token", [("id", ID), ("position", sa.Integer), ("line_id", ID),
+               ("content", sa.TEXT), ("lemma", sa.TEXT), ("ana", sa.TEXT)],
+     ["id"], ["position", "line_id"]),
+    ("token_form", [("id", ID), ("kind", sa.String(8)), ("form", sa.String(255)),
+                    ("frequency", sa.Integer), ("trigram_count", sa.Integer)],
+     ["id"], ["form"]),
+    ("token_form_association", [("form_id", ID), ("token_id", ID)],
+     ["form_id", "token_id"], []),
+    ("form_trigram", [("trigram", sa.String(3)), ("form_id", ID)],
+     ["trigram", "form_id"], []),
+]
+LEGACY_PREFIX = "legacy_"
+
+
+def legacy_tables():
+    """
+    Get the play tables created without corpus_id by the legacy parser, the
+        ddl printed in offline mode is the one of a new database.
+    """
+    if context.is_offline_mode():
+        return []
+    inspector = sa.inspect(op.get_bind())
+    return [table for table, _, _, _ in CORPUS_TABLES
+            if inspector.has_table(table)
+            and "corpus_id" not in {column["name"]
+                                    for column in inspector.get_columns(table)}]
+
+
+def upgrade():
+    for table in legacy_tables():
+        op.rename_table(table, LEGACY_PREFIX + table)
+
+    op.create_table(
+        "corpus",
+        sa.Column("id", CORPUS_ID, primary_key=True),
+        sa.Column("name", sa.String(255)),
+        sa.Column("location", sa.String(255)),
+        sa.Column("created_at", sa.DateTime),
+    )
+    op.create_index("ix_corpus_name", "corpus", ["name"])
+
+    # on sqlite the corpus tables are created in the file of each corpus
+    if op.get_bind().dialect.name == "sqlite":
+        return
+    for table, columns, primary_key, indexed in CORPUS_TABLES:
+        op.create_table(
+            table,
+            sa.Column("corpus_id", CORPUS_ID, primary_key=True),
+            *(sa.Column(name, type_, primary_key=name in primary_key)
+              for name, type_ in columns),
+        )
+        for column in indexed:
+            op.create_index(f"ix_{table}_{column}", table, [column])
+        # mariadb can't create a list partitioned table without partitions
+        op.execute(f"ALTER TABLE {table} PARTITION BY LIST COLUMNS(corpus_id) "
+                   f"(PARTITION p_empty VALUES IN (''))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        for table, _, _, _ in reversed(CORPUS_TABLES):
+            op.drop_table(table)
+    op.drop_index("ix_corpus_name", "corpus")
+    op.drop_table("corpus")
+
+    if context.is_offline_mode():
+        return
+    inspector = sa.inspect(op.get_bind())
+    for table, _, _, _ in CORPUS_TABLES:
+        if inspector.has_table(LEGACY_PREFIX + table):
+            op.rename_table(LEGACY_PREFIX + table, table)
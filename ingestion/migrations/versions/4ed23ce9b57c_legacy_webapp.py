@@ -0,0 +1,27 @@
+"""legacy webapp schema, play tables created by the parser without corpora
+
+Revision ID: 4ed23ce9b57c
+Revises:
+Create Date: 2022-02-19 19:26:14.560975
+
+Databases served by the first webapp were stamped with this revision by
+Flask-Migrate. It only created the unused question and answer tables, the play tables
+(act, scene, token, ...) were created by the parser with create_all and hold a single
+play without corpus_id. The revision is kept as root of the chain so those databases
+can be upgraded, new databases don't need the question and answer tables.
+"""
+
+
+# revision identifiers, used by Alembic.
+revision = '4ed23ce9b57c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
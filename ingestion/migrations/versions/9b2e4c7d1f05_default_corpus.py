@@ -0,0 +1,223 @@
+"""move the rows of the legacy play tables into a default corpus
+
+Revision ID: 9b2e4c7d1f05
+Revises: 3f6c2d1a9b80
+Create Date: 2026-10-19 20:00:00.000000
+
+The legacy_<table> tables left by the previous revision hold a single play without
+corpus_id or positions. Their rows are copied into a new, complete corpus named
+DEFAULT_CORPUS_NAME (a partition on mariadb, a corpus file on sqlite), its search
+index is built like the parser builds it and the legacy tables are dropped.
+
+The legacy schema didn't store the document order. Rows are numbered depth first
+along act, scene, speech, line and token in the order they were inserted (rowid) on
+sqlite and by id on mariadb, the stages of a scene come before its speeches.
+"""
+import os
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from ingestion.trigram_index import get_form_id, normalize_form, trigrams
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e4c7d1f05'
+down_revision = '3f6c2d1a9b80'
+branch_labels = None
+depends_on = None
+
+DEFAULT_CORPUS_NAME = "default"
+LEGACY_PREFIX = "legacy_"
+# rows inserted at once
+BATCH_SIZE = 1000
+
+ID = sa.String(36)
+CORPUS_ID = sa.String(32)
+
+# corpus tables as created by 3f6c2d1a9b80, (table, columns without corpus_id,
+#  primary key columns without corpus_id, indexed columns) in dependency order
+CORPUS_TABLES = [
+    ("cast_group", [("id", ID)], ["id"], []),
+    ("cast_item", [("id", ID), ("cast_group_id", ID), ("name", sa.TEXT),
+                   ("content", sa.TEXT)], ["id"], ["cast_group_id"]),
+    ("cast_role", [("id", ID), ("cast_item_id", ID), ("name", sa.TEXT),
+                   ("content", sa.TEXT), ("description", sa.TEXT)],
+     ["id"], ["cast_item_id"]),
+    ("act", [("id", ID), ("position", sa.Integer), ("content", sa.TEXT)],
+     ["id"], ["position"]),
+    ("scene", [("id", ID), ("position", sa.Integer), ("act_id", ID),
+               ("content", sa.TEXT)], ["id"], ["position", "act_id"]),
+    ("stage", [("id", ID), ("position", sa.Integer), ("scene_id", ID),
+               ("content", sa.TEXT)], ["id"], ["position", "scene_id"]),
+    ("cast_stage_association", [("cast_item_id", ID), ("stage_id", ID)],
+     ["cast_item_id", "stage_id"], []),
+    ("speech", [("id", ID), ("position", sa.Integer), ("scene_id", ID),
+                ("cast_item_id", ID)], ["id"], ["position", "scene_id", "cast_item_id"]),
+    ("line", [("id", ID), ("position", sa.Integer), ("speech_id", ID)],
+     ["id"], ["position", "speech_id"]),
+    ("token", [("id", ID), ("position", sa.Integer), ("line_id", ID),
+               ("content", sa.TEXT), ("lemma", sa.TEXT), ("ana", sa.TEXT)],
+     ["id"], ["position", "line_id"]),
+    ("token_form", [("id", ID), ("kind", sa.String(8)), ("form", sa.String(255)),
+                    ("frequency", sa.Integer), ("trigram_count", sa.Integer)],
+     ["id"], ["form"]),
+    ("token_form_association", [("form_id", ID), ("token_id", ID)],
+     ["form_id", "token_id"], []),
+    ("form_trigram", [("trigram", sa.String(3)), ("form_id", ID)],
+     ["trigram", "form_id"], []),
+]
+# play elements in document order, child tables by parent table and parent column
+CHILDREN = {
+    "act": [("scene", "act_id")],
+    "scene": [("stage", "scene_id"), ("speech", "scene_id")],
+    "speech": [("line", "speech_id")],
+    "line": [("token", "line_id")],
+}
+
+
+def corpus_metadata() -> sa.MetaData:
+    metadata = sa.MetaData()
+    for table, columns, primary_key, indexed in CORPUS_TABLES:
+        sa.Table(table, metadata,
+                 sa.Column("corpus_id", CORPUS_ID, primary_key=True),
+                 *(sa.Column(name, type_, primary_key=name in primary_key,
+                             index=name in indexed)
+                   for name, type_ in columns))
+    return metadata
+
+
+def read_legacy_rows(connection):
+    """
+    Get the rows of the legacy tables by table name, in insertion order on sqlite.
+    """
+    inspector = sa.inspect(connection)
+    rows = {}
+    for table, _, _, _ in CORPUS_TABLES:
+        if not inspector.has_table(LEGACY_PREFIX + table):
+            continue
+        legacy = sa.Table(LEGACY_PREFIX + table, sa.MetaData(), autoload_with=connection)
+        order = [sa.literal_column("rowid")] if connection.dialect.name == "sqlite" \
+            else list(legacy.primary_key.columns)
+        rows[table] = [dict(row) for row in
+                       connection.execute(sa.select(legacy).order_by(*order)).mappings()]
+    return rows
+
+
+def number_rows(rows) -> None:
+    """
+    Give the play elements positions in depth first order.
+    """
+    children = defaultdict(list)
+    for parent, child_tables in CHILDREN.items():
+        for child, column in child_tables:
+            for row in rows.get(child, ()):
+                children[(parent, row.get(column))].append((child, row))
+
+    position = 0
+    stack = [("act", row) for row in reversed(rows.get("act", ()))]
+    while stack:
+        table, row = stack.pop()
+        position += 1
+        row["position"] = position
+        stack.extend(reversed(children.get((table, row["id"]), ())))
+    # rows whose parent is missing follow the rest of their table
+    for table in ("act", "scene", "stage", "speech", "line", "token"):
+        for row in rows.get(table, ()):
+            if "position" not in row:
+                position += 1
+                row["position"] = position
+
+
+def index_rows(tokens):
+    """
+    Get the rows of the trigram index over the forms and lemmas of the tokens, see
+        TeiXmlParser.build_token_index.
+    """
+    forms = defaultdict(list)
+    for token in tokens:
+        for kind, form in (("content", token.get("content")),
+                           ("lemma", token.get("lemma"))):
+            form = normalize_form(form or "")
+            if form:
+                forms[(kind, form)].append(token["id"])
+    form_rows, trigram_rows, postings = [], [], []
+    for (kind, form), token_ids in forms.items():
+        form_id = get_form_id(kind, form)
+        form_trigrams = trigrams(form)
+        form_rows.append({"id": form_id, "kind": kind, "form": form,
+                          "frequency": len(token_ids),
+                          "trigram_count": len(form_trigrams)})
+        trigram_rows.extend({"trigram": trigram, "form_id": form_id}
+                            for trigram in form_trigrams)
+        postings.extend({"form_id": form_id, "token_id": token_id}
+                        for token_id in dict.fromkeys(token_ids))
+    return {"token_form": form_rows, "form_trigram": trigram_rows,
+            "token_form_association": postings}
+
+
+def insert_rows(connection, metadata: sa.MetaData, rows, corpus_id: str) -> None:
+    for table in metadata.sorted_tables:
+        columns = set(table.c.keys())
+        table_rows = [{**{key: value for key, value in row.items() if key in columns},
+                       "corpus_id": corpus_id}
+                      for row in rows.get(table.name, ())]
+        for start in range(0, len(table_rows), BATCH_SIZE):
+            connection.execute(table.insert(), table_rows[start:start + BATCH_SIZE])
+
+
+def upgrade():
+    if context.is_offline_mode():
+        # the legacy rows can't be read without a connection
+        return
+    connection = op.get_bind()
+    rows = read_legacy_rows(connection)
+    legacy_tables = list(rows)
+    if not legacy_tables:
+        return
+    number_rows(rows)
+    rows.update(index_rows(rows.get("token", ())))
+
+    corpus_id = uuid.uuid4().hex
+    metadata = corpus_metadata()
+    location = None
+    if connection.dialect.name == "sqlite":
+        # sqlite can't attach a database inside the migration's transaction, the
+        #  corpus file is written on its own connection
+        main_path = connection.engine.url.database
+        stem = os.path.splitext(os.path.basename(main_path))[0]
+        location = os.path.join(f"{stem}_corpora", f"{corpus_id}.db")
+        path = os.path.join(os.path.dirname(main_path), location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        engine = sa.create_engine(f"sqlite:///{path}")
+        try:
+            with engine.begin() as corpus_connection:
+                metadata.create_all(corpus_connection)
+                insert_rows(corpus_connection, metadata, rows, corpus_id)
+        except Exception:
+            os.remove(path)
+            raise
+        finally:
+            engine.dispose()
+    else:
+        for table in metadata.sorted_tables:
+            op.execute(f"ALTER TABLE {table.name} ADD PARTITION "
+                       f"(PARTITION p_{corpus_id} VALUES IN ('{corpus_id}'))")
+        insert_rows(connection, metadata, rows, corpus_id)
+
+    corpus = sa.table("corpus", sa.column("id"), sa.column("name"),
+                      sa.column("location"), sa.column("created_at"))
+    op.execute(corpus.insert().values(id=corpus_id, name=DEFAULT_CORPUS_NAME,
+                                      location=location, created_at=datetime.utcnow()))
+    # children first, the legacy tables may still carry foreign keys
+    for table, _, _, _ in reversed(CORPUS_TABLES):
+        if table in legacy_tables:
+            op.drop_table(LEGACY_PREFIX + table)
+
+
+def downgrade():
+    # the default corpus stays, it can be dropped like any other corpus
+    pass
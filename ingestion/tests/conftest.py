@@ -0,0 +1,153 @@
+"""
+Fixtures of the ingestion tests, run with `python -m pytest` from ingestion/ or the
+    repository root.
+
+    Corpora are generated TEI documents shaped like the Folger editions, databases
+    are sqlite files in the temporary directory of a test.
+"""
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+
+INGESTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# behind the repository root, whose app package shadows ingestion/app.py
+if INGESTION_DIR not in sys.path:
+    sys.path.append(INGESTION_DIR)
+
+from ingestion.database_connector import DatabaseConnector  # noqa: E402
+from ingestion import tei_sql_schema as schema  # noqa: E402
+
+CAST = ["Valentine", "Proteus", "Julia", "Silvia", "Launce"]
+WORDS = [("loue", "love", "#n1"), ("love", "love", "#n1"), ("sweet", "sweet", "#j"),
+         ("lady", "lady", "#n1"), ("my", "my", "#po"), ("and", "and", "#cc"),
+         ("gentle", "gentle", "#j"), ("hart", "heart", "#n1"), ("Proteus", "Proteus", "#n1")]
+# columns holding the uuids the parser generates, they differ in every parse
+GENERATED_IDS = {"cast_group": {"id"}, "cast_item": {"cast_group_id"},
+                 "cast_role": {"id"}, "act": {"id"}, "scene": {"id", "act_id"},
+                 "stage": {"scene_id"}, "speech": {"scene_id"}}
+
+
+def tei_document(acts: int = 3, scenes: int = 2, speeches: int = 4, lines: int = 3,
+                 words: int = 6, seed: int = 0) -> str:
+    """
+    Generate a TEI document with stages between and within speeches.
+
+    Args:
+        acts: number of acts
+        scenes: scenes per act
+        speeches: speeches per scene
+        lines: lines per speech
+        words: tokens per line
+        seed: seed of the chosen speakers and words
+
+    Returns:
+        xml string
+    """
+    rng = random.Random(seed)
+    counters = {"stg": 0, "sp": 0, "ftln": 0, "w": 0}
+
+    def next_id(prefix: str) -> str:
+        counters[prefix] += 1
+        return f"{prefix}-{counters[prefix]:07d}"
+
+    def stage(who):
+        return f'<stage xml:id="{next_id("stg")}" who="{who}">Enter {who}</stage>'
+
+    parts = ['<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><titleStmt>'
+             '<title>Test</title></titleStmt></fileDesc></teiHeader><text><front>'
+             '<castList>']
+    parts += [f'<castItem xml:id="{name}_TG"><role><name>{name}</name></role>'
+              f'<roleDesc>a character</roleDesc></castItem>' for name in CAST]
+    parts.append('</castList></front><body>')
+    for act in range(1, acts + 1):
+        parts.append(f'<div type="act" n="{act}"><head>ACT {act}</head>')
+        for scene in range(1, scenes + 1):
+            parts.append(f'<div type="scene" n="{scene}"><head>Scene {scene}</head>')
+            parts.append(stage(" ".join(f"#{name}_TG" for name in rng.sample(CAST, 2))))
+            for speech in range(speeches):
+                speaker = f"#{rng.choice(CAST)}_TG"
+                parts.append(f'<sp xml:id="{next_id("sp")}" who="{speaker}">')
+                for line in range(lines):
+                    if line == 1 and speech % 2:
+                        parts.append(stage(speaker))
+                    parts.append(f'<l xml:id="{next_id("ftln")}">')
+                    for word, lemma, ana in (rng.choice(WORDS) for _ in range(words)):
+                        parts.append(f'<w xml:id="{next_id("w")}" lemma="{lemma}" '
+                                     f'ana="{ana}">{word}</w> ')
+                    parts.append('</l>')
+                parts.append('</sp>')
+            parts.append('</div>')
+        parts.append('</div>')
+    parts.append('</body></text></TEI>')
+    return "".join(parts)
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    """
+    Database name of a new sqlite database for DatabaseConnector and its subclasses,
+        which open sqlite databases relative to the parent of the working directory.
+    """
+    return os.path.relpath(tmp_path / "test", os.path.dirname(os.getcwd()))
+
+
+@pytest.fixture
+def database_path(tmp_path) -> Path:
+    """
+    Path of the sqlite database named by the database fixture.
+    """
+    return tmp_path / "test.db"
+
+
+@pytest.fixture
+def connector(database):
+    connector = DatabaseConnector(database=database)
+    connector.upgrade_schema()
+    yield connector
+    connector.close()
+
+
+@pytest.fixture
+def corpus_file(tmp_path) -> Path:
+    path = tmp_path / "corpus.xml"
+    path.write_text(tei_document(), encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def corpus_rows():
+    """
+    Read the rows of a stored corpus, see read_corpus_rows.
+    """
+    return read_corpus_rows
+
+
+def read_corpus_rows(connector: DatabaseConnector, corpus_id: str,
+                     generated_ids: bool = True) -> dict:
+    """
+    Read the rows of a stored corpus without corpus_id.
+
+    Args:
+        connector: connector of the database holding the corpus
+        corpus_id: id of the corpus
+        generated_ids: keep the columns of GENERATED_IDS
+
+    Returns:
+        sorted row tuples by table name
+    """
+    rows = {}
+    for table in schema.CORPUS_TABLES:
+        skipped = {"corpus_id"} | (set() if generated_ids
+                                   else GENERATED_IDS.get(table.name, set()))
+        # tables left without columns are compared by their number of rows
+        columns = [column for column in table.c if column.name not in skipped] \
+            or [sa.literal(1)]
+        rows[table.name] = sorted(
+            (tuple(row) for row in connector.stream(
+                sa.select(*columns).select_from(table).order_by(*table.primary_key),
+                1000, table, corpus_id=corpus_id)), key=repr)
+    return rows
@@ -0,0 +1,194 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sa
+
+from ingestion import database_connector
+from ingestion.database_connector import (
+    DatabaseConnector, ER_DROP_PARTITION_NON_EXISTENT, ER_LOCK_WAIT_TIMEOUT)
+from ingestion.tei_sql_schema import Corpus, CORPUS_TABLES
+from ingestion.tei_xml_parser import TeiXmlParser
+
+
+def new_parser(database) -> TeiXmlParser:
+    return TeiXmlParser(None, None, None, None, database)
+
+
+###
+# jobs
+def test_every_job_has_its_own_parser_on_a_shared_engine(connector, database):
+    first, second = new_parser(database), new_parser(database)
+    assert first is not second and first.session is not second.session
+    assert first.engine is second.engine is connector.engine
+    first.close()
+    second.close()
+
+
+def test_loads_commit_in_batches_and_dont_block_other_jobs(
+        connector, database, corpus_file, corpus_rows, monkeypatch):
+    monkeypatch.setattr(database_connector, "FLUSH_SIZE", 50)
+    committed, resume = threading.Event(), threading.Event()
+    written = DatabaseConnector._written
+
+    def pause_first_job(self, count):
+        written(self, count)
+        if threading.current_thread().name == "first" and self._unflushed == 0 \
+                and not committed.is_set():
+            committed.set()
+            assert resume.wait(30)
+
+    monkeypatch.setattr(DatabaseConnector, "_written", pause_first_job)
+    jobs = {}
+
+    def run(name):
+        parser = new_parser(database)
+        try:
+            jobs[name] = parser.parse(corpus_file, corpus_name=name)
+        finally:
+            parser.close()
+
+    first = threading.Thread(target=run, args=("first",), name="first")
+    first.start()
+    try:
+        assert committed.wait(30)
+        # the first batch is committed, the corpus is still invisible
+        assert connector.find_corpora("first") == []
+        with connector.engine.connect() as connection:
+            location, = connection.execute(sa.select(Corpus.location)).one()
+        with sqlite3.connect(connector.corpus_path(location)) as corpus_file_connection:
+            rows = sum(corpus_file_connection.execute(
+                f"SELECT count(*) FROM {table.name}").fetchone()[0]
+                for table in CORPUS_TABLES)
+        assert rows >= 50
+        # a second job loads completely while the first one is halfway
+        run("second")
+        assert [corpus.id for corpus in connector.find_corpora()] == [jobs["second"]]
+    finally:
+        resume.set()
+        first.join(30)
+    assert [corpus.id for corpus in connector.find_corpora()] == \
+        [jobs["second"], jobs["first"]]
+    assert corpus_rows(connector, jobs["first"], generated_ids=False) == \
+        corpus_rows(connector, jobs["second"], generated_ids=False)
+
+
+def test_failed_loads_are_dropped_with_their_batches(
+        connector, database, database_path, corpus_file, monkeypatch):
+    monkeypatch.setattr(database_connector, "FLUSH_SIZE", 50)
+    written = DatabaseConnector._written
+
+    def fail_after_first_batch(self, count):
+        written(self, count)
+        if self.corpus_id is not None and self._unflushed == 0:
+            raise RuntimeError("parse failed")
+
+    monkeypatch.setattr(DatabaseConnector, "_written", fail_after_first_batch)
+    parser = new_parser(database)
+    with pytest.raises(RuntimeError):
+        parser.parse(corpus_file, corpus_name="failing")
+    parser.close()
+    with connector.engine.connect() as connection:
+        assert connection.execute(sa.select(Corpus.id)).all() == []
+    assert list(database_path.parent.glob("*_corpora/*.db")) == []
+
+
+###
+# partition ddl on mariadb
+class MariaDbError(Exception):
+    def __init__(self, errno: int):
+        super().__init__(errno)
+        self.errno = errno
+
+
+class FakeMariaDb:
+    """
+    Engine of a mariadb server whose partition ddl fails with queued errors per table.
+    """
+    dialect = SimpleNamespace(name="mariadb")
+
+    def __init__(self, errors=None, partitions=(), registered=()):
+        self.errors = {table: list(codes) for table, codes in (errors or {}).items()}
+        self.partitions = list(partitions)
+        self.registered = list(registered)
+        self.ddl = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    connect = begin
+
+    def exec_driver_sql(self, statement):
+        if not statement.startswith("ALTER TABLE"):
+            return SimpleNamespace(all=lambda: self.partitions)
+        table = statement.split()[2]
+        if self.errors.get(table):
+            raise sa.exc.OperationalError(statement, None,
+                                          MariaDbError(self.errors[table].pop(0)))
+        self.ddl.append(statement)
+
+    def execute(self, statement):
+        return [(corpus_id,) for corpus_id in self.registered]
+
+
+@pytest.fixture
+def mariadb(connector, monkeypatch):
+    monkeypatch.setattr(database_connector.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(database_connector, "DDL_RETRY_PAUSE", 0)
+
+    def use(**state) -> FakeMariaDb:
+        engine = FakeMariaDb(**state)
+        monkeypatch.setattr(connector, "engine", engine)
+        return engine
+    return use
+
+
+def test_locked_tables_are_retried(connector, mariadb):
+    engine = mariadb(errors={"token": [ER_LOCK_WAIT_TIMEOUT] * 2})
+    tables = [table for table in CORPUS_TABLES if table.name in ("line", "token")]
+    assert connector.alter_partitions(tables, "DROP PARTITION p_x", 10) == []
+    # each statement waits for the locks at most DDL_LOCK_WAIT seconds
+    assert engine.ddl == [f"ALTER TABLE {name} WAIT {database_connector.DDL_LOCK_WAIT} "
+                          f"DROP PARTITION p_x" for name in ("line", "token")]
+
+
+def test_tables_locked_until_the_timeout_are_returned(connector, mariadb):
+    mariadb(errors={"token": [ER_LOCK_WAIT_TIMEOUT] * 100})
+    left = connector.alter_partitions(CORPUS_TABLES, "DROP PARTITION p_x", 0)
+    assert [table.name for table in left] == ["token"]
+
+
+def test_partitions_dropped_by_other_jobs_are_done(connector, mariadb):
+    engine = mariadb(errors={"token": [ER_DROP_PARTITION_NON_EXISTENT]})
+    assert connector.alter_partitions(CORPUS_TABLES, "DROP PARTITION p_x", 0) == []
+    assert len(engine.ddl) == len(CORPUS_TABLES) - 1
+
+
+def test_other_ddl_errors_are_raised(connector, mariadb):
+    mariadb(errors={"token": [1064]})
+    with pytest.raises(sa.exc.OperationalError):
+        connector.alter_partitions(CORPUS_TABLES, "DROP PARTITION p_x", 10)
+
+
+def test_only_partitions_of_unregistered_corpora_are_stale(connector, mariadb):
+    engine = mariadb(partitions=[("token", "p_kept"), ("token", "p_stale"),
+                                 ("line", "p_stale"), ("unknown", "p_other")],
+                     registered=["kept"])
+    connector.drop_stale_partitions()
+    assert sorted(statement.split()[2] for statement in engine.ddl) == ["line", "token"]
+    assert all(statement.endswith("DROP PARTITION p_stale") for statement in engine.ddl)
+
+
+def test_corpora_without_partitions_are_dropped(connector, mariadb, monkeypatch):
+    monkeypatch.setattr(database_connector, "ADD_PARTITION_TIMEOUT", 0)
+    dropped = []
+    monkeypatch.setattr(DatabaseConnector, "drop_corpus",
+                        lambda self, corpus_id: dropped.append(corpus_id))
+    engine = mariadb(errors={"token": [ER_LOCK_WAIT_TIMEOUT]})
+    engine.execute = lambda statement: None
+    with pytest.raises(TimeoutError):
+        connector.create_corpus("locked")
+    assert len(dropped) == 1 and f"p_{dropped[0]}" in engine.ddl[0]
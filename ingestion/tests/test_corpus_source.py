@@ -0,0 +1,131 @@
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+
+import pytest
+from lxml import etree
+
+from ingestion import corpus_source
+from ingestion.corpus_source import (CorpusSourceError, compression, content_hash,
+                                     open_source, read_tree)
+from conftest import tei_document
+
+DOCUMENT = tei_document(acts=2, scenes=1).encode("utf-8")
+COMPRESSORS = {"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+
+
+class Unseekable(io.RawIOBase):
+    """
+    Stream like a request body or a pipe, it can only be read in order.
+    """
+
+    def __init__(self, data: bytes, chunk_size: int = 1000):
+        self.data = io.BytesIO(data)
+        self.chunk_size = chunk_size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.data.read(min(len(buffer), self.chunk_size))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def tokens(tree) -> int:
+    return len(tree.findall(".//{*}w"))
+
+
+@pytest.fixture
+def expected():
+    return tokens(etree.ElementTree(etree.fromstring(DOCUMENT)))
+
+
+@pytest.mark.parametrize("name", [None, *COMPRESSORS])
+def test_compression_is_detected_by_magic_bytes(name):
+    data = COMPRESSORS[name](DOCUMENT) if name else DOCUMENT
+    assert compression(data[:corpus_source.MAGIC_LENGTH]) == name
+
+
+@pytest.mark.parametrize("name", [None, *COMPRESSORS])
+@pytest.mark.parametrize("kind", ["path", "bytes", "file", "unseekable", "mmap"])
+def test_every_source_reads_the_document(tmp_path, expected, name, kind):
+    data = COMPRESSORS[name](DOCUMENT) if name else DOCUMENT
+    path = tmp_path / "corpus.xml"
+    path.write_bytes(data)
+    with open(path, "rb") as file:
+        source = {
+            "path": lambda: path,
+            "bytes": lambda: data,
+            "file": lambda: file,
+            "unseekable": lambda: Unseekable(data),
+            "mmap": lambda: mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ),
+        }[kind]()
+        assert tokens(read_tree(source)) == expected
+
+
+def test_strings_are_documents_not_paths(tmp_path, expected):
+    path = tmp_path / "corpus.xml"
+    path.write_bytes(DOCUMENT)
+    assert tokens(read_tree(DOCUMENT.decode("utf-8"))) == expected
+    with pytest.raises(etree.XMLSyntaxError):
+        read_tree(str(path))
+
+
+def test_uncompressed_files_are_read_by_libxml2(tmp_path):
+    path = tmp_path / "corpus.xml"
+    path.write_bytes(DOCUMENT)
+    with open_source(path) as opened:
+        assert opened == str(path)
+
+
+def test_unseekable_streams_are_read_from_their_start():
+    stream = Unseekable(gzip.compress(DOCUMENT), chunk_size=3)
+    with open_source(stream) as opened:
+        assert opened.read() == DOCUMENT
+
+
+@pytest.mark.parametrize("name", list(COMPRESSORS))
+def test_content_hash_ignores_compression(tmp_path, name):
+    path = tmp_path / "corpus.xml"
+    path.write_bytes(COMPRESSORS[name](DOCUMENT))
+    digest = content_hash(DOCUMENT)
+    assert content_hash(path) == digest
+    assert content_hash(DOCUMENT.decode("utf-8")) == digest
+    with open(path, "rb") as file:
+        file.seek(0)
+        assert content_hash(file) == digest
+        # file objects are moved back for reading the document
+        assert file.tell() == 0
+
+
+def test_unseekable_streams_cant_be_hashed():
+    with pytest.raises(CorpusSourceError, match="unseekable"):
+        content_hash(Unseekable(DOCUMENT))
+
+
+@pytest.mark.parametrize("name", list(COMPRESSORS))
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:10] + b"\x00" * 200,
+])
+def test_truncated_and_corrupt_input(tmp_path, name, damage):
+    path = tmp_path / "corpus.xml"
+    path.write_bytes(damage(COMPRESSORS[name](DOCUMENT)))
+    with pytest.raises(CorpusSourceError, match=f"isn't valid {name} data"):
+        read_tree(path)
+    with pytest.raises(CorpusSourceError):
+        content_hash(path)
+
+
+def test_zstd_needs_zstandard(monkeypatch):
+    monkeypatch.setattr(corpus_source, "zstandard", None)
+    with pytest.raises(CorpusSourceError, match="zstandard"):
+        read_tree(b"\x28\xb5\x2f\xfd" + b"\x00" * 20)
+
+
+def test_unsupported_sources():
+    with pytest.raises(CorpusSourceError, match="int"):
+        read_tree(42)
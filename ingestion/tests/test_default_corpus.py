@@ -0,0 +1,151 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+from ingestion.database_connector import DatabaseConnector
+from ingestion.tei_sql_schema import SCHEMA_REVISION
+from ingestion.tei_xml_writer import TeiXmlWriter
+
+# play tables as the parser created them before corpora existed
+LEGACY_DDL = [
+    "CREATE TABLE cast_group (id VARCHAR(36) PRIMARY KEY)",
+    "CREATE TABLE cast_item (id VARCHAR(36) PRIMARY KEY, cast_group_id VARCHAR(36) "
+    "REFERENCES cast_group (id), name TEXT, content TEXT)",
+    "CREATE TABLE cast_role (id VARCHAR(36) PRIMARY KEY, cast_item_id VARCHAR(36) "
+    "REFERENCES cast_item (id), name TEXT, content TEXT, description TEXT)",
+    "CREATE TABLE act (id VARCHAR(36) PRIMARY KEY, content TEXT)",
+    "CREATE TABLE scene (id VARCHAR(36) PRIMARY KEY, act_id VARCHAR(36) "
+    "REFERENCES act (id), content TEXT)",
+    "CREATE TABLE stage (id VARCHAR(36) PRIMARY KEY, scene_id VARCHAR(36) "
+    "REFERENCES scene (id), content TEXT)",
+    "CREATE TABLE cast_stage_association (cast_item_id VARCHAR(36) REFERENCES "
+    "cast_item (id), stage_id VARCHAR(36) REFERENCES stage (id), "
+    "PRIMARY KEY (cast_item_id, stage_id))",
+    "CREATE TABLE speech (id VARCHAR(36) PRIMARY KEY, scene_id VARCHAR(36) "
+    "REFERENCES scene (id), cast_item_id VARCHAR(36) REFERENCES cast_item (id))",
+    "CREATE TABLE line (id VARCHAR(36) PRIMARY KEY, speech_id VARCHAR(36) "
+    "REFERENCES speech (id))",
+    "CREATE TABLE token (id VARCHAR(36) PRIMARY KEY, line_id VARCHAR(36) "
+    "REFERENCES line (id), content TEXT, lemma TEXT, ana TEXT)",
+]
+# the text of the legacy play, speeches of two lines each, in the order the legacy
+#  parser inserted them, ids don't follow that order
+TEXT = [
+    ("Proteus", ["Cease to persuade", "my loving Proteus"]),
+    ("Valentine", ["Home keeping youth", "have ever homely wits"]),
+    ("Proteus", ["Wilt thou be gone", "sweet Valentine adieu"]),
+]
+
+
+def write_legacy_play(path, stamp: bool):
+    """
+    Write a play into the legacy tables of a new database.
+
+    Args:
+        path: path of the sqlite database
+        stamp: stamp the database with the revision of the legacy webapp
+    """
+    connection = sqlite3.connect(path)
+    for statement in LEGACY_DDL:
+        connection.execute(statement)
+    if stamp:
+        connection.execute("CREATE TABLE alembic_version (version_num VARCHAR(32))")
+        connection.execute("INSERT INTO alembic_version VALUES ('4ed23ce9b57c')")
+    connection.execute("INSERT INTO cast_group VALUES ('g')")
+    for name in ("Valentine", "Proteus"):
+        connection.execute("INSERT INTO cast_item VALUES (?, 'g', ?, ?)",
+                           (name, name, name))
+        connection.execute("INSERT INTO cast_role VALUES (?, ?, ?, ?, '')",
+                           (f"role-{name}", name, name, name))
+    connection.execute("INSERT INTO act VALUES ('z-act', 'ACT 1')")
+    connection.execute("INSERT INTO scene VALUES ('y-scene', 'z-act', 'Scene 1')")
+    connection.execute("INSERT INTO stage VALUES ('x-stage', 'y-scene', 'Enter')")
+    connection.execute("INSERT INTO cast_stage_association VALUES ('Proteus', 'x-stage')")
+    token = 0
+    for number, (speaker, lines) in enumerate(TEXT):
+        speech_id = f"sp-{9 - number}"
+        connection.execute("INSERT INTO speech VALUES (?, 'y-scene', ?)",
+                           (speech_id, speaker))
+        for line_number, line in enumerate(lines):
+            line_id = f"l-{number}-{9 - line_number}"
+            connection.execute("INSERT INTO line VALUES (?, ?)", (line_id, speech_id))
+            for word in line.split():
+                token += 1
+                connection.execute("INSERT INTO token VALUES (?, ?, ?, ?, '#n1')",
+                                   (f"w-{100 - token}", line_id, word, word.lower()))
+    connection.commit()
+    connection.close()
+
+
+def corpus_rows(database_path, statement: str):
+    connection = sqlite3.connect(database_path)
+    try:
+        corpus_id, name, location = connection.execute(
+            "SELECT id, name, location FROM corpus").fetchone()
+        connection.execute("ATTACH DATABASE ? AS corpus",
+                           (str(database_path.parent / location),))
+        return name, connection.execute(statement).fetchall()
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("stamp", [True, False])
+def test_legacy_play_moves_into_default_corpus(database, database_path, stamp):
+    write_legacy_play(database_path, stamp)
+    connector = DatabaseConnector(database=database)
+    connector.upgrade_schema()
+    assert connector.schema_revision() == SCHEMA_REVISION
+
+    tables = set(sa.inspect(connector.engine).get_table_names())
+    assert not {table for table in tables if table.startswith("legacy_")}
+    corpora = connector.find_corpora()
+    assert [corpus.name for corpus in corpora] == ["default"]
+    assert corpora[0].created_at is not None
+    connector.close()
+
+    name, words = corpus_rows(database_path, "SELECT content FROM corpus.token "
+                                             "ORDER BY position")
+    assert name == "default"
+    assert " ".join(word for word, in words) == \
+        " ".join(line for _, lines in TEXT for line in lines)
+
+
+def test_default_corpus_positions_are_in_document_order(database, database_path):
+    write_legacy_play(database_path, stamp=True)
+    DatabaseConnector(database=database).upgrade_schema()
+    _, positions = corpus_rows(database_path, """
+        SELECT 'act', position FROM corpus.act UNION ALL
+        SELECT 'scene', position FROM corpus.scene UNION ALL
+        SELECT 'stage', position FROM corpus.stage UNION ALL
+        SELECT 'speech', position FROM corpus.speech UNION ALL
+        SELECT 'line', position FROM corpus.line UNION ALL
+        SELECT 'token', position FROM corpus.token ORDER BY 2""")
+    kinds = [kind for kind, _ in positions]
+    assert kinds[:4] == ["act", "scene", "stage", "speech"]
+    assert [position for _, position in positions] == list(range(1, len(positions) + 1))
+    # every speech is followed by its lines and every line by its tokens
+    assert kinds[4:7] == ["line", "token", "token"]
+
+
+def test_default_corpus_has_a_search_index(database, database_path):
+    write_legacy_play(database_path, stamp=True)
+    DatabaseConnector(database=database).upgrade_schema()
+    _, forms = corpus_rows(database_path, "SELECT kind, form, frequency FROM "
+                                          "corpus.token_form WHERE form = 'proteus'")
+    assert sorted(forms) == [("content", "proteus", 1), ("lemma", "proteus", 1)]
+    _, postings = corpus_rows(database_path, "SELECT count(*) FROM "
+                                             "corpus.token_form_association")
+    assert postings == [(2 * sum(len(line.split()) for _, lines in TEXT
+                                 for line in lines),)]
+
+
+def test_default_corpus_exports_like_a_parsed_corpus(database, database_path, tmp_path):
+    write_legacy_play(database_path, stamp=True)
+    writer = TeiXmlWriter(database=database)
+    writer.upgrade_schema()
+    writer.export(str(tmp_path / "export.xml"), writer.find_corpora()[0].id)
+    writer.close()
+    exported = (tmp_path / "export.xml").read_text(encoding="utf-8")
+    assert exported.index("Cease") < exported.index("Home") < exported.index("adieu")
+    assert 'who="#Proteus"' in exported
@@ -0,0 +1,102 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+from alembic import command
+from alembic.script import ScriptDirectory
+
+from ingestion import schema_migrations
+from ingestion.database_connector import DatabaseConnector
+from ingestion.tei_sql_schema import SCHEMA_REVISION
+
+LEGACY_REVISION = "4ed23ce9b57c"
+
+
+def revision_of(path) -> str:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT version_num FROM alembic_version").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_chain_starts_at_the_legacy_revision_and_ends_at_the_schema_revision():
+    script = ScriptDirectory.from_config(schema_migrations.alembic_config())
+    revisions = [revision.revision for revision in script.walk_revisions()]
+    assert revisions[0] == script.get_current_head() == SCHEMA_REVISION
+    assert revisions[-1] == LEGACY_REVISION
+    assert schema_migrations.BASELINE_REVISION in revisions
+
+
+def test_new_database_is_created_at_head(database, database_path):
+    connector = DatabaseConnector(database=database)
+    assert connector.schema_revision() is None
+    assert not connector.database_exists()
+    connector.upgrade_schema()
+    assert revision_of(database_path) == SCHEMA_REVISION
+    assert sa.inspect(connector.engine).has_table("corpus")
+    connector.close()
+
+
+def test_current_database_isnt_migrated_again(connector, monkeypatch):
+    def fail(*args, **kwargs):
+        pytest.fail("up to date databases aren't migrated")
+
+    monkeypatch.setattr(schema_migrations, "upgrade", fail)
+    connector.upgrade_schema()
+
+
+def test_unknown_revision_is_refused(connector, database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("UPDATE alembic_version SET version_num = 'f00dfeedbeef'")
+    connection.commit()
+    connection.close()
+    with pytest.raises(RuntimeError, match="newer release.*alembic stamp"):
+        connector.upgrade_schema()
+    assert revision_of(database_path) == "f00dfeedbeef"
+
+
+def test_unversioned_registry_is_stamped_instead_of_created(connector, database_path):
+    connector.create_corpus("kept")
+    connection = sqlite3.connect(database_path)
+    connection.execute("DROP TABLE alembic_version")
+    connection.commit()
+    connection.close()
+    assert connector.schema_revision() is None
+    assert connector.database_exists()
+
+    connector.upgrade_schema()
+    assert revision_of(database_path) == SCHEMA_REVISION
+    with connector.engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT name FROM corpus").scalars().all() == \
+            ["kept"]
+
+
+def test_downgrade_restores_the_legacy_tables(database, database_path):
+    connection = sqlite3.connect(database_path)
+    connection.execute("CREATE TABLE act (id VARCHAR(36) PRIMARY KEY, content TEXT)")
+    connection.execute("INSERT INTO act VALUES ('a', 'ACT 1')")
+    connection.execute("CREATE TABLE alembic_version (version_num VARCHAR(32))")
+    connection.execute(f"INSERT INTO alembic_version VALUES ('{LEGACY_REVISION}')")
+    connection.commit()
+    connection.close()
+
+    engine = DatabaseConnector(database=database).engine
+    with engine.begin() as connection:
+        config = schema_migrations.alembic_config(connection)
+        command.upgrade(config, schema_migrations.BASELINE_REVISION)
+        tables = set(sa.inspect(connection).get_table_names())
+        assert {"corpus", "legacy_act"} <= tables and "act" not in tables
+        command.downgrade(config, LEGACY_REVISION)
+    assert revision_of(database_path) == LEGACY_REVISION
+    connection = sqlite3.connect(database_path)
+    assert connection.execute("SELECT * FROM act").fetchall() == [("a", "ACT 1")]
+    connection.close()
+
+
+def test_offline_sql_of_a_new_database(capsys):
+    command.upgrade(schema_migrations.alembic_config(), f"{LEGACY_REVISION}:head",
+                    sql=True)
+    sql = capsys.readouterr().out
+    assert "CREATE TABLE corpus" in sql
+    assert f"UPDATE alembic_version SET version_num='{SCHEMA_REVISION}'" in sql
@@ -0,0 +1,141 @@
+import gzip
+
+import pytest
+import sqlalchemy as sa
+from lxml import etree
+
+from ingestion import tei_sql_schema as schema
+from ingestion import tei_xml_parser
+from ingestion.act_regions import scan_acts
+from ingestion.tei_xml_parser import TeiXmlParser
+from ingestion.tei_xml_writer import TeiXmlWriter
+from conftest import tei_document
+
+ACTS = 4
+
+
+@pytest.fixture
+def large_corpus(tmp_path):
+    path = tmp_path / "large.xml"
+    path.write_text(tei_document(acts=ACTS, scenes=3, speeches=5, seed=7),
+                    encoding="utf-8")
+    return path
+
+
+###
+# act regions
+def test_scan_finds_the_acts(large_corpus):
+    act_regions = scan_acts(str(large_corpus))
+    assert len(act_regions.regions) == ACTS
+    assert b"<w " not in act_regions.skeleton
+    assert act_regions.skeleton_tree().find(".//{*}castList") is not None
+    for index in range(ACTS):
+        acts = etree.fromstring(act_regions.region_document(index))
+        act, = acts
+        assert act.get("type") == "act" and act.get("n") == str(index + 1)
+        assert etree.QName(act).namespace == "http://www.tei-c.org/ns/1.0"
+
+
+def test_scan_skips_markup_in_comments_and_cdata(tmp_path):
+    document = tei_document(acts=2).replace(
+        "<body>", '<body><!-- <div type="act"> --><note><![CDATA[</div>]]></note>')
+    path = tmp_path / "commented.xml"
+    path.write_text(document, encoding="utf-8")
+    assert len(scan_acts(str(path)).regions) == 2
+
+
+@pytest.mark.parametrize("change", [
+    lambda document: document.replace("</div></body>", "</body>"),
+    lambda document: document.replace('<div type="act" n="2">', '<div type="scene">', 1)
+    .replace('<div type="act" n="3">', '<div type="scene">', 1)
+    .replace('<div type="act" n="4">', '<div type="scene">', 1),
+    lambda document: '<!DOCTYPE TEI [<!ENTITY who "Proteus">]>' + document,
+])
+def test_files_which_cant_be_split(tmp_path, change):
+    path = tmp_path / "corpus.xml"
+    path.write_text(change(tei_document(acts=ACTS)), encoding="utf-8")
+    assert scan_acts(str(path)) is None
+
+
+def test_compressed_files_arent_split(tmp_path):
+    path = tmp_path / "corpus.xml.gz"
+    path.write_bytes(gzip.compress(tei_document(acts=ACTS).encode("utf-8")))
+    assert scan_acts(str(path)) is None
+
+
+###
+# parsing
+def parse(database, source, workers):
+    parser = TeiXmlParser(None, None, None, None, database, workers=workers)
+    parser.upgrade_schema()
+    return parser, parser.parse(source, corpus_name=f"workers-{workers}")
+
+
+def hierarchy(connector, corpus_id):
+    """
+    Get the positions of the scenes, speeches and stages with the positions of
+        their parents, the uuids of acts and scenes differ in every parse.
+    """
+    def positions(model):
+        return dict(tuple(row) for row in connector.stream(
+            sa.select(model.id, model.position).order_by(model.id), 1000,
+            model.__table__,
+            corpus_id=corpus_id))
+
+    acts, scenes = positions(schema.Act), positions(schema.Scene)
+    children = {}
+    for model, parent, parent_positions in ((schema.Scene, "act_id", acts),
+                                            (schema.Speech, "scene_id", scenes),
+                                            (schema.Stage, "scene_id", scenes)):
+        children[model.__tablename__] = sorted(
+            (position, parent_positions[parent_id]) for position, parent_id in
+            connector.stream(sa.select(model.position, getattr(model, parent))
+                             .order_by(model.position), 1000, model.__table__,
+                             corpus_id=corpus_id))
+    return children
+
+
+def export(database, corpus_id, path):
+    writer = TeiXmlWriter(database=database)
+    writer.export(str(path), corpus_id)
+    writer.close()
+    return path.read_bytes()
+
+
+def test_parallel_parse_matches_serial_parse(database, large_corpus, corpus_rows,
+                                             tmp_path, monkeypatch):
+    monkeypatch.setattr(tei_xml_parser, "PARALLEL_MIN_SIZE", 0)
+    serial, serial_id = parse(database, large_corpus, workers=1)
+
+    parse_acts = TeiXmlParser.parse_acts
+    split = []
+
+    def spy(self, act_regions):
+        split.append(len(act_regions.regions))
+        parse_acts(self, act_regions)
+
+    monkeypatch.setattr(TeiXmlParser, "parse_acts", spy)
+    parallel, parallel_id = parse(database, large_corpus, workers=2)
+    assert split == [ACTS]
+
+    assert corpus_rows(parallel, parallel_id, generated_ids=False) == \
+        corpus_rows(serial, serial_id, generated_ids=False)
+    assert hierarchy(parallel, parallel_id) == hierarchy(serial, serial_id)
+    assert export(database, parallel_id, tmp_path / "parallel.xml") == \
+        export(database, serial_id, tmp_path / "serial.xml")
+    serial.close()
+    parallel.close()
+
+
+@pytest.mark.parametrize("min_size, source", [
+    (10 ** 9, lambda path: path),
+    (0, lambda path: path.read_text(encoding="utf-8")),
+    (0, lambda path: path.read_bytes()),
+])
+def test_small_files_and_other_sources_are_parsed_serially(
+        database, large_corpus, monkeypatch, min_size, source):
+    monkeypatch.setattr(tei_xml_parser, "PARALLEL_MIN_SIZE", min_size)
+    monkeypatch.setattr(TeiXmlParser, "parse_acts", pytest.fail)
+    parser, corpus_id = parse(database, source(large_corpus), workers=2)
+    assert [corpus.id for corpus in parser.find_corpora()] == [corpus_id]
+    parser.close()
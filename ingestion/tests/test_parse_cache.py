@@ -0,0 +1,112 @@
+import gzip
+import os
+import zlib
+
+import pytest
+
+from ingestion import tei_xml_parser
+from ingestion.corpus_source import content_hash
+from ingestion.parse_cache import ParseCacheError, decode_column, encode_column
+from ingestion.tei_xml_parser import TeiXmlParser
+
+
+###
+# codec
+@pytest.mark.parametrize("kind, values", [
+    ("int", [1, None, -5, 0, 2 ** 62, None]),
+    ("int", []),
+    ("str", ["loue", None, "", "ſweet ❦ lady", "x" * 70000, None]),
+    ("str", [None, None]),
+])
+def test_codec_round_trip(kind, values):
+    assert decode_column(kind, len(values), encode_column(kind, values)) == values
+
+
+@pytest.mark.parametrize("kind, rows, block", [
+    ("int", 2, b"not a zlib block"),
+    ("int", 2, encode_column("int", [1, 2])[:-3]),
+    ("int", 3, encode_column("int", [1, 2])),
+    ("str", 3, encode_column("str", ["a", "b"])),
+    ("str", 1, zlib.compress(b"\x00" + (4).to_bytes(4, "little") + b"\xff\xfe\xfd\xfc")),
+    ("str", 1, zlib.compress(b"\x00" + (9).to_bytes(4, "little") + b"abc")),
+])
+def test_damaged_blocks_raise(kind, rows, block):
+    with pytest.raises(ParseCacheError):
+        decode_column(kind, rows, block)
+
+
+###
+# parser
+@pytest.fixture
+def parser(database, tmp_path):
+    parser = TeiXmlParser(None, None, None, None, database,
+                          cache_dir=str(tmp_path / "cache"))
+    parser.upgrade_schema()
+    yield parser
+    parser.close()
+
+
+def damage(path: str, offset: int):
+    with open(path, "r+b") as file_pointer:
+        file_pointer.seek(offset)
+        byte = file_pointer.read(1)
+        file_pointer.seek(offset)
+        file_pointer.write(bytes([byte[0] ^ 0xff]))
+
+
+def test_cached_corpus_is_replayed(parser, corpus_file, corpus_rows, monkeypatch):
+    parsed = parser.parse(corpus_file, corpus_name="parsed")
+    source_hash = content_hash(corpus_file)
+    assert source_hash in parser.cache
+    assert parser.cache.footer(source_hash)["content_hash"] == source_hash
+
+    monkeypatch.setattr(tei_xml_parser, "read_tree", pytest.fail)
+    replayed = parser.parse(corpus_file, corpus_name="replayed")
+    assert replayed != parsed
+    assert corpus_rows(parser, replayed) == corpus_rows(parser, parsed)
+
+
+def test_cache_is_shared_by_compressed_sources(parser, corpus_file, monkeypatch):
+    parser.parse(corpus_file, corpus_name="parsed")
+    monkeypatch.setattr(tei_xml_parser, "read_tree", pytest.fail)
+    parser.parse(gzip.compress(corpus_file.read_bytes()), corpus_name="replayed")
+    assert len(parser.find_corpora()) == 2
+
+
+@pytest.mark.parametrize("where", ["block", "footer", "truncated", "magic", "empty"])
+def test_damaged_cache_falls_back_to_parsing(parser, corpus_file, corpus_rows, where):
+    parsed = parser.parse(corpus_file, corpus_name="parsed")
+    source_hash = content_hash(corpus_file)
+    path = parser.cache.path(source_hash)
+    size = os.path.getsize(path)
+    if where == "block":
+        # the rows of the last tables are decoded long after the first are read
+        damage(path, size * 3 // 4)
+    elif where == "footer":
+        damage(path, size - 20)
+    elif where == "truncated":
+        os.truncate(path, size // 2)
+    else:
+        # cut off while the file was written, before its first block
+        os.truncate(path, 4 if where == "magic" else 0)
+    with pytest.raises(ParseCacheError):
+        parser.cache.validate(source_hash)
+
+    fallback = parser.parse(corpus_file, corpus_name="fallback")
+    assert [corpus.name for corpus in parser.find_corpora()] == ["parsed", "fallback"]
+    assert corpus_rows(parser, fallback, generated_ids=False) == \
+        corpus_rows(parser, parsed, generated_ids=False)
+    # the damaged file was written again
+    parser.cache.validate(source_hash)
+
+
+def test_damaged_cache_loads_nothing(parser, corpus_file):
+    parser.parse(corpus_file, corpus_name="parsed")
+    source_hash = content_hash(corpus_file)
+    path = parser.cache.path(source_hash)
+    damage(path, os.path.getsize(path) * 3 // 4)
+    with pytest.raises(ParseCacheError):
+        parser.cache.replay(source_hash, parser, corpus_name="replayed")
+    with parser.engine.connect() as connection:
+        names = [name for name, in connection.exec_driver_sql("SELECT name FROM corpus")]
+    assert names == ["parsed"]
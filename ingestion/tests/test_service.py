@@ -0,0 +1,83 @@
+import gzip
+import importlib.util
+import os
+
+import flask
+import pytest
+
+from ingestion import corpus_source
+from ingestion.database_connector import DatabaseConnector
+from conftest import INGESTION_DIR, tei_document
+
+
+@pytest.fixture
+def service(database, monkeypatch):
+    """
+    The service module of ingestion/app.py on the sqlite database of the test, loaded
+        from its file, the app package of the repository root shadows it.
+    """
+    connector = DatabaseConnector(database=database)
+    connector.upgrade_schema()
+    connector.close()
+    spec = importlib.util.spec_from_file_location(
+        "ingestion_service", os.path.join(INGESTION_DIR, "app.py"))
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+    for name in ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD", "PARSE_CACHE"):
+        monkeypatch.setattr(service, name, None)
+    monkeypatch.setattr(service, "DB_NAME", database)
+    return service
+
+
+@pytest.fixture
+def client(service, tmp_path, monkeypatch):
+    """
+    Client of the stream endpoint, registered like create_app does without connexion.
+    """
+    monkeypatch.setattr(service, "UPLOAD_DIR", str(tmp_path))
+    app = flask.Flask(__name__)
+    app.add_url_rule("/ingest/stream", view_func=service.ingest_stream, methods=["POST"])
+    return app.test_client()
+
+
+def test_stream_ingests_compressed_corpora(client, database, tmp_path):
+    response = client.post("/ingest/stream?corpus_name=stream",
+                           data=gzip.compress(tei_document().encode("utf-8")))
+    assert response.status_code == 200
+    connector = DatabaseConnector(database=database)
+    corpus, = connector.find_corpora("stream")
+    assert corpus.id == response.json["corpus_id"]
+    connector.close()
+    # the upload is removed once it is parsed
+    assert not list(tmp_path.glob("*.upload"))
+
+
+@pytest.mark.parametrize("body, detail", [
+    (b"", "empty request body"),
+    (tei_document().encode("utf-8")[:5000], "isn't well-formed xml"),
+    (gzip.compress(tei_document().encode("utf-8"))[:2000], "isn't valid gzip data"),
+    (b"\x28\xb5\x2f\xfd" + b"\x00" * 100, "zstandard"),
+], ids=["empty", "malformed", "truncated-gzip", "zstd"])
+def test_stream_rejects_unreadable_corpora(client, monkeypatch, body, detail):
+    monkeypatch.setattr(corpus_source, "zstandard", None)
+    response = client.post("/ingest/stream", data=body)
+    assert response.status_code == 400
+    assert detail in response.json["detail"]
+
+
+@pytest.mark.parametrize("body, detail", [
+    ({}, "no corpus in request"),
+    ({"xml_string": 42}, "has to be a string"),
+    ({"xml_string": "<TEI><text>"}, "isn't well-formed xml"),
+])
+def test_ingest_rejects_unreadable_corpora(service, body, detail):
+    response, status = service.ingest(body)
+    assert status == 400 and detail in response["detail"]
+
+
+def test_ingest_parses_the_xml_string(service, database):
+    response = service.ingest({"xml_string": tei_document()}, corpus_name="form")
+    connector = DatabaseConnector(database=database)
+    assert [corpus.id for corpus in connector.find_corpora("form")] == \
+        [response["corpus_id"]]
+    connector.close()
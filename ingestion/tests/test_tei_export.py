@@ -0,0 +1,97 @@
+import io
+
+import pytest
+import sqlalchemy as sa
+from lxml import etree
+
+from ingestion import tei_sql_schema as schema
+from ingestion.tei_xml_parser import TeiXmlParser
+from ingestion.tei_xml_writer import TeiXmlWriter, XML_ID
+
+TEI = {"tei": "http://www.tei-c.org/ns/1.0"}
+
+
+@pytest.fixture
+def parser(database):
+    parser = TeiXmlParser(None, None, None, None, database)
+    parser.upgrade_schema()
+    yield parser
+    parser.close()
+
+
+@pytest.fixture
+def writer(parser, database):
+    # connectors of the same database share its engine
+    writer = TeiXmlWriter(database=database)
+    yield writer
+    writer.close()
+
+
+@pytest.fixture
+def corpus_id(parser, corpus_file):
+    return parser.parse(corpus_file, corpus_name="source")
+
+
+def export(writer, corpus_id, **subset) -> bytes:
+    target = io.BytesIO()
+    writer.export(target, corpus_id, **subset)
+    return target.getvalue()
+
+
+def column(connector, model, name: str, corpus_id: str) -> list:
+    """
+    Read a column of a table of the corpus in document order.
+    """
+    columns = model.__table__.c
+    order = columns.position if "position" in columns else columns.id
+    return [value for value, in connector.stream(
+        sa.select(columns[name]).order_by(order), 1000, model.__table__,
+        corpus_id=corpus_id)]
+
+
+def test_export_is_valid_tei(parser, writer, corpus_id):
+    root = etree.fromstring(export(writer, corpus_id, title="Verona"))
+    assert root.tag == "{http://www.tei-c.org/ns/1.0}TEI"
+    assert root.xpath("string(//tei:title)", namespaces=TEI) == "Verona"
+    assert len(root.xpath("//tei:castItem", namespaces=TEI)) == 5
+    assert len(root.xpath("//tei:div[@type='act']", namespaces=TEI)) == 3
+    # tokens are separated like in the source
+    line = root.xpath("//tei:l", namespaces=TEI)[0]
+    assert len("".join(line.itertext()).split()) == 6
+
+
+def test_reparsed_export_stores_the_same_rows(parser, writer, corpus_id, corpus_rows,
+                                              tmp_path):
+    path = tmp_path / "export.xml"
+    path.write_bytes(export(writer, corpus_id))
+    reparsed = parser.parse(path, corpus_name="reparsed")
+    assert corpus_rows(parser, reparsed, generated_ids=False) == \
+        corpus_rows(parser, corpus_id, generated_ids=False)
+    # and exports the same document again
+    assert export(writer, reparsed) == export(writer, corpus_id)
+
+
+def test_export_of_one_act(parser, writer, corpus_id):
+    act_id = column(parser, schema.Act, "id", corpus_id)[-1]
+    root = etree.fromstring(export(writer, corpus_id, act_id=act_id))
+    acts = root.xpath("//tei:div[@type='act']", namespaces=TEI)
+    assert [act.xpath("string(tei:head)", namespaces=TEI) for act in acts] == ["ACT 3"]
+    assert len(acts[0].xpath(".//tei:sp", namespaces=TEI)) == 2 * 4
+    # the cast list stays complete
+    assert len(root.xpath("//tei:castItem", namespaces=TEI)) == 5
+
+
+def test_export_of_one_speaker(parser, writer, corpus_id):
+    speakers = column(parser, schema.Speech, "cast_item_id", corpus_id)
+    cast_item_id = max(set(speakers), key=speakers.count)
+    root = etree.fromstring(export(writer, corpus_id, cast_item_id=cast_item_id))
+    speeches = root.xpath("//tei:sp", namespaces=TEI)
+    assert len(speeches) == speakers.count(cast_item_id)
+    assert {speech.get("who") for speech in speeches} == {f"#{cast_item_id}"}
+    assert [item.get(XML_ID) for item in root.xpath("//tei:castItem",
+                                                    namespaces=TEI)] == [cast_item_id]
+
+
+def test_export_of_an_unknown_act_is_empty(parser, writer, corpus_id):
+    root = etree.fromstring(export(writer, corpus_id, act_id="no such act"))
+    assert root.xpath("//tei:div", namespaces=TEI) == []
@@ -1,43 +0,0 @@
-"""empty message
-
-Revision ID: 4ed23ce9b57c
-Revises: 
-Create Date: 2022-02-19 19:26:14.560975
-
-"""
-from alembic import op
-import sqlalchemy as sa
-
-
-# revision identifiers, used by Alembic.
-revision = '4ed23ce9b57c'
-down_revision = None
-branch_labels = None
-depends_on = None
-
-
-def upgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.create_table('question',
-    sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('subject', sa.String(length=200), nullable=False),
-    sa.Column('content', sa.Text(), nullable=False),
-    sa.Column('create_date', sa.DateTime(), nullable=False),
-    sa.PrimaryKeyConstraint('id')
-    )
-    op.create_table('answer',
-    sa.Column('id', sa.Integer(), nullable=False),
-    sa.Column('question_id', sa.Integer(), nullable=True),
-    sa.Column('content', sa.Text(), nullable=False),
-    sa.Column('create_date', sa.DateTime(), nullable=False),
-    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ondelete='CASCADE'),
-    sa.PrimaryKeyConstraint('id')
-    )
-    # ### end Alembic commands ###
-
-
-def downgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_table('answer')
-    op.drop_table('question')
-    # ### end Alembic commands ###
@@ -0,0 +1,109 @@
+"""
+Fixtures of the webapp tests, run with `python -m pytest` from the repository root.
+
+    The tests read a copy of verona.db migrated by the ingestion migrations, the
+    database of the repository is never changed.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+import config
+from app import create_app
+from app.corpus import resolve_corpus, scope_session
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INGESTION_DIR = os.path.join(REPO_DIR, "ingestion")
+# behind the repository root, whose app package shadows ingestion/app.py
+if INGESTION_DIR not in sys.path:
+    sys.path.append(INGESTION_DIR)
+
+from ingestion import schema_migrations  # noqa: E402
+
+
+def migrate_database(directory) -> str:
+    """
+    Copy verona.db into a directory and migrate it, its play is moved into the corpus
+        'default' in a corpus file next to it.
+
+    Returns:
+        path of the migrated database
+    """
+    path = shutil.copy(os.path.join(REPO_DIR, "verona.db"), directory)
+    engine = sa.create_engine(f"sqlite:///{path}")
+    with engine.connect() as connection:
+        revision = connection.exec_driver_sql(
+            "SELECT version_num FROM alembic_version").scalar()
+    schema_migrations.upgrade(engine, revision)
+    engine.dispose()
+    return path
+
+
+def copy_database(path: str, directory) -> str:
+    """
+    Copy a database and its corpus files into a directory.
+
+    Returns:
+        path of the copied database
+    """
+    shutil.copy(path, directory)
+    corpora = f"{os.path.splitext(path)[0]}_corpora"
+    shutil.copytree(corpora, os.path.join(directory, os.path.basename(corpora)))
+    return os.path.join(directory, os.path.basename(path))
+
+
+@pytest.fixture(scope="session")
+def database(tmp_path_factory) -> str:
+    """
+    Path of the migrated verona.db shared by the tests which only read it.
+    """
+    return migrate_database(tmp_path_factory.mktemp("verona"))
+
+
+@pytest.fixture
+def writable_database(database, tmp_path) -> str:
+    """
+    Path of a copy of the migrated verona.db of its own, for tests changing the
+        database.
+    """
+    return copy_database(database, tmp_path)
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    """
+    Create apps on a database with config values overridden, e.g.
+        make_app(path, QUERY_COST_LIMIT=1).
+    """
+    def make(path: str, **settings):
+        monkeypatch.setattr(config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{path}")
+        monkeypatch.setattr(config, "IN_MEMORY", False)
+        for name, value in settings.items():
+            monkeypatch.setattr(config, name, value, raising=False)
+        return create_app()
+    return make
+
+
+@pytest.fixture
+def app(database, make_app):
+    return make_app(database)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def session(app):
+    """
+    Request session scoped to the default corpus.
+    """
+    from app import db
+
+    with app.test_request_context():
+        scope_session(resolve_corpus(None))
+        yield db.session
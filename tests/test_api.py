@@ -0,0 +1,103 @@
+import re
+from contextlib import contextmanager
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+
+
+@contextmanager
+def corpus_selects(app):
+    """
+    Collect the selects of corpus tables sent while the block runs.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and "FROM corpus " not in statement:
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    sa.event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", record)
+
+
+def select_of(statements, table: str) -> str:
+    """
+    Get the select loading the rows of a table, sibling levels load in any order.
+    """
+    statement, = [statement for statement in statements
+                  if re.match(rf"SELECT \w+\.{table}\.", statement.lstrip())]
+    return statement
+
+
+@pytest.fixture
+def scenes(client):
+    return client.get("/api/scene?depth=scene").json
+
+
+def test_documents_take_one_query_per_level(app, client, scenes):
+    with corpus_selects(app) as statements:
+        acts = client.get("/api/act").json
+    # act, scene, speech, speaker, line and token
+    assert len(statements) == 6
+    assert len(acts) == 6
+    speeches = [speech for act in acts for scene in act["scenes"]
+                for speech in scene["speeches"]]
+    assert len(speeches) == 858
+    assert sum(len(line["tokens"]) for speech in speeches for line in speech["lines"]) \
+        == 12670
+
+    with corpus_selects(app) as statements:
+        scene = client.get(f"/api/scene/{scenes[0]['id']}").json
+    assert len(statements) == 5
+    assert [document["id"] for document in scene] == [scenes[0]["id"]]
+
+
+def test_depth_stops_the_loads(app, client):
+    with corpus_selects(app) as statements:
+        acts = client.get("/api/act?depth=scene").json
+    assert len(statements) == 2
+    assert all("speeches" not in scene for act in acts for scene in act["scenes"])
+
+
+def test_children_are_in_document_order(client, scenes):
+    scene = client.get(f"/api/scene/{scenes[1]['id']}?depth=line").json[0]
+    positions = [speech["position"] for speech in scene["speeches"]]
+    assert positions == sorted(positions)
+    assert scene["position"] < positions[0]
+
+
+def test_fields_project_the_loaded_columns(app, client, scenes):
+    url = f"/api/scene/{scenes[0]['id']}?fields[scene]=content" \
+          f"&fields[speech]=position&fields[line]=&fields[token]=content,lemma" \
+          f"&fields[speaker]=name"
+    with corpus_selects(app) as statements:
+        scene = client.get(url).json[0]
+    assert set(scene) == {"content", "speeches"}
+    speech = scene["speeches"][0]
+    assert set(speech) == {"position", "speaker", "lines"}
+    assert set(speech["speaker"]) == {"name"}
+    assert set(speech["lines"][0]) == {"tokens"}
+    assert set(speech["lines"][0]["tokens"][0]) == {"content", "lemma"}
+    # unrequested columns aren't selected either
+    token_select = select_of(statements, "token")
+    assert ".token.content" in token_select and ".token.ana" not in token_select
+    speech_select = select_of(statements, "speech")
+    assert ".speech.position" in speech_select and ".speech.cast_item_id" in speech_select
+
+
+@pytest.mark.parametrize("url, status", [
+    ("/api/act?fields[token]=colour", 400),
+    ("/api/act?fields[chapter]=id", 400),
+    ("/api/act?depth=page", 400),
+    ("/api/scene/no-such-scene", 404),
+    ("/api/token", 404),
+])
+def test_invalid_requests(client, url, status):
+    assert client.get(url).status_code == status
@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from app.models import SCHEMA_REVISION
+
+
+def execute(path: str, *statements: str):
+    connection = sqlite3.connect(path)
+    for statement in statements:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+
+
+def test_migrated_database_boots(writable_database, make_app):
+    app = make_app(writable_database)
+    response = app.test_client().get("/api/act")
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("revision, message", [
+    ("3f6c2d1a9b80", "Migrate an older database"),
+    ("f00dfeedbeef", "newer release"),
+])
+def test_other_revisions_are_refused(writable_database, make_app, revision, message):
+    execute(writable_database, f"UPDATE alembic_version SET version_num = '{revision}'")
+    with pytest.raises(RuntimeError, match=message) as error:
+        make_app(writable_database)
+    assert SCHEMA_REVISION in str(error.value)
+
+
+def test_legacy_database_is_refused(writable_database, make_app):
+    execute(writable_database, "DROP TABLE alembic_version", "DROP TABLE corpus")
+    with pytest.raises(RuntimeError, match="predates the corpus registry"):
+        make_app(writable_database)
+
+
+def test_unversioned_registry_boots_with_a_warning(writable_database, make_app, caplog):
+    execute(writable_database, "DROP TABLE alembic_version")
+    app = make_app(writable_database)
+    assert "isn't versioned" in caplog.text
+    assert app.test_client().get("/api/act").status_code == 200
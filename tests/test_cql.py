@@ -0,0 +1,192 @@
+import json
+from itertools import islice
+
+import pytest
+
+from app.cql import CqlQuery, CqlSyntaxError, parse_cursor, search
+
+
+def stream(text: str):
+    """
+    Build stream tokens from space separated word/lemma/ana triples.
+    """
+    return [(f"w{position}", *triple.split("/"), "l1", position)
+            for position, triple in enumerate(text.split(), 1)]
+
+
+TOKENS = stream("my/my/#po sweet/sweet/#j gentle/gentle/#j lady/lady/#n1 "
+                "and/and/#cc my/my/#po love/love/#n1 lady/lady/#n1")
+
+
+def matches(query: str, tokens=TOKENS):
+    """
+    Get the words of the longest matches found left to right.
+    """
+    automaton = CqlQuery(query).automaton
+    found, start = [], 0
+    while start < len(tokens):
+        end = automaton.match(tokens, start)
+        if end is None:
+            start += 1
+            continue
+        found.append(" ".join(token[1] for token in tokens[start:end]))
+        start = end
+    return found
+
+
+###
+# automaton
+@pytest.mark.parametrize("query, expected", [
+    ('[lemma="lady"]', ["lady", "lady"]),
+    ('"l.*"', ["lady", "love", "lady"]),
+    ('"lad"', []),
+    ('[ana="#j"]+', ["sweet gentle"]),
+    ('[lemma="my"] [ana="#j"]* [lemma="lady"]', ["my sweet gentle lady"]),
+    ('[lemma="my"] [ana="#j"]? [ana="#n1"]', ["my love"]),
+    ('[lemma="my"] [ana="#j"]{2} [lemma="lady"]', ["my sweet gentle lady"]),
+    ('[lemma="my"] [ana="#j"]{0,1} [lemma="lady"]', []),
+    ('[lemma="my"] []{1,2} [lemma="lady"]', ["my sweet gentle lady", "my love lady"]),
+    ('[ana="#n.*"] [lemma="and"]', ["lady and"]),
+])
+def test_patterns(query, expected):
+    assert matches(query) == expected
+
+
+@pytest.mark.parametrize("query, expected", [
+    ('[lemma="my" & word!="my"]', []),
+    ('[lemma="love" | lemma="lady"]', ["lady", "love", "lady"]),
+    ('[ana="#j" & !word="sweet"]', ["gentle"]),
+    ('[!(ana="#j" | ana="#n1" | ana="#po")]', ["and"]),
+    ('[lemma!="my"]{3}', ["sweet gentle lady"]),
+])
+def test_boolean_tests(query, expected):
+    assert matches(query) == expected
+
+
+def test_matches_are_longest_and_dont_overlap():
+    tokens = stream("a/a/#x a/a/#x a/a/#x b/b/#y")
+    assert matches('[word="a"]+', tokens) == ["a a a"]
+    assert matches('[word="a"]{1,2}', tokens) == ["a a", "a"]
+    assert matches('[word="a"]* [word="b"]', tokens) == ["a a a b"]
+
+
+def test_missing_attributes_match_as_empty():
+    tokens = [("w1", "word", None, None, "l1", 1)]
+    assert matches('[lemma=""]', tokens) == ["word"]
+    assert matches('[lemma!="x"]', tokens) == ["word"]
+
+
+###
+# parsing
+@pytest.mark.parametrize("query", [
+    "",
+    '[lemma="love"',
+    '[lemma="love"]]',
+    '[foo="love"]',
+    '[lemma<"love"]',
+    '[lemma="love"]{3,1}',
+    '[lemma="love"]{51}',
+    '[lemma="("]',
+    '[lemma="love"]?',
+    "lemma",
+    "[lemma='love']",
+])
+def test_syntax_errors(query):
+    with pytest.raises(CqlSyntaxError):
+        CqlQuery(query)
+
+
+def test_anchors_are_mandatory_literals():
+    query = CqlQuery('"Lady" [lemma="love" & ana="#n1"] [lemma="my"]? [word="l.*"] '
+                     '[lemma!="and"] [lemma="a" | lemma="b"]')
+    assert query.anchors == [("content", "lady"), ("lemma", "love")]
+
+
+def test_escaped_quotes():
+    tokens = [("w1", 'say "no"', "say", "#v", "l1", 1)]
+    assert matches(r'"say \"no\""', tokens) == ['say "no"']
+
+
+def test_parse_cursor():
+    assert parse_cursor(None) == (None, None)
+    assert parse_cursor("12:345") == (12, 345)
+    with pytest.raises(CqlSyntaxError):
+        parse_cursor("12")
+    with pytest.raises(CqlSyntaxError):
+        parse_cursor("a:b")
+
+
+###
+# search
+def get_page(client, query: str, limit: int = None, cursor: str = None):
+    params = {"q": query}
+    if limit is not None:
+        params["limit"] = limit
+    if cursor is not None:
+        params["cursor"] = cursor
+    response = client.get("/cql/", query_string=params)
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    return lines[:-1], lines[-1]["next"]
+
+
+def keys(found):
+    return [(match["speech_position"], match["tokens"][0]["position"]) for match in found]
+
+
+def test_search_is_in_document_order(client):
+    found, cursor = get_page(client, '[lemma="love"]', limit=500)
+    assert found and cursor is None
+    assert keys(found) == sorted(keys(found))
+    assert len(set(keys(found))) == len(found)
+    first = found[0]
+    assert first["tokens"][0]["lemma"] == "love"
+    assert any(first["tokens"][0]["word"] in line["text"].split()
+               for line in first["lines"])
+
+
+def test_anchored_and_streamed_search_agree(session):
+    anchored = list(search(CqlQuery('[lemma="love"] [ana="#n.*"]'), session=session))
+    streamed = list(search(CqlQuery('[lemma="lov(e)"] [ana="#n.*"]'), session=session))
+    assert anchored
+    assert [match.cursor for match in anchored] == [match.cursor for match in streamed]
+
+
+def test_paging_follows_the_cursor(client):
+    query = '[lemma="my"] [ana="#j"]? [ana="#n1"]'
+    everything, _ = get_page(client, query, limit=500)
+    assert len(everything) > 10
+
+    paged, cursor = [], None
+    while True:
+        found, cursor = get_page(client, query, limit=7, cursor=cursor)
+        assert len(found) <= 7
+        paged.extend(found)
+        if cursor is None:
+            break
+    assert keys(paged) == keys(everything)
+
+
+def test_cursor_resumes_within_a_speech(session):
+    query = CqlQuery('[]')
+    first = list(islice(search(query, session=session), 5))
+    assert first[2].speech_id == first[3].speech_id
+    resumed = next(search(query, cursor=first[2].cursor, session=session))
+    assert resumed.cursor == first[3].cursor
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_limit_is_at_least_one(client, limit):
+    found, cursor = get_page(client, '[lemma="love"]', limit=limit)
+    assert len(found) == 1
+    assert cursor is not None
+
+
+@pytest.mark.parametrize("params", [
+    {"q": '[lemma="love"'},
+    {"q": '[lemma="love"]', "cursor": "nowhere"},
+])
+def test_invalid_requests(client, params):
+    response = client.get("/cql/", query_string=params)
+    assert response.status_code == 400
+    assert "error" in response.json
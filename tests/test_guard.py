@@ -0,0 +1,144 @@
+import sqlite3
+
+import pytest
+
+from app import guard
+from app.guard import estimate_cost, with_statement_timeout
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    # table sizes are cached per process by schema and table name
+    monkeypatch.setattr(guard, "_table_rows", {})
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE line (id TEXT PRIMARY KEY, speech_id TEXT)")
+    connection.execute("CREATE TABLE token (id TEXT PRIMARY KEY, line_id TEXT, "
+                       "content TEXT)")
+    connection.execute("CREATE INDEX ix_token_line_id ON token (line_id)")
+    connection.executemany("INSERT INTO line VALUES (?, ?)",
+                           ((f"l{i}", f"sp{i // 10}") for i in range(200)))
+    connection.executemany("INSERT INTO token VALUES (?, ?, ?)",
+                           ((f"w{i}", f"l{i // 8}", "love") for i in range(1600)))
+    yield connection
+    connection.close()
+
+
+###
+# estimate
+def test_full_scan(connection):
+    assert estimate_cost(connection, "sqlite", "SELECT * FROM token WHERE content "
+                                               "LIKE ?", ("%lo%",)) == (1600, False)
+
+
+def test_scan_with_limit_stops_early(connection):
+    cost, stops_early = estimate_cost(connection, "sqlite",
+                                      "SELECT * FROM token LIMIT 10", ())
+    assert cost == 1600 and stops_early
+
+
+@pytest.mark.parametrize("statement, parameters", [
+    ("SELECT * FROM token WHERE content LIKE ? LIMIT 10", ("%lo%",)),
+    ("SELECT * FROM token WHERE lower(token.content) LIKE lower(?) LIMIT 10", ("lo%",)),
+    # the scanned line is filtered by the LIKE on the token joined to it
+    ("SELECT * FROM line JOIN token ON token.line_id = line.id "
+     "WHERE token.content LIKE ? LIMIT 10", ("%lo%",)),
+])
+def test_like_scan_with_limit_doesnt_stop_early(connection, statement, parameters):
+    cost, stops_early = estimate_cost(connection, "sqlite", statement, parameters)
+    assert cost >= 200 and not stops_early
+
+
+def test_like_on_rows_found_by_key_stops_early(connection):
+    cost, stops_early = estimate_cost(
+        connection, "sqlite", "SELECT * FROM token WHERE line_id = ? AND content "
+                              "LIKE ? LIMIT 10", ("l1", "%lo%"))
+    assert cost == guard.DEFAULT_ROWS_PER_KEY and stops_early
+
+
+def test_sorted_scan_doesnt_stop_early(connection):
+    cost, stops_early = estimate_cost(
+        connection, "sqlite", "SELECT * FROM token ORDER BY content LIMIT 10", ())
+    assert cost == 1600 and not stops_early
+
+
+def test_lookups_by_key(connection):
+    assert estimate_cost(connection, "sqlite", "SELECT * FROM token WHERE id = ?",
+                         ("w1",))[0] == 1
+    assert estimate_cost(connection, "sqlite", "SELECT * FROM token WHERE line_id = ?",
+                         ("l1",))[0] == guard.DEFAULT_ROWS_PER_KEY
+
+
+def test_joins_multiply(connection):
+    # sqlite keeps the order of cross joined tables, line is the outer loop
+    cost, _ = estimate_cost(
+        connection, "sqlite", "SELECT * FROM line CROSS JOIN token "
+                              "ON token.line_id = line.id WHERE line.speech_id LIKE ?",
+        ("%1%",))
+    assert cost == 200 + 200 * guard.DEFAULT_ROWS_PER_KEY
+
+
+def test_analyzed_tables_use_their_statistics(connection):
+    connection.execute("DELETE FROM token WHERE id NOT IN ('w1', 'w2')")
+    connection.execute("ANALYZE")
+    assert estimate_cost(connection, "sqlite", "SELECT * FROM token", ())[0] == 2
+
+
+def test_mariadb_statements_carry_their_timeout():
+    assert with_statement_timeout("SELECT 1", 2.5) == \
+        "SET STATEMENT max_statement_time=2.500000 FOR SELECT 1"
+
+
+###
+# views
+def test_expensive_query_is_rejected(database, make_app):
+    app = make_app(database, QUERY_COST_LIMIT=1)
+    response = app.test_client().post("/result/token", data={"query": "protevs"})
+    assert response.status_code == 200
+    assert response.headers["X-Query-Guard"] == "rejected; reason=cost"
+    rejected = app.extensions["rejected_queries"].to_dict()
+    assert rejected["total"] == 1
+    assert rejected["queries"][0]["endpoint"] == "result.token2"
+
+
+def test_query_stopping_early_passes_the_cost_limit(database, make_app):
+    app = make_app(database, QUERY_COST_LIMIT=1)
+    response = app.test_client().get("/query/act")
+    assert response.status_code == 200 and "X-Query-Guard" not in response.headers
+    assert app.extensions["rejected_queries"].to_dict()["total"] == 0
+
+
+def test_like_scan_isnt_exempted_by_its_limit(database, make_app):
+    client = make_app(database, QUERY_COST_LIMIT=5).test_client()
+    # a pattern found in no act scans all 6 of them
+    for query in ("ACT", "no such act"):
+        response = client.post("/result/act", data={"query": query})
+        assert response.headers["X-Query-Guard"] == "rejected; reason=cost"
+    client = make_app(database, QUERY_COST_LIMIT=6).test_client()
+    response = client.post("/result/act", data={"query": "ACT"})
+    assert "X-Query-Guard" not in response.headers
+    assert b"ACT 1" in response.data
+
+
+def test_slow_query_is_interrupted(database, make_app):
+    app = make_app(database, STATEMENT_TIMEOUT=0.0)
+    client = app.test_client()
+    response = client.get("/query/token")
+    assert response.status_code == 200
+    assert response.headers["X-Query-Guard"] == "rejected; reason=timeout"
+    # the deadline ends with the request, the pooled connection runs statements again
+    with app.app_context():
+        from app import db
+
+        assert db.session.execute(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+            "WHERE i < 100000) SELECT count(*) FROM n").scalar() == 100000
+
+
+def test_results_are_truncated_at_the_row_limit(database, make_app):
+    app = make_app(database, DEFAULT_ROW_LIMIT=3)
+    client = app.test_client()
+    response = client.post("/result/act", data={"query": "ACT"})
+    assert response.headers["X-Query-Guard"] == "truncated; limit=3"
+    assert response.data.split(b"<tbody>")[1].count(b"<tr>") == 3
+    response = client.post("/result/act", data={"query": "ACT 4"})
+    assert "X-Query-Guard" not in response.headers
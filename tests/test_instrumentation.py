@@ -0,0 +1,111 @@
+import logging
+import re
+import sqlite3
+import time
+
+from app import db, guard
+from app.instrumentation import RequestStats, _CountingCursor, percentiles
+
+
+def server_timing(response) -> dict:
+    """
+    Get the metrics of the Server-Timing header by name, as dicts of their parameters.
+    """
+    metrics = {}
+    for metric in response.headers["Server-Timing"].split(", "):
+        name, *parameters = metric.split(";")
+        metrics[name] = dict(parameter.split("=", 1) for parameter in parameters)
+    return metrics
+
+
+def count(description: str) -> int:
+    return int(re.fullmatch(r'"(\d+) \w+"', description).group(1))
+
+
+def test_counting_cursor_counts_fetched_rows():
+    connection = sqlite3.connect(":memory:")
+    stats = RequestStats()
+    query = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 10) " \
+            "SELECT i FROM n"
+    cursor = _CountingCursor(connection.execute(query), stats)
+    assert cursor.fetchone() == (1,)
+    assert len(cursor.fetchmany(3)) == 3
+    assert len(list(cursor)) == 6
+    assert cursor.fetchone() is None and cursor.fetchall() == []
+    assert stats.rows == 10
+    # everything else is passed on to the cursor
+    assert cursor.description[0][0] == "i"
+    connection.close()
+
+
+def test_percentiles_use_the_nearest_rank():
+    assert percentiles(range(1, 101)) == {"p50": 50, "p95": 95, "p99": 99}
+    assert percentiles([3.0]) == {"p50": 3.0, "p95": 3.0, "p99": 3.0}
+
+
+def test_server_timing_counts_statements_and_rows(client):
+    response = client.get("/api/act?depth=act")
+    metrics = server_timing(response)
+    assert set(metrics) == {"sql", "rows", "tpl", "total"}
+    assert float(metrics["sql"]["dur"]) <= float(metrics["total"]["dur"])
+    # the corpus registry (one corpus) and the 6 acts
+    assert count(metrics["rows"]["desc"]) == len(response.json) + 1 == 7
+    assert count(metrics["sql"]["desc"]) >= 2
+
+
+def test_server_timing_times_templates(client):
+    metrics = server_timing(client.get("/query/act"))
+    assert float(metrics["tpl"]["dur"]) > 0
+    assert float(metrics["tpl"]["dur"]) <= float(metrics["total"]["dur"])
+
+
+def test_cost_estimates_are_not_sql_time(client, monkeypatch):
+    estimate_cost = guard.estimate_cost
+
+    def slow_estimate(*args):
+        time.sleep(0.2)
+        return estimate_cost(*args)
+
+    monkeypatch.setattr(guard, "estimate_cost", slow_estimate)
+    metrics = server_timing(client.get("/query/act"))
+    assert float(metrics["total"]["dur"]) >= 200
+    assert float(metrics["sql"]["dur"]) < 200
+
+
+def test_rejected_statements_are_not_timed(client, monkeypatch):
+    monkeypatch.setattr(guard, "estimate_cost", lambda *args: (10 ** 9, False))
+    response = client.get("/query/act")
+    assert response.headers["X-Query-Guard"] == "rejected; reason=cost"
+    with client.application.app_context():
+        with db.engine.connect() as connection:
+            # no timer of the rejected statement was left on the pooled connection
+            assert not connection.info.get("query_started")
+
+
+def test_slow_statements_are_logged_with_their_plan(database, make_app, caplog):
+    client = make_app(database, SLOW_QUERY_MS=0).test_client()
+    with caplog.at_level(logging.WARNING):
+        client.get("/api/act?depth=act")
+    slow = [record.getMessage() for record in caplog.records
+            if record.getMessage().startswith("slow query on api.")]
+    assert any(".act.position" in message and re.search(r"plan:\n .*(SCAN|SEARCH)", message)
+               for message in slow)
+
+
+def test_fast_statements_are_not_logged(client, caplog):
+    with caplog.at_level(logging.WARNING):
+        client.get("/api/act?depth=act")
+    assert not any(record.getMessage().startswith("slow query")
+                   for record in caplog.records)
+
+
+def test_debug_stats_aggregate_the_requests(database, make_app):
+    client = make_app(database, DEBUG_STATS=True).test_client()
+    for _ in range(3):
+        client.get("/api/act?depth=act")
+    stats = client.get("/debug/stats").json
+    endpoint, = [name for name in stats if name.startswith("api.")]
+    assert stats[endpoint]["requests"] == 3
+    assert stats[endpoint]["rows"] == {"p50": 7, "p95": 7, "p99": 7}
+    assert set(stats[endpoint]) == {"requests", "total_ms", "sql_ms", "template_ms",
+                                    "statements", "rows"}
@@ -0,0 +1,90 @@
+import gc
+
+import pytest
+
+import config
+from app import create_app
+from app.memory import MODELS, SEARCH_COLUMNS, current_store
+from app.trigram import fuzzy_tokens
+
+
+@pytest.fixture(scope="module")
+def memory_app(database):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{database}")
+        monkeypatch.setattr(config, "IN_MEMORY", True)
+        yield create_app()
+    gc.unfreeze()
+
+
+@pytest.fixture
+def store(memory_app):
+    with memory_app.test_request_context():
+        memory_app.preprocess_request()
+        yield current_store()
+
+
+def ids(records) -> list:
+    return [record.id for record in records]
+
+
+def test_store_serves_the_read_blueprints(memory_app):
+    with memory_app.test_request_context("/api/act"):
+        memory_app.preprocess_request()
+        assert current_store().corpus.name == "default"
+    with memory_app.test_request_context("/search/cql"):
+        memory_app.preprocess_request()
+        assert current_store() is None
+
+
+@pytest.mark.parametrize("table, query", [
+    ("act", "ACT"), ("act", "act 3"), ("scene", "scene 1"), ("cast_role", "_tgv"),
+    ("speech", "proteus"), ("line", "sp-001"), ("cast_group", "45ec"), ("act", ""),
+    ("scene", "no such scene"),
+])
+def test_like_matches_the_database(app, store, table, query):
+    model = MODELS[table]
+    with app.test_request_context():
+        app.preprocess_request()
+        column = getattr(model, SEARCH_COLUMNS[table])
+        expected = model.query.filter(column.like(f"%{query}%")).all()
+    assert sorted(ids(store.like(table, query))) == sorted(ids(expected))
+
+
+@pytest.mark.parametrize("query, kinds", [
+    ("protevs", ("content", "lemma")), ("loue", ("content", "lemma")),
+    ("loue", ("lemma",)), ("my", ("content",)), ("zzzz", ("content", "lemma")),
+])
+def test_fuzzy_tokens_match_the_database(app, store, query, kinds):
+    with app.test_request_context():
+        app.preprocess_request()
+        expected = ids(fuzzy_tokens(query, kinds))
+    assert ids(store.fuzzy_tokens(query, kinds)) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "/api/act", "/api/act?depth=scene&fields[scene]=content",
+    "/api/scene?depth=speech&fields[speaker]=name",
+])
+def test_documents_match_the_database(memory_app, client, url):
+    assert memory_app.test_client().get(url).json == client.get(url).json
+
+
+def test_single_documents_match_the_database(memory_app, client):
+    scenes = client.get("/api/scene?depth=speech").json
+    speech = scenes[3]["speeches"][2]
+    for url in (f"/api/scene/{scenes[3]['id']}", f"/api/speech/{speech['id']}",
+                f"/api/speech/{speech['id']}?depth=speech", "/api/line/no-such-line"):
+        memory, database = memory_app.test_client().get(url), client.get(url)
+        assert memory.status_code == database.status_code
+        assert memory.json == database.json
+
+
+@pytest.mark.parametrize("params", [
+    {"q": "lo"}, {"q": "lov"}, {"q": "Pro", "kind": "cast"},
+    {"q": "s", "kind": "form,lemma", "limit": 20}, {"q": "th", "limit": 50},
+])
+def test_suggestions_match_the_database(memory_app, client, params):
+    memory = memory_app.test_client().get("/suggest", query_string=params).json
+    assert memory == client.get("/suggest", query_string=params).json
+    assert memory["suggestions"]
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from app import shards
+from app.corpus import resolve_corpus
+from app.models import Token
+from app.shards import ShardTimeout, fan_out, shard_session
+from app.trigram import fuzzy_forms
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+@pytest.mark.parametrize("query", ['[lemma="love"]', '[lemma="my"] []{0,2} [lemma="lady"]'])
+def test_fan_out_finds_the_matches_of_the_corpus(client, query):
+    unsharded = ndjson(client.get("/cql/", query_string={"q": query, "limit": 20}))[:-1]
+    sharded = client.get("/search/cql", query_string={"q": query, "limit": 20}).json
+    assert sharded["shards"] == 1 and not sharded["timed_out"] and not sharded["failed"]
+    assert [{key: value for key, value in match.items()
+             if key not in ("corpus", "corpus_id")} for match in sharded["results"]] == \
+        unsharded
+    assert {match["corpus"] for match in sharded["results"]} == {"default"}
+
+
+def test_fan_out_finds_the_forms_of_the_corpus(client, session):
+    expected = [(form.kind, form.form, distance)
+                for form, distance, _ in fuzzy_forms("loue", session=session)]
+    sharded = client.get("/search/forms", query_string={"q": "loue"}).json
+    assert [(match["kind"], match["form"], match["distance"])
+            for match in sharded["results"]] == expected
+
+
+def test_shard_statements_are_restricted_to_the_corpus(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with app.app_context():
+        corpus = resolve_corpus(None)
+        engine = shards._shard_engine(corpus)
+        sa.event.listen(engine, "before_cursor_execute", record)
+        try:
+            with shard_session(corpus, engine, timeout=5) as session:
+                session.query(Token).filter(Token.lemma == "love").first()
+        finally:
+            sa.event.remove(engine, "before_cursor_execute", record)
+    statement, parameters = statements[-1]
+    # the join keys and lookups of every corpus table start with corpus_id
+    assert "token.corpus_id = ?" in statement and corpus.id in parameters
+
+
+def test_slow_and_failing_shards_are_reported(app):
+    def slow(session, corpus):
+        raise ShardTimeout(corpus.name)
+
+    def failing(session, corpus):
+        raise ValueError("broken shard")
+
+    with app.test_request_context():
+        assert fan_out(slow, key=len, limit=5).timed_out == ["default"]
+        result = fan_out(failing, key=len, limit=5)
+        assert result.failed == ["default"] and result.results == []
+
+
+def test_expired_shards_are_interrupted(app):
+    def search(session, corpus):
+        return session.execute(sa.text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+            "SELECT count(*) FROM n")).all()
+
+    with app.test_request_context():
+        assert fan_out(search, key=len, limit=5, timeout=0.05).timed_out == ["default"]
+
+
+def test_unknown_corpora_have_no_shards(client):
+    result = client.get("/search/cql", query_string={"q": '[lemma="love"]',
+                                                     "corpus": "no-such-corpus"}).json
+    assert result == {"results": [], "shards": 0, "timed_out": [], "failed": []}
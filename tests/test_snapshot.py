@@ -0,0 +1,85 @@
+import importlib
+import os
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+import config
+from app import create_app, db
+from app.corpus import resolve_corpus
+
+from ingestion.sqlite_snapshot import SqliteSnapshot
+
+
+@pytest.fixture
+def snapshot(database, tmp_path) -> str:
+    # connectors open sqlite databases relative to the parent of the working directory
+    name = os.path.relpath(os.path.splitext(database)[0], os.path.dirname(os.getcwd()))
+    source = SqliteSnapshot(database=name)
+    corpus, = source.find_corpora("default")
+    path = str(tmp_path / "verona.snapshot.db")
+    source.build(path, corpus.id)
+    source.close()
+    return path
+
+
+@pytest.fixture
+def opened(monkeypatch) -> list:
+    """
+    Record the uris of the sqlite files opened with uri=True.
+    """
+    uris = []
+    connect = sqlite3.connect
+
+    def record(database, *args, **kwargs):
+        if kwargs.get("uri"):
+            uris.append(database)
+        return connect(database, *args, **kwargs)
+
+    monkeypatch.setattr(sqlite3, "connect", record)
+    return uris
+
+
+@pytest.fixture
+def snapshot_app(snapshot, client, monkeypatch):
+    """
+    App configured by TT_SNAPSHOT, created after the app of the client.
+    """
+    monkeypatch.setenv("TT_SNAPSHOT", snapshot)
+    monkeypatch.setenv("TT_IN_MEMORY", "0")
+    importlib.reload(config)
+    yield create_app()
+    monkeypatch.delenv("TT_SNAPSHOT")
+    # reloading keeps the names only set for snapshots
+    del config.SQLALCHEMY_ENGINE_OPTIONS
+    importlib.reload(config)
+
+
+def test_snapshot_is_read_only_and_complete(snapshot, database):
+    assert not os.access(snapshot, os.W_OK) or os.geteuid() == 0
+    assert not os.path.exists(f"{snapshot}.partial")
+    connection = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    tables = {name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"corpus", "token", "token_form", "sqlite_stat1"} <= tables
+    assert not any(name.endswith("_fts") for name in tables)
+    assert connection.execute("SELECT location FROM corpus").fetchall() == [(None,)]
+    assert connection.execute("SELECT count(*) FROM token").fetchone() == (12670,)
+    # rows are stored in document order
+    positions = [position for position, in connection.execute(
+        "SELECT position FROM token ORDER BY rowid")]
+    assert positions == sorted(positions)
+    connection.close()
+
+
+def test_webapp_serves_the_snapshot_immutable(opened, snapshot_app, snapshot, client):
+    assert snapshot_app.config["SQLALCHEMY_DATABASE_URI"] == f"sqlite:///{snapshot}"
+    with snapshot_app.app_context():
+        assert resolve_corpus(None).location is None
+        with pytest.raises(sa.exc.OperationalError, match="readonly"):
+            db.session.execute("CREATE TABLE scratch (id INTEGER)")
+    assert opened and set(opened) == {f"file:{snapshot}?mode=ro&immutable=1"}
+    served = snapshot_app.test_client()
+    for url in ("/api/act?depth=scene", "/cql/?q=[lemma%3D%22love%22]&limit=5"):
+        assert served.get(url).data == client.get(url).data
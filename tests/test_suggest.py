@@ -0,0 +1,208 @@
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+from app import db
+from app.models import CastItem, TokenForm
+from app.suggest import (MAX_LIMIT, PRECOMPUTED_LENGTH, PrefixIndex, Suggestion,
+                         SuggestCache, SuggestIndex, current_cache)
+
+
+def suggestion(text: str, weight: int, kind: str = "form") -> Suggestion:
+    return Suggestion(text, kind, weight, text)
+
+
+WORDS = [suggestion(text, weight) for text, weight in [
+    ("love", 40), ("Loue", 12), ("lover", 3), ("loves", 9), ("lady", 20), ("lo", 1),
+    ("sweet", 15), ("Silvia", 7), ("", 100)]]
+
+
+###
+# PrefixIndex
+def test_prefix_index_keeps_normalized_keys_sorted():
+    index = PrefixIndex(WORDS)
+    assert index.keys == sorted(index.keys)
+    # entries without text are left out
+    assert len(index) == len(WORDS) - 1
+    assert "loue" in index.keys and "Loue" not in index.keys
+
+
+@pytest.mark.parametrize("prefix", ["l", "lo", "lov", "love", "s", "si", "x", "lovers"])
+def test_prefix_index_completes_the_most_frequent(prefix):
+    index = PrefixIndex(WORDS)
+    expected = sorted((word for word in WORDS
+                       if word.text and word.text.lower().startswith(prefix)),
+                      key=lambda word: -word.weight)
+    assert index.complete(prefix, 3) == expected[:3]
+
+
+def test_precomputed_prefixes_match_the_range_search():
+    words = [suggestion(f"{a}{b}{c}", weight) for weight, (a, b, c) in enumerate(
+        (a, b, c) for a in "abc" for b in "abc" for c in "xyz")]
+    index = PrefixIndex(words)
+    for prefix in ("a", "ab", "c", "cb"):
+        assert len(prefix) <= PRECOMPUTED_LENGTH
+        assert prefix in index.top
+        assert index.complete(prefix, MAX_LIMIT) == sorted(
+            (word for word in words if word.text.startswith(prefix)),
+            key=lambda word: -word.weight)
+
+
+###
+# SuggestIndex
+def test_suggest_index_merges_kinds_and_drops_duplicates():
+    index = SuggestIndex(WORDS + [suggestion("love", 30, "lemma"),
+                                  suggestion("Launce", 25, "cast")])
+    assert [(s.text, s.kind) for s in index.suggest("l", limit=4)] == \
+        [("love", "form"), ("Launce", "cast"), ("lady", "form"), ("Loue", "form")]
+    assert [s.kind for s in index.suggest("lo", kinds=["lemma"])] == ["lemma"]
+
+
+@pytest.mark.parametrize("prefix, limit", [("", 10), ("  ", 10), ("lo", 0), ("lo", -3)])
+def test_suggest_index_ignores_empty_requests(prefix, limit):
+    assert SuggestIndex(WORDS).suggest(prefix, limit=limit) == []
+
+
+def test_suggest_index_caps_the_limit():
+    words = [suggestion(f"w{i:03d}", i) for i in range(200)]
+    assert len(SuggestIndex(words).suggest("w", limit=500)) == MAX_LIMIT
+
+
+###
+# SuggestCache
+def test_cache_keeps_the_most_recently_used_indexes():
+    cache = SuggestCache(size=2)
+    built = []
+
+    def build(corpus_id):
+        return lambda: built.append(corpus_id) or SuggestIndex([])
+
+    first = cache.get("a", build("a"))
+    cache.get("b", build("b"))
+    assert cache.get("a", build("a")) is first
+    cache.get("c", build("c"))
+    assert list(cache.indexes) == ["a", "c"]
+    cache.get("b", build("b"))
+    assert built == ["a", "b", "c", "b"]
+
+
+def test_other_corpora_are_served_while_an_index_is_built():
+    cache = SuggestCache()
+    cache.get("cached", lambda: SuggestIndex(WORDS))
+    started, release = threading.Event(), threading.Event()
+
+    def slow_build():
+        started.set()
+        assert release.wait(10)
+        return SuggestIndex([])
+
+    builds = []
+    slow = [threading.Thread(target=lambda: builds.append(cache.get("slow", slow_build)))
+            for _ in range(3)]
+    for thread in slow:
+        thread.start()
+    try:
+        assert started.wait(10)
+        assert cache.get("cached", pytest.fail).suggest("lov")
+        assert cache.get("other", lambda: SuggestIndex(WORDS)).suggest("lov")
+    finally:
+        release.set()
+        for thread in slow:
+            thread.join(10)
+    # the requests for the slow corpus waited for one build
+    assert len(builds) == 3 and all(index is builds[0] for index in builds)
+    assert cache.building == {}
+
+
+def test_failed_builds_are_retried():
+    cache = SuggestCache()
+
+    def failing():
+        raise sa.exc.OperationalError("SELECT", (), Exception("locked"))
+
+    with pytest.raises(sa.exc.OperationalError):
+        cache.get("a", failing)
+    assert cache.building == {} and "a" not in cache.indexes
+    assert cache.get("a", lambda: SuggestIndex(WORDS)).suggest("lo")
+
+
+###
+# /suggest
+def suggest(client, **params):
+    response = client.get("/suggest", query_string=params)
+    return response.status_code, response.json
+
+
+def test_suggestions_are_the_most_frequent_forms(client, session):
+    forms = session.execute(
+        sa.select(TokenForm.form, TokenForm.frequency)
+        .where(TokenForm.kind == "content", TokenForm.form.like("lo%"))
+        .order_by(TokenForm.frequency.desc())).all()
+    status, result = suggest(client, q="lo", kind="form", limit=5)
+    assert status == 200
+    assert [(s["text"], s["weight"]) for s in result["suggestions"]] == \
+        [tuple(form) for form in forms[:5]]
+    assert all(s["value"] == s["text"] and s["kind"] == "form"
+               for s in result["suggestions"])
+
+
+def test_cast_suggestions_search_for_the_cast_item(client, session):
+    names = dict(session.execute(sa.select(CastItem.id, CastItem.name)).all())
+    status, result = suggest(client, q="pro", kind="cast")
+    assert status == 200 and result["suggestions"]
+    for found in result["suggestions"]:
+        # cast items without name are suggested by their id
+        assert found["kind"] == "cast"
+        assert found["text"] == (names[found["value"]] or found["value"])
+
+
+@pytest.mark.parametrize("kind", ["form,lemma", ["form", "lemma"]])
+def test_kinds_can_be_combined(client, kind):
+    status, result = suggest(client, q="lo", kind=kind, limit=20)
+    assert status == 200
+    assert {s["kind"] for s in result["suggestions"]} <= {"form", "lemma"}
+    texts = [s["text"] for s in result["suggestions"]]
+    assert len(texts) == len(set(texts))
+
+
+def test_limits(client):
+    assert len(suggest(client, q="s")[1]["suggestions"]) == 10
+    assert len(suggest(client, q="s", limit=3)[1]["suggestions"]) == 3
+    assert len(suggest(client, q="s", limit=1000)[1]["suggestions"]) == MAX_LIMIT
+    assert suggest(client, q="s", limit=0)[1]["suggestions"] == []
+    assert suggest(client, q="")[1]["suggestions"] == []
+
+
+def test_unknown_kinds_are_rejected(client):
+    status, result = suggest(client, q="lo", kind="form,speech")
+    assert status == 400 and "speech" in result["error"]
+
+
+def test_corpus_is_resolved_like_the_other_pages(app, client):
+    default = suggest(client, q="lo")[1]
+    assert suggest(client, q="lo", corpus="default")[1] == default
+    with app.app_context():
+        corpus_id = db.session.execute(sa.text("SELECT id FROM corpus")).scalar()
+    assert suggest(client, q="lo", corpus=corpus_id)[1] == default
+    assert client.get("/suggest", query_string={"q": "lo", "corpus": "none"}) \
+        .status_code == 404
+
+
+def test_cached_indexes_dont_touch_the_corpus(app, client):
+    suggest(client, q="lo")
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        sa.event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            assert suggest(client, q="lov")[1]["suggestions"]
+            assert len(current_cache().indexes) == 1
+        finally:
+            sa.event.remove(db.engine, "before_cursor_execute", record)
+    # only the corpus registry is read to resolve the corpus
+    assert statements and all("FROM corpus" in statement and "ATTACH" not in statement
+                              for statement in statements)
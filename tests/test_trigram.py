@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.trigram import default_max_distance, fuzzy_forms, fuzzy_tokens, levenshtein, \
+    normalize_form, trigrams, verify_forms
+
+
+def form(text: str, frequency: int = 1):
+    return SimpleNamespace(form=text, frequency=frequency,
+                           trigram_count=len(trigrams(text)))
+
+
+def test_trigrams_are_blank_padded():
+    assert trigrams("love") == {"  l", " lo", "lov", "ove", "ve "}
+
+
+@pytest.mark.parametrize("a, b, distance", [
+    ("love", "love", 0),
+    ("loue", "love", 1),
+    ("love", "loved", 1),
+    ("protevs", "proteus", 1),
+    ("heart", "hart", 1),
+    ("sweet", "swete", 2),
+])
+def test_levenshtein(a, b, distance):
+    assert levenshtein(a, b, 2) == distance
+
+
+def test_levenshtein_gives_up_past_max_distance():
+    assert levenshtein("love", "lady", 1) == 2
+    assert levenshtein("a", "abcdef", 2) == 3
+
+
+def test_default_max_distance_grows_with_the_form():
+    assert [default_max_distance(text) for text in ("my", "love", "proteus")] == [0, 1, 2]
+
+
+def test_verify_forms_ranks_by_distance_and_frequency():
+    query = normalize_form(" Loue ")
+    query_trigrams = trigrams(query)
+    candidates = [form("love", 172), form("lout", 1), form("lady", 50), form("loue", 2)]
+    matches = verify_forms(query, query_trigrams,
+                           ((candidate, len(query_trigrams & trigrams(candidate.form)))
+                            for candidate in candidates), 1, 10)
+    assert [(match.form, distance) for match, distance, _ in matches] == \
+        [("loue", 0), ("love", 1), ("lout", 1)]
+    assert matches[0][2] == 1.0
+
+
+def test_verify_forms_breaks_ties_by_similarity():
+    candidates = [(form("lovers", 3), 3), (form("lover", 3), 4)]
+    matches = verify_forms("loved", trigrams("loved"), candidates, 2, 10)
+    assert [match.form for match, _, _ in matches] == ["lover", "lovers"]
+
+
+def test_verify_forms_limit():
+    candidates = [(form(text), 1) for text in ("lova", "lovb", "lovc")]
+    assert len(verify_forms("love", trigrams("love"), candidates, 1, 2)) == 2
+
+
+def test_fuzzy_forms_finds_spelling_variants(session):
+    matches = fuzzy_forms("protevs", session=session)
+    assert {(match.form, match.kind) for match, _, _ in matches[:2]} == \
+        {("proteus", "lemma"), ("proteus", "content")}
+    assert all(distance <= 2 for _, distance, _ in matches)
+
+
+def test_fuzzy_forms_respects_kinds_and_max_distance(session):
+    matches = fuzzy_forms("loue", kinds=("lemma",), session=session)
+    assert {match.kind for match, _, _ in matches} == {"lemma"}
+    assert "love" in {match.form for match, _, _ in matches}
+    exact = fuzzy_forms("love", max_distance=0, session=session)
+    assert {match.form for match, _, _ in exact} == {"love"}
+
+
+@pytest.mark.parametrize("query", [None, "", "   "])
+def test_fuzzy_forms_without_query(session, query):
+    assert fuzzy_forms(query, session=session) == []
+
+
+def test_fuzzy_tokens_follow_the_postings(session):
+    tokens = fuzzy_tokens("protevs", limit=20)
+    assert 0 < len(tokens) <= 20
+    assert {normalize_form(token.lemma) for token in tokens[:5]} == {"proteus"}
+
+
+def test_token_results_without_query(client):
+    response = client.post("/result/token")
+    assert response.status_code == 200
+
+
+def test_token_results_find_variants(client):
+    response = client.post("/result/token", data={"query": "protevs"})
+    assert response.status_code == 200
+    assert b"Proteus" in response.data
+
+
+def test_frequent_variants_come_first(session):
+    matches = fuzzy_forms("loue", kinds=("content",), session=session)
+    forms = [match.form for match, _, _ in matches]
+    assert forms.index("love") < forms.index("lout")
+    assert matches[0][0].frequency == max(match.frequency for match, distance, _ in matches
+                                          if distance == matches[0][1])